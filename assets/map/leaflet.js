@@ -0,0 +1,111 @@
+// Functions used by the leaflet renderer of the map (see src/map/map.py)
+window.rsdb = Object.assign({}, window.rsdb, {
+    map: {
+        // Style flight tracks with the color set in the feature properties
+        trackStyle: function(feature) {
+            if (feature.geometry.type === "Polygon") { // Density grid cells
+                return {color: feature.properties.color, weight: 0, fillOpacity: 0.6};
+            }
+            return {color: feature.properties.color};
+        },
+
+        // Draw POI dots as circle markers instead of default markers
+        pointToLayer: function(feature, latlng) {
+            return L.circleMarker(latlng, {
+                radius: feature.properties.radius,
+                color: feature.properties.color,
+                weight: 3,
+                fill: true,
+                fillOpacity: 1,
+                opacity: 1
+            });
+        },
+
+        // Show tooltips and open the flight page when clicking a track
+        onEachTrack: function(feature, layer) {
+            if (feature.properties.tooltip) {
+                layer.bindTooltip(feature.properties.tooltip);
+            }
+            if (feature.properties.serial) {
+                layer.on("click", function() {
+                    rsdb.map.openFlight(feature.properties.serial);
+                });
+            }
+        },
+
+        // Open the flight page without reloading, so the map keeps its search results
+        openFlight: function(serial) {
+            window.history.pushState({}, "", "/flight/" + encodeURIComponent(serial));
+            window.dispatchEvent(new CustomEvent("_dashprivate_pushstate")); // Notify dcc.Location of the new path
+        }
+    }
+});
+
+// Clientside callbacks of the leaflet renderer
+var searchPagesLoad = 0; // Incremented for every search, so loading pages of older searches stops
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    rsdb_map: {
+        // Load further pages of search results as additional layers after the first page is shown
+        loadPages: function(searchPages) {
+            var load = ++searchPagesLoad;
+            if (!searchPages || searchPages.after === null) {
+                return [];
+            }
+
+            var start = Date.now();
+            var layers = [];
+            var count = searchPages.count;
+            var after = searchPages.after;
+            (async function() {
+                while (after !== null) {
+                    var params = new URLSearchParams(searchPages.query);
+                    params.set("after", after);
+                    params.set("count", count);
+                    params.set("session", searchPages.session);
+
+                    var response = await fetch("/search/page?" + params.toString());
+                    if (!response.ok) {
+                        console.error("Failed to load page of search results: " + response.status);
+                        if (response.status === 503 && load === searchPagesLoad) { // Out of time or server busy, show why loading stopped
+                            dash_clientside.set_props("flight_count", {children: await response.text()});
+                        }
+                        return;
+                    }
+                    var page = await response.json();
+                    if (load !== searchPagesLoad) { // A new search was started in the meantime
+                        return;
+                    }
+
+                    count += page.count;
+                    after = page.after;
+                    layers = layers.concat([{
+                        namespace: "dash_leaflet",
+                        type: "GeoJSON",
+                        props: {
+                            data: page.tracks,
+                            style: {variable: "rsdb.map.trackStyle"},
+                            pointToLayer: {variable: "rsdb.map.pointToLayer"},
+                            onEachFeature: {variable: "rsdb.map.onEachTrack"}
+                        }
+                    }]);
+
+                    var elapsed = (searchPages.elapsed + (Date.now() - start) / 1000).toFixed(1);
+                    var text = "(" + elapsed + "s) Showing " + count + " flights" + (after === null ? "" : ", loading more...");
+                    dash_clientside.set_props("tracks_pages", {children: layers});
+                    dash_clientside.set_props("flight_count", {children: text});
+                }
+            })();
+
+            return [];
+        },
+
+        // Show live sondes in the live layer
+        connectLive: function(id) {
+            rsdb.live.connect(function(data) {
+                dash_clientside.set_props("live_layer", {data: data});
+            });
+
+            return dash_clientside.no_update;
+        }
+    }
+});
@@ -0,0 +1,96 @@
+// Live view of sondes currently tracked by the archiver, used by both map renderers (see src/map/live.py)
+window.rsdb = window.rsdb || {};
+window.rsdb.live = {
+    color: "#ff3b30",
+    updateInterval: 250, // Minimum milliseconds between map updates
+
+    layerOptions: {
+        style: function(feature) {
+            return {color: feature.properties.color};
+        },
+        pointToLayer: function(feature, latlng) {
+            return L.circleMarker(latlng, {
+                radius: feature.properties.radius,
+                color: feature.properties.color,
+                weight: 3,
+                fill: true,
+                fillOpacity: 1,
+                opacity: 1
+            });
+        },
+        onEachFeature: function(feature, layer) {
+            layer.bindTooltip(feature.properties.tooltip);
+        }
+    },
+
+    // Create GeoJSON with a trail and the latest position of every live sonde
+    makeGeoJSON: function(flights) {
+        var features = [];
+        for (var serial in flights) {
+            var flight = flights[serial];
+            var trail = flight.trail;
+            if (trail.length === 0) {
+                continue;
+            }
+            var latest = trail[trail.length - 1];
+
+            if (trail.length > 1) {
+                features.push({
+                    type: "Feature",
+                    geometry: {type: "LineString", coordinates: trail.map(function(point) { return [point[1], point[0]]; })},
+                    properties: {color: rsdb.live.color, tooltip: serial + " (" + flight.sonde_type + ")"}
+                });
+            }
+            features.push({
+                type: "Feature",
+                geometry: {type: "Point", coordinates: [latest[1], latest[0]]},
+                properties: {
+                    color: rsdb.live.color,
+                    radius: 5,
+                    tooltip: serial + " (" + flight.sonde_type + ") @ " + latest[2] + "m on " + new Date(latest[3] * 1000).toLocaleString()
+                }
+            });
+        }
+
+        return {type: "FeatureCollection", features: features};
+    },
+
+    // Connect to the live event stream and call onUpdate with new GeoJSON whenever live sondes change
+    connect: function(onUpdate) {
+        var flights = {};
+        var trailLength = 0;
+        var timeout = null;
+        var update = function() {
+            if (timeout === null) {
+                timeout = setTimeout(function() {
+                    timeout = null;
+                    onUpdate(rsdb.live.makeGeoJSON(flights));
+                }, rsdb.live.updateInterval);
+            }
+        };
+
+        var source = new EventSource("/live");
+        source.addEventListener("reset", function(event) { // Sent on every (re)connect before the current state
+            flights = {};
+            trailLength = JSON.parse(event.data).trail_length;
+            update();
+        });
+        source.onmessage = function(event) {
+            var message = JSON.parse(event.data);
+            if (message.event === "reset") {
+                flights = {};
+            } else if (message.event === "flight") {
+                flights[message.serial] = {sonde_type: message.sonde_type, trail: message.trail};
+            } else if (message.event === "point") {
+                var flight = flights[message.serial];
+                if (flight === undefined) {
+                    flight = flights[message.serial] = {sonde_type: message.sonde_type, trail: []};
+                }
+                flight.trail = flight.trail.concat([message.point]).slice(-trailLength);
+            } else if (message.event === "remove") {
+                delete flights[message.serial];
+            }
+            update();
+        };
+    }
+};
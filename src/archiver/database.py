@@ -1,14 +1,19 @@
 import logging
-from typing import Dict
+from typing import Dict, List, Optional
 
-import geopy.distance
 import mariadb
 
 import src.rsdb as rsdb
 
 
-def add_to_meta(cursor: mariadb.Cursor, first_packet: rsdb.Packet, burst_packet: None | rsdb.Packet, latest_packet: rsdb.Packet, frame_count: int):
-    """Add a flight to the metadata table by its first packet, last packet and optionally burst packet"""
+def add_to_meta(cursor: mariadb.Cursor, first_packet: rsdb.Packet, burst_packet: None | rsdb.Packet, latest_packet: rsdb.Packet, frame_count: int,
+                flight_range: Optional[rsdb.flight.RangeTracker] = None, metrics: Optional[Dict[str, float | None]] = None,
+                launch_site: Optional[str] = None):
+    """
+    Add a flight to the metadata table by its first packet, last packet, optionally burst packet,
+    optionally its range from the station, optionally its derived metrics (see rsdb.flight.derive_metrics)
+    and optionally the launch site it was attributed to
+    """
 
     logging.info(f"Adding sonde '{first_packet.serial}' to meta table")
 
@@ -31,16 +36,35 @@ def add_to_meta(cursor: mariadb.Cursor, first_packet: rsdb.Packet, burst_packet:
         burst_lon = burst_packet.longitude
         burst_alt = burst_packet.altitude
 
+    # Set range statistics to none if the station location isn't known
+    first_rx_range = last_rx_range = last_rx_bearing = max_range = max_range_bearing = max_range_alt = None
+    if flight_range is not None and flight_range.first is not None:
+        assert flight_range.last is not None and flight_range.max is not None # should never fail
+        first_rx_range = flight_range.first[0]
+        last_rx_range, last_rx_bearing = flight_range.last[0], flight_range.last[1]
+        max_range, max_range_bearing, max_range_alt = flight_range.max
+
+    if metrics is None:
+        metrics = {}
+    metric_values = [metrics.get(metric) for metric in rsdb.flight.DERIVED_METRICS]
+
     # Round frequency
     frequency = None if latest_packet.frequency is None else round(latest_packet.frequency, 2)
 
-    # Insert into DB
-    cursor.execute("INSERT INTO meta VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+    # Insert into DB. Columns are listed, as more columns may be added to existing databases later.
+    cursor.execute("INSERT INTO meta (serial, sonde_type, subtype, frame_count, " \
+                   "has_humidity, has_pressure, has_battery, has_burst_timer, has_xdata, frequency, " \
+                   "first_rx_time, first_rx_lat, first_rx_lon, first_rx_alt, last_rx_time, last_rx_lat, last_rx_lon, last_rx_alt, " \
+                   "burst_time, burst_lat, burst_lon, burst_alt, rs41_mainboard, rs41_firmware, " \
+                   "first_rx_range, last_rx_range, last_rx_bearing, max_range, max_range_bearing, max_range_alt, launch_site, " \
+                   f"{', '.join(rsdb.flight.DERIVED_METRICS)}) " \
+                   f"VALUES ({', '.join(['?'] * (31 + len(rsdb.flight.DERIVED_METRICS)))});",
                    (first_packet.serial, latest_packet.type, latest_packet.subtype, frame_count,
                     has_humidity, has_pressure, has_battery, has_burst_timer, has_xdata, frequency,
                     first_packet.datetime, first_packet.latitude, first_packet.longitude, first_packet.altitude,
                     latest_packet.datetime, latest_packet.latitude, latest_packet.longitude, latest_packet.altitude,
-                    burst_time, burst_lat, burst_lon, burst_alt, latest_packet.rs41_mainboard, latest_packet.rs41_mainboard_fw,))
+                    burst_time, burst_lat, burst_lon, burst_alt, latest_packet.rs41_mainboard, latest_packet.rs41_mainboard_fw,
+                    first_rx_range, last_rx_range, last_rx_bearing, max_range, max_range_bearing, max_range_alt, launch_site, *metric_values,))
     
 def add_to_tracking(cursor: mariadb.Cursor, packet: rsdb.Packet):
     """Add a packet to the tracking table"""
@@ -51,6 +75,15 @@ def add_to_tracking(cursor: mariadb.Cursor, packet: rsdb.Packet):
                     packet.altitude, packet.temperature, packet.humidity, packet.pressure, packet.speed, 
                     packet.battery, packet.burst_timer, packet.xdata,))
 
+def add_packets_to_tracking(cursor: mariadb.Cursor, packets: List[rsdb.Packet]):
+    """Add multiple packets to the tracking table in one batch"""
+
+    logging.debug(f"Adding {len(packets)} packets to tracking table")
+    cursor.executemany("INSERT INTO tracking VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                       [(packet.serial, packet.frame, packet.datetime, packet.latitude, packet.longitude,
+                         packet.altitude, packet.temperature, packet.humidity, packet.pressure, packet.speed,
+                         packet.battery, packet.burst_timer, packet.xdata,) for packet in packets])
+
 def wipe_flight(cursor: mariadb.Cursor, serial: str):
     """Wipe a sonde flight from the tracking table"""
 
@@ -71,7 +104,7 @@ def find_burst_point(cursor: mariadb.Cursor, serial: str) -> rsdb.Packet | None:
     # Try to get next and previous frame to ensure it is actually a burst
     cursor.execute("SELECT altitude FROM tracking WHERE serial = ? AND frame < ? AND altitude < ? ORDER BY frame DESC LIMIT 1;", (serial, data[0], data[3],))
     previous = cursor.fetchone()
-    cursor.execute("SELECT altitude FROM tracking WHERE serial = ? AND frame < ? AND altitude < ? ORDER BY frame ASC LIMIT 1;", (serial, data[0], data[3],))
+    cursor.execute("SELECT altitude FROM tracking WHERE serial = ? AND frame > ? AND altitude < ? ORDER BY frame ASC LIMIT 1;", (serial, data[0], data[3],))
     next = cursor.fetchone()
 
     if (previous is None) or (next is None):
@@ -93,58 +126,25 @@ def find_burst_point(cursor: mariadb.Cursor, serial: str) -> rsdb.Packet | None:
 
     return packet
 
-def calculate_speed_values(cursor: mariadb.Cursor, serial: str):
-    """Calculate missing speed for packets where it's not present for specified flight"""
+def calculate_derived_values(cursor: mariadb.Cursor, serial: str) -> Dict[str, float | None]:
+    """
+    Calculate missing speed for packets where it's not present for specified flight,
+    and the derived metrics of the flight (see rsdb.flight.derive_metrics) with the same data
+    """
 
-    logging.info(f"Calculating missing speed values for flight '{serial}'")
+    logging.info(f"Calculating missing speed values and metrics for flight '{serial}'")
 
-    # Get all fackets from flight
-    cursor.execute("SELECT frame, speed, latitude, longitude, time " \
+    # Get all packets from flight
+    cursor.execute("SELECT frame, speed, latitude, longitude, time, altitude, temperature " \
                    "FROM tracking WHERE serial = ? ORDER BY frame;",
                     (serial,))
     packets = cursor.fetchall()
 
     # Calculate new speed values
-    updated_values: Dict[int, float] = {} # List with frame numbers and updated speed
-    for i, packet in enumerate(packets):
-        if packet[1] is not None: # Skip packets that already have a speed value
-            continue
-
-        if i == 0: # First packet
-            next_packet = packets[i+1]
-
-            lat1 = packet[2]
-            lon1 = packet[3]
-            lat2 = next_packet[2]
-            lon2 = next_packet[3]
-
-            time_diff = (next_packet[4] - packet[4]).total_seconds()
-        elif i == (len(packets)-1): # Last packet
-            prev_packet = packets[i-1]
-
-            lat1 = packet[2]
-            lon1 = packet[3]
-            lat2 = prev_packet[2]
-            lon2 = prev_packet[3]
-
-            time_diff = (packet[4] - prev_packet[4]).total_seconds()
-        else: # Other packets
-            prev_packet = packets[i-1]
-            next_packet = packets[i+1]
-
-            lat1 = prev_packet[2]
-            lon1 = prev_packet[3]
-            lat2 = prev_packet[2]
-            lon2 = prev_packet[3]
-
-            time_diff = (next_packet[4] - prev_packet[4]).total_seconds()
-
-        # Calculate speed
-        distance = geopy.distance.geodesic((lat1, lon1), (lat2, lon2)).meters
-        speed = distance / time_diff
-
-        # Add new speed to dict
-        updated_values[packet[0]] = round(speed, 1)
+    new_speeds: Dict[int, float] = {}
+    if len(packets) > 1:
+        new_speeds = rsdb.flight.calculate_missing_speeds([packet[1:5] for packet in packets])
+    updated_values: Dict[int, float] = {packets[i][0]: speed for i, speed in new_speeds.items()} # Dict with frame numbers and updated speed
 
     if updated_values == {}: # If theres nothing to be done, log and return
         logging.info(f"All speed values in flight '{serial}' are already present")
@@ -154,3 +154,7 @@ def calculate_speed_values(cursor: mariadb.Cursor, serial: str):
     # Update values in DB
     for frame, new_speed in updated_values.items():
         cursor.execute("UPDATE tracking SET speed = ? WHERE serial = ? AND frame = ?", (new_speed, serial, frame,))
+
+    # Calculate metrics with the updated speed values
+    return rsdb.flight.derive_metrics([(packet[4], packet[5], new_speeds.get(i, packet[1]), packet[6])
+                                       for i, packet in enumerate(packets)])
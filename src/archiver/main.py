@@ -1,11 +1,13 @@
 import logging
 import socket
+import time
 import traceback
 
 import src.rsdb as rsdb
 
 from . import tracking
 
+PRUNE_INTERVAL = 3600 # Seconds between deleting old changes from the changes feed
 
 def main():
     rsdb.logging.set_up_logging("rsdb-archiver") # Set up logging
@@ -26,6 +28,17 @@ def main():
     # Connect to DB
     database = rsdb.database.connect(config)
 
+    # If enabled, collect range statistics from the receiving station
+    if config["station"]["enabled"]:
+        tracking.station = (config["station"]["latitude"], config["station"]["longitude"])
+
+    # Attribute flights to launch sites, if there are any in launchsites.txt
+    tracking.launchsite_index = rsdb.launchsites.create_index(config)
+
+    # If enabled, publish live data of tracked sondes
+    if config["live"]["enabled"]:
+        tracking.live_publisher = rsdb.live.LivePublisher(config["live"]["socket_dir"], config["live"]["trail_length"])
+
     # Set up main listener
     logging.info(f"Starting AutoRX UDP listener on {config['autorx']['host']}:{config['autorx']['port']}")
     udp_socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
@@ -38,6 +51,7 @@ def main():
 
     # Start listening and enter main loop
     udp_socket.bind((config["autorx"]["host"], config["autorx"]["port"]))
+    last_prune = 0.0
     try:
         while True:
             try: # Got data, update sondes and timeouts
@@ -51,6 +65,13 @@ def main():
             except socket.timeout: # No data from AutoRX, only update timeouts
                 tracking.update_timeouts()
 
+            # Delete old changes from the changes feed every hour
+            if time.monotonic() - last_prune >= PRUNE_INTERVAL:
+                cursor = database.cursor()
+                rsdb.changes.prune(cursor, config["changes"]["keep_days"])
+                cursor.close()
+                last_prune = time.monotonic()
+
             database.commit()
     except KeyboardInterrupt:
         logging.info("Got keyboard interrupt, shutting down..")
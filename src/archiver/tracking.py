@@ -1,9 +1,8 @@
 import logging
 import traceback
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Dict, Optional
 
-import geopy.distance
 import mariadb
 
 import src.rsdb as rsdb
@@ -27,6 +26,9 @@ class SondeTracker():
         self.first_packet: rsdb.Packet
         self.burst_packet: None | rsdb.Packet = None
 
+        # Range statistics are collected while receiving, if the station location is known
+        self.flight_range = None if station is None else rsdb.flight.RangeTracker(station)
+
     def close(self):
         """Close tracker specific cursor and remove self from tracked list"""
 
@@ -34,6 +36,9 @@ class SondeTracker():
         self.cursor.close()
         tracked_sondes.pop(self.sonde_serial)
 
+        if live_publisher is not None:
+            live_publisher.publish_remove(self.sonde_serial)
+
     def update_timeout(self):
         """Update timeout to terminate if necessary"""
 
@@ -47,18 +52,25 @@ class SondeTracker():
             if self.total_frames < self.min_frames:
                 logging.info(f"Sonde '{self.sonde_serial}' has not reached the minimum amount of frames, deleting data")
                 database.wipe_flight(self.cursor, self.sonde_serial)
+                rsdb.changes.record(self.cursor, rsdb.changes.WIPED, [self.sonde_serial])
                 self.close()
                 return
             
-            # Calculate missing speed values
-            if self.total_frames > 1:
-                database.calculate_speed_values(self.cursor, self.sonde_serial)
+            # Calculate missing speed values and derived metrics
+            metrics = database.calculate_derived_values(self.cursor, self.sonde_serial)
 
             # Get burst point
             self.burst_packet = database.find_burst_point(self.cursor, self.sonde_serial)
 
+            # Attribute flight to the nearest launch site of its first received position
+            launch_site = None
+            if launchsite_index is not None:
+                launch_site = launchsite_index.attribute(self.first_packet.latitude, self.first_packet.longitude)
+
             # Add to meta table
-            database.add_to_meta(self.cursor, self.first_packet, self.burst_packet, self.latest_packet, self.total_frames)
+            database.add_to_meta(self.cursor, self.first_packet, self.burst_packet, self.latest_packet, self.total_frames,
+                                 self.flight_range, metrics, launch_site)
+            rsdb.changes.record(self.cursor, rsdb.changes.FINALIZED, [self.sonde_serial])
 
             self.close()
 
@@ -75,11 +87,8 @@ class SondeTracker():
 
         # Filter packets by velocity (>300m/s shouldn't be possible without a broken packet)
         if packet != self.first_packet:
-            prev_position = (self.latest_packet.latitude, self.latest_packet.longitude)
-            position = (packet.latitude, packet.longitude)
-            distance = geopy.distance.geodesic(prev_position, position).meters
-            velocity = distance / last_packet_time_delta # type: ignore
-            if velocity > 300:
+            velocity = rsdb.flight.packet_velocity(self.latest_packet, packet)
+            if velocity > rsdb.flight.MAX_VELOCITY:
                 logging.info(f"Discarded invalid packet from sonde '{self.sonde_serial}' (velocity {round(velocity, 1)} m/s)")
                 return
 
@@ -89,8 +98,16 @@ class SondeTracker():
         # Increment frame counter and set latest packet
         self.total_frames += 1
         self.latest_packet = packet
+        if self.flight_range is not None:
+            self.flight_range.add(packet)
+
+        if live_publisher is not None:
+            live_publisher.publish_packet(packet)
 
 tracked_sondes: Dict[str, SondeTracker] = {} # Dict to store currently tracked sondes by their serials with the corresponding handler
+live_publisher: Optional[rsdb.live.LivePublisher] = None # Publishes live data of tracked sondes if enabled
+station: Optional[rsdb.flight.station_type] = None # Location of the receiving station for range statistics if enabled
+launchsite_index: Optional[rsdb.launchsites.LaunchsiteIndex] = None # Attributes flights to launch sites if there are any
 
 def process_packet(packet: rsdb.Packet, db_conn: mariadb.Connection, min_frames: int, rx_timeout_seconds: int, min_frame_spacing: int):
     """Process packet from AutoRX by passing it to sonde specific handlers"""
@@ -98,24 +115,8 @@ def process_packet(packet: rsdb.Packet, db_conn: mariadb.Connection, min_frames:
     # Set packet datetime using date from RTC and time from UDP packet
     packet.datetime = datetime.now(timezone.utc)
     
-    # Remove type prefix from serial (to match sondehub's serial format)
-    if packet.serial[:3] == "DFM":
-        packet.serial = packet.serial[4:]
-    elif packet.serial[:4] == "IMET":
-        packet.serial = packet.serial[5:]
-    elif packet.serial[:3] == "M10":
-        packet.serial = packet.serial[4:]
-    elif packet.serial[:3] == "M20":
-        packet.serial = packet.serial[4:]
-    # TODO: are there more of these?
-
-    # Remove suffix from main type
-    if packet.type is not None: # theoretically shouldn't happen but who knows
-        if packet.type[-4:] == "-SGP":
-            packet.type = packet.type[:-4]
-        elif packet.type[-3:] == "-SG":
-            packet.type = packet.type[:-3]
-        # TODO: are there more of these?
+    # Remove type prefix from serial and suffix from type (to match sondehub's format)
+    packet.normalize()
 
     # Check if sonde is already being tracked
     if packet.serial not in tracked_sondes: # If no, do checks and add to tracked list
@@ -136,6 +137,7 @@ def process_packet(packet: rsdb.Packet, db_conn: mariadb.Connection, min_frames:
         tracker.first_packet = packet
         tracker.latest_packet = packet
         tracked_sondes[packet.serial] = tracker
+        rsdb.changes.record(cursor, rsdb.changes.STARTED, [packet.serial])
 
         logging.info(f"Added new sonde '{packet.serial}' to tracker list. Tracked list is now: {list(tracked_sondes.keys())}")
 
@@ -151,7 +153,10 @@ def process_packet(packet: rsdb.Packet, db_conn: mariadb.Connection, min_frames:
             pass
 
 def update_timeouts():
-    """Update all sonde trackers timeouts"""
+    """Update all sonde trackers timeouts, and check for new live data subscribers"""
+
+    if live_publisher is not None:
+        live_publisher.poll()
 
     serials = list(tracked_sondes.keys()).copy()
     for serial in serials:
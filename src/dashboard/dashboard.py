@@ -1,71 +1,213 @@
 import logging
-from typing import Any, Dict
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
 
 import dash_bootstrap_components as dbc
 import mariadb
-from dash import dcc, html
+import plotly.graph_objects as go
+from dash import Input, Output, dcc, html
 
 import src.rsdb as rsdb
 from src.rsdb.web import COLORS
 
-from . import database, graphs
+from . import database, figure_cache, graphs, window
 
+SLOW_ENTRY_TIME = 2 # Seconds after which creating a graph is logged on info level instead of debug
 
-def get_graph_from_name(graph_name: str, cursor: mariadb.Cursor) -> graphs.DashboardGraph:
-    """Get a graph class from a graph name. Requires a cursor to initialize the graph class with."""
+def get_graph_from_name(graph_name: str, cursor: mariadb.Cursor, time_window: window.TimeWindow) -> graphs.DashboardGraph:
+    """Get a graph class from a graph name. Requires a cursor and the time window to show to initialize the graph class with."""
 
     if graph_name == "week_sonde_count":
-        return graphs.WeekSondeCount(COLORS, cursor)
+        return graphs.WeekSondeCount(COLORS, cursor, time_window)
     elif graph_name == "sonde_types":
-        return graphs.SondeTypes(COLORS, cursor)
+        return graphs.SondeTypes(COLORS, cursor, time_window)
     elif graph_name == "week_burst_altitudes":
-        return graphs.WeekBurstAltitudes(COLORS, cursor)
+        return graphs.WeekBurstAltitudes(COLORS, cursor, time_window)
     elif graph_name == "week_frame_count":
-        return graphs.WeekFrameCount(COLORS, cursor)
+        return graphs.WeekFrameCount(COLORS, cursor, time_window)
+    elif graph_name == "first_rx_range":
+        return graphs.FirstRxRange(COLORS, cursor, time_window)
+    elif graph_name == "last_rx_altitude":
+        return graphs.LastRxAltitude(COLORS, cursor, time_window)
+    elif graph_name == "coverage":
+        return graphs.Coverage(COLORS, cursor, time_window)
     else:
         logging.error(f"Attemped to get class for invalid name {graph_name}")
         exit(1)
 
 class Dashboard(rsdb.web.WebApp):
-    def __init__(self, app_name: str, config: Dict[str, Any], connection: mariadb.Connection) -> None:
-        super().__init__(app_name, config, connection)
+    def __init__(self, app_name: str, config: Dict[str, Any], changes_config: Dict[str, Any],
+                 db_pool: rsdb.database.ProcessPool) -> None:
+        super().__init__(app_name, config, db_pool)
+
+        # Graphs are created in parallel, each on its own connection from the pool.
+        # This executor only fills the cache, threads don't survive forking so start creates the one used for requests.
+        self.pool_size = config["db_pool_size"]
+        self.executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix="dashboard-graph")
 
         self.top_left_graph = config["top_left_graph"]
         self.top_right_graph = config["top_right_graph"]
         self.bottom_left_graph = config["bottom_left_graph"]
         self.bottom_right_graph = config["bottom_right_graph"]
+
+        try:
+            self.time_window = window.TimeWindow(config["window"])
+        except ValueError as e:
+            logging.error(f"Invalid dashboard time window: {e}")
+            exit(1)
+
+        # Functions to create the sonde count and every graph
+        self.page_functions: Dict[str, Callable[[mariadb.Cursor], Any]] = {"sonde_count": database.get_sonde_count}
+        for graph_name in (self.top_left_graph, self.top_right_graph, self.bottom_left_graph, self.bottom_right_graph):
+            self.page_functions[graph_name] = lambda cursor, graph_name=graph_name: get_graph_from_name(graph_name, cursor, self.time_window).create_figure()
+
+        # If enabled, cache figures and refresh them in the background instead of creating them for every page load
+        self.figure_cache = None
+        if config["cache_ttl"] > 0:
+            logging.info("Filling dashboard cache")
+            self.figure_cache = figure_cache.FigureCache(self._create_entries, list(self.page_functions), config["cache_ttl"])
+
+            # Refresh figures early when flights were added to meta or changed
+            self.change_feed = rsdb.changes.ChangeFeed(db_pool, changes_config["poll_interval"])
+            self.change_feed.subscribe(self._handle_changes)
+
+        self.executor.shutdown()
         
+        # Fill panels independently after the page has loaded, so slow or failing graphs don't hold up the others
+        panels = {
+            "graph_top_left": self.top_left_graph,
+            "graph_top_right": self.top_right_graph,
+            "graph_bottom_left": self.bottom_left_graph,
+            "graph_bottom_right": self.bottom_right_graph
+        }
+        for graph_id, graph_name in panels.items():
+            self._add_panel_callback(graph_id, graph_name)
+
+        @self.app.callback(
+            Output("sonde_count", "children"),
+            Input("page_loaded", "data"),
+            prevent_initial_call=False
+        )
+        def update_sonde_count(_):
+            """Callback to show the sonde count and how old cached data is"""
+
+            sonde_count = self._get_entry("sonde_count")
+            sonde_count_text = f"Total sondes: {sonde_count if sonde_count is not None else '?'}"
+            if self.figure_cache is not None:
+                age = int(time.time() - self.figure_cache.oldest())
+                sonde_count_text += f" (updated {age // 60}m {age % 60}s ago)"
+
+            return sonde_count_text
+
         self.app.layout = self._create_page
 
-    def _create_page(self) -> html.Div:
-        """Internal function to get data from database and assemble the web page"""
+    def start(self):
+        """Start creating graphs and refreshing cached ones in this process"""
+
+        self.executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix="dashboard-graph")
+        if self.figure_cache is not None:
+            self.figure_cache.start()
+            self.change_feed.start()
+
+    def _handle_changes(self, changes: List[rsdb.changes.change_type]):
+        """Internal function to invalidate the cached figures if any flight in meta changed, called by the changes feed"""
+
+        assert self.figure_cache is not None # should never fail, the feed is only used with the cache
+
+        if any(event in (rsdb.changes.FINALIZED, rsdb.changes.UPDATED) for _, event, _ in changes):
+            self.figure_cache.invalidate()
+
+    def _create_entry(self, name: str) -> Any:
+        """Internal function to create the sonde count or a graph figure on a connection from the pool. Returns None if it fails."""
+
+        start = time.time()
+        try:
+            connection = rsdb.database.get_pool_connection(self.db_pool)
+            try:
+                cursor = connection.cursor()
+                value = self.page_functions[name](cursor)
+                cursor.close()
+            finally:
+                connection.close()
+        except mariadb.Error as e:
+            logging.error(f"Failed to create dashboard entry '{name}': {e}")
+            return None
+        except Exception: # Bugs in a single graph shouldn't break the others or the cache refresh thread
+            logging.exception(f"Got exception while creating dashboard entry '{name}'")
+            return None
 
-        # TODO: Add option for caching dashboard?
-        logging.debug("Creating dashboard")
+        # Log time to find slow graphs
+        duration = time.time() - start
+        logging.log(logging.INFO if duration >= SLOW_ENTRY_TIME else logging.DEBUG,
+                    f"Created dashboard entry '{name}' in {round(duration, 2)}s")
 
-        # Create cursor
-        cursor = self.db_conn.cursor()
+        return value
 
-        # Get sonde count
-        sonde_count = database.get_sonde_count(cursor)
+    def _create_entries(self, names: List[str]) -> Dict[str, Any]:
+        """
+        Internal function to create the sonde count and graph figures in parallel.
+        Each figure is built in the thread that got its data, overlapping with the queries of the others.
+        """
 
-        # Define graphs
-        top_left_graph = get_graph_from_name(self.top_left_graph, cursor)
-        top_right_graph = get_graph_from_name(self.top_right_graph, cursor)
-        bottom_left_graph = get_graph_from_name(self.bottom_left_graph, cursor)
-        bottom_right_graph = get_graph_from_name(self.bottom_right_graph, cursor)
+        start = time.time()
+        futures = {name: self.executor.submit(self._create_entry, name) for name in names}
+        values = {name: future.result() for name, future in futures.items()}
+        logging.debug(f"Created {len(names)} dashboard entries in {round(time.time()-start, 2)}s")
+
+        return values
+
+    def _get_entry(self, name: str) -> Any:
+        """Internal function to get the sonde count or a graph figure from the cache if enabled, otherwise from the database"""
+
+        if self.figure_cache is None:
+            return self._create_entry(name)
+
+        entry = self.figure_cache.get(name)
+
+        return None if entry is None else entry[0]
+
+    def _add_panel_callback(self, graph_id: str, graph_name: str):
+        """Internal function to add the callback filling a graph panel once the page has loaded"""
+
+        @self.app.callback(
+            Output(graph_id, "figure"),
+            Input("page_loaded", "data"),
+            prevent_initial_call=False
+        )
+        def update_graph(_):
+            """Callback to fill a graph panel"""
+
+            figure = self._get_entry(graph_name)
+            if figure is None: # Creating the figure failed, only this panel shows an error
+                figure = go.Figure()
+                figure.update_layout(paper_bgcolor=COLORS["background"], plot_bgcolor=COLORS["background"],
+                                     xaxis_visible=False, yaxis_visible=False,
+                                     annotations=[dict(text="Failed to load graph", showarrow=False,
+                                                       font=dict(size=16, color=COLORS["text"]))])
+
+            return figure
+
+    def _create_page(self) -> html.Div:
+        """Internal function to assemble the web page. Panels are filled by their own callbacks as their data arrives."""
 
-        # Create layout for graphs with dbcs
         logging.debug("Creating page layout")
 
+        def _panel(graph_id: str) -> dcc.Loading:
+            return dcc.Loading(dcc.Graph(id=graph_id, figure=go.Figure(layout=dict(paper_bgcolor=COLORS["background"],
+                                                                                    plot_bgcolor=COLORS["background"],
+                                                                                    xaxis_visible=False,
+                                                                                    yaxis_visible=False))),
+                               type="circle", color=COLORS["text"])
+
         graphs_layout = dbc.Container([
             dbc.Row([
-                dbc.Col(dcc.Graph(figure=top_left_graph.create_figure()), style={"height": "100%"}, width=6),
-                dbc.Col(dcc.Graph(figure=top_right_graph.create_figure()), style={"height": "100%"}, width=6)
+                dbc.Col(_panel("graph_top_left"), style={"height": "100%"}, width=6),
+                dbc.Col(_panel("graph_top_right"), style={"height": "100%"}, width=6)
             ], style={"height": "40vh"}),
             dbc.Row([
-                dbc.Col(dcc.Graph(figure=bottom_left_graph.create_figure()), style={"height": "100%"}, width=6),
-                dbc.Col(dcc.Graph(figure=bottom_right_graph.create_figure()), style={"height": "100%"}, width=6)
+                dbc.Col(_panel("graph_bottom_left"), style={"height": "100%"}, width=6),
+                dbc.Col(_panel("graph_bottom_right"), style={"height": "100%"}, width=6)
             ], style={"height": "40vh"})
         ], fluid=True)
 
@@ -73,14 +215,14 @@ class Dashboard(rsdb.web.WebApp):
         layout = html.Div(style={"backgroundColor": COLORS["background"], "height": "100vh"}, children=[
             html.H1(children="RSDB Dashboard", style={"color": COLORS["text"]}),
 
-            html.Div(children=f"Total sondes: {sonde_count}", style={
+            html.Div(children="Total sondes: ...", id="sonde_count", style={
                 "color": COLORS["text"],
                 "font-size": "1.5rem",
                 "padding-left": "2%"}),
 
-            html.Div(children=graphs_layout, style={"overflowY": "auto"})
-        ])
+            html.Div(children=graphs_layout, style={"overflowY": "auto"}),
 
-        cursor.close()
+            dcc.Store(id="page_loaded", data=True) # Triggers the panel callbacks
+        ])
 
         return layout
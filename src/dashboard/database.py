@@ -1,9 +1,18 @@
 from collections import defaultdict
-from datetime import datetime
-from typing import Dict, List
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
 
 import mariadb
 
+import src.rsdb as rsdb
+
+BURST_SKETCH_METRIC = "burst_alt"
+HISTOGRAM_COLUMNS = ["first_rx_range", "last_rx_range", "max_range", "last_rx_alt"] # meta columns histograms can be made of
+
+def _days(start: date, end: date) -> List[date]:
+    """Internal function to get all days from start to end (including both)"""
+
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
 
 def get_sonde_count(cursor: mariadb.Cursor) -> int:
     """Get amount of sondes in the database"""
@@ -12,124 +21,128 @@ def get_sonde_count(cursor: mariadb.Cursor) -> int:
     
     return cursor.fetchone()[0]
 
-def get_week_sonde_count(cursor: mariadb.Cursor) -> Dict[datetime, int]:
-    """Get amount of sondes for the last seven days (including today)"""
+def get_daily_sonde_count(cursor: mariadb.Cursor, start: date, end: date) -> Dict[date, int]:
+    """Get amount of sondes for every day from start to end (including both)"""
 
     cursor.execute("""
-WITH RECURSIVE dates AS (
-    SELECT CURDATE() AS d
-    UNION ALL
-    SELECT d - INTERVAL 1 DAY
-    FROM dates
-    WHERE d > CURDATE() - INTERVAL 6 DAY
-)
-SELECT
-    dates.d AS day,
-    COALESCE(t.cnt, 0) AS row_count
-FROM dates
-LEFT JOIN (
-    SELECT DATE(first_rx_time) AS day, COUNT(*) AS cnt
-    FROM meta
-    WHERE DATE(first_rx_time) BETWEEN CURDATE() - INTERVAL 6 DAY AND CURDATE()
-    GROUP BY DATE(first_rx_time)
-) AS t ON t.day = dates.d
-ORDER BY day DESC;
-""")
+SELECT DATE(first_rx_time) AS day, COUNT(*)
+FROM meta
+WHERE first_rx_time >= ? AND first_rx_time < ?
+GROUP BY day;
+""", (start, end + timedelta(days=1)))
 
-    data = dict(cursor.fetchall())
+    counts = dict(cursor.fetchall())
 
-    return data
+    return {day: counts.get(day, 0) for day in _days(start, end)}
 
-def get_week_types(cursor: mariadb.Cursor) -> Dict[str, int]:
-    """Get sonde type occurences in the past 7 days including today"""
+def get_types(cursor: mariadb.Cursor, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, int]:
+    """Get sonde type occurences from start to end (including both), or all time if not set"""
 
-    cursor.execute("""
-SELECT
-    sonde_type AS value,
-    COUNT(*) AS occurrences
+    if start is None or end is None:
+        cursor.execute("SELECT sonde_type, COUNT(*) FROM meta GROUP BY sonde_type;")
+    else:
+        cursor.execute("""
+SELECT sonde_type, COUNT(*)
 FROM meta
-WHERE first_rx_time >= CURDATE() - INTERVAL 6 DAY
-    AND first_rx_time < CURDATE() + INTERVAL 1 DAY
+WHERE first_rx_time >= ? AND first_rx_time < ?
 GROUP BY sonde_type;
-""")
+""", (start, end + timedelta(days=1)))
     
     data = dict(cursor.fetchall())
 
     return data
 
-def get_all_types(cursor: mariadb.Cursor) -> Dict[str, int]:
-    """Get all time sonde type occurences"""
+def get_daily_frame_count(cursor: mariadb.Cursor, start: date, end: date) -> Dict[date, int]:
+    """Get average frame count for every day from start to end (including both)"""
 
     cursor.execute("""
-SELECT
-    sonde_type AS value,
-    COUNT(*) AS occurrences
+SELECT DATE(first_rx_time) AS day, ROUND(AVG(frame_count), 0)
 FROM meta
-GROUP BY sonde_type;
-""")
+WHERE first_rx_time >= ? AND first_rx_time < ?
+GROUP BY day;
+""", (start, end + timedelta(days=1)))
     
-    data = dict(cursor.fetchall())
+    averages = dict(cursor.fetchall())
 
-    return data
+    return {day: int(averages.get(day, 0)) for day in _days(start, end)}
 
-def get_week_frame_count(cursor: mariadb.Cursor) -> Dict[datetime, int]:
-    """Get average frame count for the past 7 days including today"""
+def get_daily_burst_sketches(cursor: mariadb.Cursor, start: date, end: date) -> Dict[date, rsdb.sketch.TDigest]:
+    """
+    Get sketches of the burst altitude distribution for every day with bursts from start to end (including both).
+    Sketches are stored in the database, and only created from the meta table for days that are missing or have changed.
+    """
 
+    # Get amount of bursts per day to find out which stored sketches are outdated
     cursor.execute("""
-WITH RECURSIVE dates AS (
-    SELECT CURDATE() AS d
-    UNION ALL
-    SELECT d - INTERVAL 1 DAY
-    FROM dates
-    WHERE d > CURDATE() - INTERVAL 6 DAY
-)
-SELECT
-    dates.d AS day,
-    COALESCE(ROUND(AVG(t.frame_count), 0), 0 ) AS avg_val
-FROM
-    dates
-    LEFT JOIN meta AS t
-        ON DATE(t.first_rx_time) = dates.d
-GROUP BY
-  dates.d
-ORDER BY
-  dates.d;
-""")
-    
-    data = dict(cursor.fetchall())
+SELECT DATE(first_rx_time) AS day, COUNT(*)
+FROM meta
+WHERE first_rx_time >= ? AND first_rx_time < ? AND burst_alt IS NOT NULL
+GROUP BY day;
+""", (start, end + timedelta(days=1)))
+    burst_counts = dict(cursor.fetchall())
+
+    cursor.execute("SELECT day, flights, sketch FROM daily_sketches WHERE metric = ? AND day >= ? AND day <= ?",
+                   (BURST_SKETCH_METRIC, start, end))
+    sketches = {}
+    outdated = set(burst_counts.keys())
+    for day, flights, sketch in cursor.fetchall():
+        if burst_counts.get(day) == flights:
+            sketches[day] = rsdb.sketch.TDigest.from_bytes(sketch)
+            outdated.discard(day)
+
+    if len(outdated) == 0:
+        return sketches
+
+    # Create sketches of outdated days from the burst altitudes, and store them
+    cursor.execute("""
+SELECT DATE(first_rx_time) AS day, burst_alt
+FROM meta
+WHERE first_rx_time >= ? AND first_rx_time < ? AND burst_alt IS NOT NULL;
+""", (min(outdated), max(outdated) + timedelta(days=1)))
 
-    return data
+    new_sketches = defaultdict(rsdb.sketch.TDigest)
+    for day, burst_alt in cursor.fetchall():
+        if day in outdated:
+            new_sketches[day].add(burst_alt)
 
-def get_week_burst_alts(cursor: mariadb.Cursor) -> Dict[datetime, List[int]]:
-    """Get a list of burst altitudes for the past 7 days including today"""
+    cursor.executemany("REPLACE INTO daily_sketches (day, metric, flights, sketch) VALUES (?, ?, ?, ?)",
+                       [(day, BURST_SKETCH_METRIC, int(sketch.count), sketch.to_bytes()) for day, sketch in new_sketches.items()])
+    cursor.connection.commit()
+    sketches.update(new_sketches)
 
-    cursor.execute("""
-WITH RECURSIVE dates AS (
-    SELECT CURDATE() AS d
-    UNION ALL
-    SELECT d - INTERVAL 1 DAY
-    FROM dates
-    WHERE d > CURDATE() - INTERVAL 6 DAY
-)
-SELECT
-    dates.d AS day,
-    t.burst_alt 
-FROM
-    dates
-    LEFT JOIN meta AS t
-        ON DATE(t.first_rx_time) = dates.d
-        AND t.frame_count IS NOT NULL
-ORDER BY
-    dates.d, 
-    t.first_rx_time;
-""")
-
-    data = cursor.fetchall()
-    
-    grouped = defaultdict(list)
-    for d, value in data:
-        grouped[d].append(value)
+    return sketches
+
+def get_histogram(cursor: mariadb.Cursor, column: str, bin_size: int, start: date, end: date) -> Dict[int, int]:
+    """
+    Get the amount of flights from start to end (including both) in bins of a meta column.
+    Returns the amount by the start of the bin. Flights without a value are skipped.
+    """
+
+    if column not in HISTOGRAM_COLUMNS: # Column names can't be parameters, so only allow known ones
+        raise ValueError(f"Invalid histogram column '{column}'")
 
-    grouped = dict(grouped)
+    cursor.execute(f"""
+SELECT FLOOR({column} / ?) * ? AS bin, COUNT(*)
+FROM meta
+WHERE first_rx_time >= ? AND first_rx_time < ? AND {column} IS NOT NULL
+GROUP BY bin
+ORDER BY bin;
+""", (bin_size, bin_size, start, end + timedelta(days=1)))
+
+    return {int(bin): count for bin, count in cursor.fetchall()}
+
+def get_coverage(cursor: mariadb.Cursor, sector_size: int, start: date, end: date) -> Dict[int, Tuple[int, int, int]]:
+    """
+    Get the coverage of the receiving station in bearing sectors from flights from start to end (including both).
+    Returns the maximum range, average maximum range and amount of flights by the start bearing of the sector.
+    """
+
+    cursor.execute("""
+SELECT FLOOR(max_range_bearing / ?) * ? AS sector, MAX(max_range), AVG(max_range), COUNT(*)
+FROM meta
+WHERE first_rx_time >= ? AND first_rx_time < ? AND max_range IS NOT NULL
+GROUP BY sector
+ORDER BY sector;
+""", (sector_size, sector_size, start, end + timedelta(days=1)))
 
-    return grouped
+    return {int(sector): (max_range, int(average_range), count) for sector, max_range, average_range, count in cursor.fetchall()}
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+# Function creating the entries with the given names, with None for entries that couldn't be created
+create_function_type = Callable[[List[str]], Dict[str, Any]]
+
+MIN_INVALIDATE_INTERVAL = 30 # Minimum seconds between refreshes caused by invalidation, so bursts of changes cause one refresh
+
+class FigureCache():
+    """
+    Cache dashboard figures and values for a maximum age (TTL). Expired entries are refreshed by a background thread
+    started with start() and served stale until then, so page loads never wait for the database. Invalidated entries are refreshed early.
+    """
+
+    def __init__(self, create_function: create_function_type, names: List[str], ttl: float) -> None:
+        self.create_function = create_function
+        self.names = names
+        self.ttl = ttl
+
+        self._entries: Dict[str, Tuple[Any, float]] = {} # value and time it was created by name
+        self._lock = threading.Lock()
+        self._wake = threading.Event() # Set to refresh all entries before they expire
+        self._last_refresh = 0.0
+
+        # Fill cache once, so the first page load already has all data
+        self._refresh(self.names)
+
+    def start(self):
+        """Start refreshing entries. Called in every process serving requests, see rsdb.web.WebApp.start"""
+
+        threading.Thread(target=self._refresh_loop, name="figure-cache", daemon=True).start()
+
+    def get(self, name: str) -> Tuple[Any, float] | None:
+        """Get a cached value with the time it was created. Returns None if it couldn't be created yet."""
+
+        with self._lock:
+            return self._entries.get(name)
+
+    def oldest(self) -> float:
+        """Get the creation time of the oldest cached value"""
+
+        with self._lock:
+            return min((created for _, created in self._entries.values()), default=time.time())
+
+    def invalidate(self):
+        """Refresh all entries soon, because their data has changed"""
+
+        self._wake.set()
+
+    def _refresh(self, names: List[str]):
+        """Internal function to create entries again. Keeps the old values of entries that fail."""
+
+        self._last_refresh = time.time()
+        values = self.create_function(names)
+
+        with self._lock:
+            for name, value in values.items():
+                if value is not None:
+                    self._entries[name] = (value, time.time())
+
+    def _refresh_loop(self):
+        """Internal function to refresh expired entries, running in a thread"""
+
+        while True:
+            # Sleep until the oldest entry expires or the cache is invalidated, and retry failed entries after the TTL
+            if self._wake.wait(max(self.oldest() + self.ttl - time.time(), 1)):
+                time.sleep(max(self._last_refresh + MIN_INVALIDATE_INTERVAL - time.time(), 0))
+                self._wake.clear()
+                expired = list(self.names)
+            else:
+                with self._lock:
+                    expired = [name for name in self.names
+                               if name not in self._entries or time.time() - self._entries[name][1] >= self.ttl]
+            if len(expired) > 0:
+                logging.debug(f"Refreshing {len(expired)} dashboard cache entries")
+                try:
+                    self._refresh(expired)
+                except Exception: # Keep serving the old values and try again later
+                    logging.exception("Got exception while refreshing dashboard cache")
@@ -1,18 +1,37 @@
 from abc import ABC, abstractmethod
+from datetime import date, timedelta
 from typing import Any, Dict
 
 import mariadb
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-from . import database
+import src.rsdb as rsdb
 
+from . import database, window
+
+BUCKET_WEEKS_MIN_DAYS = 32 # Minimum window length to show distributions per week instead of per day
+BUCKET_MONTHS_MIN_DAYS = 181 # Minimum window length to show distributions per month
+RANGE_BIN_SIZE = 10_000 # Size of range histogram bins in meters
+ALTITUDE_BIN_SIZE = 1000 # Size of altitude histogram bins in meters
+COVERAGE_SECTOR_SIZE = 10 # Size of coverage bearing sectors in degrees
+
+def _get_bucket(day: date, window_days: int) -> date:
+    """Internal function to get the first day of the day, week or month a day is grouped into in a window"""
+
+    if window_days >= BUCKET_MONTHS_MIN_DAYS:
+        return day.replace(day=1)
+    elif window_days >= BUCKET_WEEKS_MIN_DAYS:
+        return day - timedelta(days=day.weekday())
+
+    return day
 
 # Base graph class
 class DashboardGraph(ABC):
-    def __init__(self, COLORS: Dict[str, str], cursor: mariadb.Cursor) -> None:
+    def __init__(self, COLORS: Dict[str, str], cursor: mariadb.Cursor, window: window.TimeWindow) -> None:
         self.COLORS = COLORS
         self.cursor = cursor
+        self.window = window
 
     def _apply_figure_settings(self, figure: go.Figure, title: str | None = None):
         """Internal function to apply common settings to a plotly figure"""
@@ -53,19 +72,19 @@ class DashboardGraph(ABC):
 
 class WeekSondeCount(DashboardGraph):
     def create_figure(self) -> go.Figure:
-        data = database.get_week_sonde_count(self.cursor)
+        data = database.get_daily_sonde_count(self.cursor, *self.window.range())
 
         figure = self._make_figure(go.Bar(
             x=list(data.keys()),
             y=list(data.values())
-        ), "Sonde Count (7d)")
+        ), f"Sonde Count ({self.window.label})")
 
         return figure
 
 class SondeTypes(DashboardGraph):
     def create_figure(self) -> go.Figure:
-        data_week = database.get_week_types(self.cursor)
-        data_all = database.get_all_types(self.cursor)
+        data_window = database.get_types(self.cursor, *self.window.range())
+        data_all = database.get_types(self.cursor)
 
         # FIXME:  title is a bit lower than other graphs
         # Create subplot
@@ -74,8 +93,8 @@ class SondeTypes(DashboardGraph):
         # Add pie charts
         figure.add_trace(
             go.Pie(
-            labels=list(data_week.keys()),
-            values=list(data_week.values())),
+            labels=list(data_window.keys()),
+            values=list(data_window.values())),
             row=1, col=1
         )
 
@@ -87,36 +106,110 @@ class SondeTypes(DashboardGraph):
         )
 
         # Make figure
-        self._apply_figure_settings(figure, "Sonde Type (7d/all)")
+        self._apply_figure_settings(figure, f"Sonde Type ({self.window.label}/all)")
         figure.update_layout(margin=dict(b=30))
 
         return figure
     
 class WeekBurstAltitudes(DashboardGraph):
     def create_figure(self) -> go.Figure:
-        data = database.get_week_burst_alts(self.cursor)
-
-        # Create box graphs
-        box_graphs = []
-        for day, altitudes in data.items():
-            box_graphs.append(go.Box(
-                y=altitudes,
-                name=str(day)
-            ))
+        start, end = self.window.range()
+        data = database.get_daily_burst_sketches(self.cursor, start, end)
+
+        # Merge daily sketches into one per day, week or month, depending on the length of the window
+        buckets: Dict[date, rsdb.sketch.TDigest] = {}
+        for day, sketch in sorted(data.items()):
+            bucket = _get_bucket(day, (end - start).days + 1)
+            if bucket not in buckets:
+                buckets[bucket] = rsdb.sketch.TDigest()
+            buckets[bucket].merge(sketch)
+
+        # Create box graph from the quantiles of the sketches, whiskers are at most 1.5 IQR like in a normal box plot
+        q1, median, q3, lower_fence, upper_fence = [], [], [], [], []
+        for sketch in buckets.values():
+            quartiles = [sketch.quantile(q) for q in (0.25, 0.5, 0.75)]
+            iqr = quartiles[2] - quartiles[0]
+            q1.append(quartiles[0])
+            median.append(quartiles[1])
+            q3.append(quartiles[2])
+            lower_fence.append(max(sketch.min, quartiles[0] - 1.5 * iqr))
+            upper_fence.append(min(sketch.max, quartiles[2] + 1.5 * iqr))
 
         # Make figure
-        figure = self._make_figure(box_graphs, "Burst Altitude (7d)")
+        figure = self._make_figure(go.Box(
+            x=[str(bucket) for bucket in buckets.keys()],
+            q1=q1,
+            median=median,
+            q3=q3,
+            lowerfence=lower_fence,
+            upperfence=upper_fence
+        ), f"Burst Altitude ({self.window.label})")
         figure.update_layout(showlegend=False)
 
         return figure
     
 class WeekFrameCount(DashboardGraph):
     def create_figure(self) -> go.Figure:
-        data = database.get_week_frame_count(self.cursor)
+        data = database.get_daily_frame_count(self.cursor, *self.window.range())
     
         figure = self._make_figure(go.Scatter( # TODO: maybe add second line/y-axis with time instead of frames?
             x=list(data.keys()),
             y=list(data.values())
-        ), title="Daily Avg. Frame Count (7d)")
+        ), title=f"Daily Avg. Frame Count ({self.window.label})")
+
+        return figure
+
+class FirstRxRange(DashboardGraph):
+    def create_figure(self) -> go.Figure:
+        data = database.get_histogram(self.cursor, "first_rx_range", RANGE_BIN_SIZE, *self.window.range())
+
+        figure = self._make_figure(go.Bar(
+            x=[bin / 1000 for bin in data.keys()],
+            y=list(data.values()),
+            offset=0,
+            width=RANGE_BIN_SIZE / 1000
+        ), f"First Receive Range ({self.window.label})")
+        figure.update_layout(xaxis_title="km")
+
+        return figure
+
+class LastRxAltitude(DashboardGraph):
+    def create_figure(self) -> go.Figure:
+        data = database.get_histogram(self.cursor, "last_rx_alt", ALTITUDE_BIN_SIZE, *self.window.range())
+
+        figure = self._make_figure(go.Bar(
+            x=[bin / 1000 for bin in data.keys()],
+            y=list(data.values()),
+            offset=0,
+            width=ALTITUDE_BIN_SIZE / 1000
+        ), f"Last Receive Altitude ({self.window.label})")
+        figure.update_layout(xaxis_title="km")
+
+        return figure
+
+class Coverage(DashboardGraph):
+    def create_figure(self) -> go.Figure:
+        data = database.get_coverage(self.cursor, COVERAGE_SECTOR_SIZE, *self.window.range())
+
+        # Show maximum and average range of the flights in every bearing sector
+        sectors = [sector + COVERAGE_SECTOR_SIZE / 2 for sector in data.keys()]
+        figure = self._make_figure([
+            go.Barpolar(
+                r=[coverage[0] / 1000 for coverage in data.values()],
+                theta=sectors,
+                width=COVERAGE_SECTOR_SIZE,
+                name="max",
+                opacity=0.5
+            ),
+            go.Barpolar(
+                r=[coverage[1] / 1000 for coverage in data.values()],
+                theta=sectors,
+                width=COVERAGE_SECTOR_SIZE,
+                name="avg",
+                customdata=[coverage[2] for coverage in data.values()],
+                hovertemplate="%{r:.0f} km (%{customdata} flights)"
+            )
+        ], f"Coverage in km ({self.window.label})")
+        figure.update_layout(polar=dict(bgcolor=self.COLORS["background"], angularaxis=dict(direction="clockwise", rotation=90)))
 
         return figure
@@ -1,18 +1,42 @@
+from typing import Any, Dict
+
+import flask
+
 import src.rsdb as rsdb
 
 from . import dashboard
 
 
-def main():
+def create(config: Dict[str, Any]) -> dashboard.Dashboard:
+    """Create the dashboard with the output of rsdb.config.read_config() as the input"""
+
+    # Ensure tables exist, requests use connections from the pool
+    rsdb.database.connect(config).close()
+    db_pool = rsdb.database.create_pool(config, "rsdb-dashboard", config["dashboard"]["db_pool_size"])
+
+    return dashboard.Dashboard("dashboard", config["dashboard"], config["changes"], db_pool)
+
+def _read_config() -> Dict[str, Any]:
+    """Internal function to set up logging and read the config"""
+
     rsdb.logging.set_up_logging("rsdb-dashboard") # Set up logging
     
     config = rsdb.config.read_config() # Read config
     rsdb.logging.set_logging_config(config) # Set logging config
 
-    # Connect to DB
-    database = rsdb.database.connect(config)
+    return config
+
+def main():
+    # Start dashboard with the development server
+    create(_read_config()).run()
+
+def create_app() -> flask.Flask:
+    """WSGI app factory for serving the dashboard with any WSGI server, e.g. gunicorn "src.dashboard.main:create_app()" """
+
+    return create(_read_config()).wsgi_app()
+
+def serve():
+    """Serve the dashboard with gunicorn with multiple worker processes"""
 
-    # Start dashboard
-    dash = dashboard.Dashboard("dashboard", config["dashboard"], database)
-    dash.run()
-    
\ No newline at end of file
+    config = _read_config()
+    rsdb.web.serve("rsdb-dashboard", lambda: create(config).wsgi_app(), config["dashboard"])
@@ -0,0 +1,45 @@
+import re
+from datetime import date, timedelta
+from typing import Tuple
+
+UNIT_DAYS = {"d": 1, "w": 7, "m": 30, "y": 365} # Days per unit of relative windows
+
+class TimeWindow():
+    """
+    A time window shown by the dashboard graphs. Either relative to today like "30d", "12w", "6m" or "1y"
+    (including today), or a fixed date range like "2024-01-01..2024-12-31" (including both dates).
+    Raises ValueError if the window is invalid.
+    """
+
+    def __init__(self, window: str) -> None:
+        window = window.strip()
+        self.label = window
+
+        self.days = None # Length of relative windows
+        self.start = self.end = None # Dates of fixed windows
+
+        relative = re.fullmatch(r"(\d+)([dwmy])", window)
+        if relative is not None:
+            self.days = int(relative.group(1)) * UNIT_DAYS[relative.group(2)]
+            if self.days == 0:
+                raise ValueError(f"Time window '{window}' is empty")
+        elif ".." in window:
+            start, end = window.split("..", 1)
+            self.start = date.fromisoformat(start.strip())
+            self.end = date.fromisoformat(end.strip())
+            if self.end < self.start:
+                raise ValueError(f"Time window '{window}' ends before it starts")
+            self.label = f"{self.start} - {self.end}"
+        else:
+            raise ValueError(f"Invalid time window '{window}'")
+
+    def range(self) -> Tuple[date, date]:
+        """Get the first and last day of the window"""
+
+        if self.days is not None:
+            today = date.today()
+            return today - timedelta(days=self.days - 1), today
+
+        assert self.start is not None and self.end is not None # should never fail
+
+        return self.start, self.end
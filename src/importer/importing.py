@@ -0,0 +1,151 @@
+import logging
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import mariadb
+
+import src.rsdb as rsdb
+from src.archiver import database
+
+from . import parsing
+
+# Per worker process state, set up by init_worker
+_db_conn: mariadb.Connection
+_archiver_config: Dict[str, Any]
+_batch_size: int
+_station: Optional[rsdb.flight.station_type]
+_launchsite_index: Optional[rsdb.launchsites.LaunchsiteIndex]
+
+import_result = Tuple[int, int, int, int] # frames read, frames stored, flights imported, flights skipped
+
+def init_worker(config: Dict[str, Any]):
+    """Initialize an importer worker process with its own database connection"""
+
+    global _db_conn, _archiver_config, _batch_size, _station, _launchsite_index
+
+    _db_conn = rsdb.database.connect(config)
+    _archiver_config = config["archiver"]
+    _batch_size = config["importer"]["batch_size"]
+    _station = (config["station"]["latitude"], config["station"]["longitude"]) if config["station"]["enabled"] else None
+    _launchsite_index = rsdb.launchsites.create_index(config)
+
+def _get_existing_serials(cursor: mariadb.Cursor, serials: List[str]) -> Set[str]:
+    """
+    Internal function to get which of the specified serials already exist in the meta or tracking table.
+    Flights are only in tracking while being received, and only in meta once their tracking data was archived.
+    """
+
+    if len(serials) == 0:
+        return set()
+
+    placeholders = ", ".join(["?"] * len(serials))
+    cursor.execute(f"SELECT serial FROM meta WHERE serial IN ({placeholders}) " \
+                   f"UNION SELECT DISTINCT serial FROM tracking WHERE serial IN ({placeholders})", serials + serials)
+
+    return {result[0] for result in cursor.fetchall()}
+
+def _prepare_flight(packets: List[rsdb.Packet]) -> Tuple[List[rsdb.Packet], rsdb.Packet | None, Dict[str, float | None]] | None:
+    """
+    Internal function to filter a flight and calculate derived values the same way the archiver does.
+    Returns the packets to store, the burst packet and the derived metrics, or None if the flight should be discarded.
+    """
+
+    # Apply the same filters as the archiver does while receiving
+    packets = rsdb.flight.filter_packets(packets, _archiver_config["min_seconds_per_frame"], _archiver_config["rx_timeout"])
+    if len(packets) < _archiver_config["min_frames"]:
+        return None
+
+    # Speed and burst calculations of the archiver work on frame sorted packets
+    frame_sorted = sorted(packets, key=lambda packet: packet.frame)
+
+    # Calculate missing speed values
+    if len(frame_sorted) > 1:
+        new_speeds = rsdb.flight.calculate_missing_speeds(
+            [(packet.speed, packet.latitude, packet.longitude, packet.datetime) for packet in frame_sorted] # type: ignore
+        )
+        for i, speed in new_speeds.items():
+            frame_sorted[i].speed = speed
+
+    # Get burst point
+    burst_index = rsdb.flight.find_burst_index([packet.altitude for packet in frame_sorted])
+    burst_packet = None if burst_index is None else frame_sorted[burst_index]
+
+    # Calculate derived metrics
+    metrics = rsdb.flight.derive_metrics([(packet.datetime, packet.altitude, packet.speed, packet.temperature) # type: ignore
+                                          for packet in frame_sorted])
+
+    return packets, burst_packet, metrics
+
+def import_file(path: str) -> import_result:
+    """Import all flights from a flight archive file. Runs in a worker process."""
+
+    frames_read = 0
+    frames_stored = 0
+    flights_imported = 0
+    flights_skipped = 0
+
+    try:
+        start = time.time()
+        flights = parsing.parse_file(path)
+        frames_read = sum(len(packets) for packets in flights.values())
+
+        cursor = _db_conn.cursor()
+        existing_serials = _get_existing_serials(cursor, list(flights.keys()))
+
+        # Insert flights, batching tracking rows across flights
+        pending_packets: List[rsdb.Packet] = []
+        for serial, packets in flights.items():
+            if serial in existing_serials:
+                logging.debug(f"Sonde '{serial}' already exists in DB. Skipping")
+                flights_skipped += 1
+                continue
+
+            prepared = _prepare_flight(packets)
+            if prepared is None:
+                logging.debug(f"Sonde '{serial}' has not reached the minimum amount of frames. Skipping")
+                flights_skipped += 1
+                continue
+            packets, burst_packet, metrics = prepared
+
+            # Collect range statistics like the archiver does while receiving
+            flight_range = None
+            if _station is not None:
+                flight_range = rsdb.flight.RangeTracker(_station)
+                for packet in packets:
+                    flight_range.add(packet)
+
+            launch_site = None
+            if _launchsite_index is not None:
+                launch_site = _launchsite_index.attribute(packets[0].latitude, packets[0].longitude)
+
+            # The meta row is inserted first, so a flight imported by another file of the same run (possibly in another worker)
+            # since checking fails here on its own. Only the failed statement is rolled back.
+            try:
+                database.add_to_meta(cursor, packets[0], burst_packet, packets[-1], len(packets), flight_range, metrics, launch_site)
+            except mariadb.IntegrityError:
+                logging.debug(f"Sonde '{serial}' was already imported from another file. Skipping")
+                flights_skipped += 1
+                continue
+            pending_packets.extend(packets)
+            rsdb.changes.record(cursor, rsdb.changes.FINALIZED, [serial])
+            flights_imported += 1
+            frames_stored += len(packets)
+
+            if len(pending_packets) >= _batch_size:
+                database.add_packets_to_tracking(cursor, pending_packets)
+                _db_conn.commit()
+                pending_packets = []
+
+        if len(pending_packets) > 0:
+            database.add_packets_to_tracking(cursor, pending_packets)
+        _db_conn.commit()
+        cursor.close()
+
+        logging.debug(f"Imported '{path}' ({frames_read} frames) in {round(time.time()-start, 2)}s")
+    except Exception as e:
+        logging.error(f"Got exception while importing '{path}': {e}")
+        logging.info(traceback.format_exc())
+        _db_conn.rollback()
+
+    return frames_read, frames_stored, flights_imported, flights_skipped
@@ -0,0 +1,74 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import src.rsdb as rsdb
+
+from . import importing, parsing
+
+
+def find_files(paths: List[str]) -> List[str]:
+    """Get all supported flight archive files from a list of files and directories"""
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                files.extend(os.path.join(directory, filename) for filename in sorted(filenames)
+                             if parsing.is_supported_file(filename))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            logging.warning(f"Couldn't find '{path}'. Skipping")
+
+    return files
+
+def main():
+    rsdb.logging.set_up_logging("rsdb-importer") # Set up logging
+
+    config = rsdb.config.read_config() # Read config
+    rsdb.logging.set_logging_config(config) # Set logging config
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Import historical flights from auto_rx log CSVs and SondeHub style JSON dumps")
+    parser.add_argument("paths", nargs="+", help="Files or directories to import (optionally gzip compressed)")
+    args = parser.parse_args()
+
+    files = find_files(args.paths)
+    if len(files) == 0:
+        logging.error("No files to import")
+        exit(1)
+
+    # Ensure tables exist before starting workers
+    rsdb.database.connect(config).close()
+
+    processes = config["importer"]["processes"] or os.cpu_count()
+    logging.info(f"Importing {len(files)} files with {processes} processes")
+
+    # Import files in process pool, each worker has its own database connection
+    frames_read = 0
+    frames_stored = 0
+    flights_imported = 0
+    flights_skipped = 0
+    start = time.time()
+    try:
+        with ProcessPoolExecutor(processes, initializer=importing.init_worker, initargs=(config,)) as executor:
+            for i, result in enumerate(executor.map(importing.import_file, files)):
+                frames_read += result[0]
+                frames_stored += result[1]
+                flights_imported += result[2]
+                flights_skipped += result[3]
+
+                elapsed = time.time() - start
+                logging.info(f"({i+1}/{len(files)}) {flights_imported} flights imported, {flights_skipped} skipped, " \
+                             f"{frames_read} frames read ({round(frames_read / elapsed)} frames/s)")
+    except KeyboardInterrupt:
+        logging.info("Got keyboard interrupt, shutting down..")
+        exit(1)
+
+    elapsed = time.time() - start
+    logging.info(f"Done in {round(elapsed, 1)}s. Imported {flights_imported} flights with {frames_stored} frames " \
+                 f"({round(frames_read / elapsed)} frames/s read, {round(frames_stored / elapsed)} frames/s stored)")
@@ -0,0 +1,182 @@
+import csv
+import gzip
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, Iterator, List
+
+import src.rsdb as rsdb
+
+AUTORX_LOG_EXTENSIONS = (".log", ".csv")
+SONDEHUB_EXTENSIONS = (".json", ".jsonl", ".ndjson")
+
+def is_supported_file(path: str) -> bool:
+    """Check if a file looks like a supported flight archive by its extension"""
+
+    name = path[:-3] if path.endswith(".gz") else path
+    return name.endswith(AUTORX_LOG_EXTENSIONS) or name.endswith(SONDEHUB_EXTENSIONS)
+
+def _open(path: str) -> IO[str]:
+    """Internal function to open a (optionally gzip compressed) text file"""
+
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    else:
+        return open(path, "r", encoding="utf-8")
+
+def _parse_time(time_str: str) -> datetime:
+    """Internal function to parse an ISO 8601 timestamp into an UTC datetime without fractional seconds"""
+
+    # datetime.fromisoformat only supports the Z suffix from python 3.11 onwards
+    if time_str.endswith("Z"):
+        time_str = time_str[:-1] + "+00:00"
+
+    time = datetime.fromisoformat(time_str)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+
+    # Tracking table only stores whole seconds
+    return time.astimezone(timezone.utc).replace(microsecond=0)
+
+def _read_autorx_log(f: IO[str]) -> Iterator[Dict[str, str]]:
+    """Internal function to read the rows of an auto_rx telemetry log CSV file"""
+
+    return csv.DictReader(f)
+
+def _convert_autorx_row(row: Dict[str, str]) -> Dict[str, Any]:
+    """Internal function to convert an auto_rx log row to the format of a payload summary UDP packet with an additional datetime key"""
+
+    data_dict: Dict[str, Any] = {
+        "station": None,
+        "callsign": row["serial"],
+        "time": row["timestamp"],
+        "datetime": row["timestamp"],
+        "frame": int(row["frame"]),
+        "latitude": float(row["lat"]),
+        "longitude": float(row["lon"]),
+        "altitude": round(float(row["alt"])),
+        "model": row["type"],
+        "speed": float(row["vel_h"]) * 3.6, # payload summaries contain the speed in km/h
+    }
+
+    # Optional fields, depending on the autorx version. Missing values are -1 (or -273 for temperature),
+    # which get filtered in rsdb.Packet.from_dict just like with UDP packets
+    if row.get("temp"):
+        data_dict["temp"] = float(row["temp"])
+    if row.get("humidity"):
+        data_dict["humidity"] = float(row["humidity"])
+    if row.get("pressure"):
+        data_dict["pressure"] = float(row["pressure"])
+    if row.get("subtype"):
+        data_dict["subtype"] = row["subtype"]
+    if row.get("freq_mhz"):
+        data_dict["freq"] = f"{float(row['freq_mhz']):.3f} MHz"
+    if row.get("batt_v") and float(row["batt_v"]) >= 0:
+        data_dict["batt"] = float(row["batt_v"])
+    if row.get("burst_timer") and int(row["burst_timer"]) >= 0:
+        data_dict["bt"] = int(row["burst_timer"])
+    if row.get("aux_data") and row["aux_data"] != "-1":
+        data_dict["aux"] = row["aux_data"]
+
+    return data_dict
+
+def _read_sondehub_json(f: IO[str]) -> Iterator[Dict[str, Any]]:
+    """Internal function to read the frames of a SondeHub style JSON dump (either a JSON list or newline delimited JSON)"""
+
+    # Check if file is a JSON list or newline delimited JSON
+    first_char = f.read(1)
+    while first_char.isspace():
+        first_char = f.read(1)
+    f.seek(0)
+
+    if first_char == "[":
+        return iter(json.load(f))
+    else:
+        return (json.loads(line) for line in f if line.strip() != "")
+
+def _convert_sondehub_frame(frame: Dict[str, Any]) -> Dict[str, Any]:
+    """Internal function to convert a SondeHub frame to the format of a payload summary UDP packet with an additional datetime key"""
+
+    data_dict: Dict[str, Any] = {
+        "station": frame.get("uploader_callsign"),
+        "callsign": frame["serial"],
+        "time": frame["datetime"],
+        "datetime": frame["datetime"],
+        "frame": int(frame["frame"]),
+        "latitude": float(frame["lat"]),
+        "longitude": float(frame["lon"]),
+        "altitude": round(float(frame["alt"])),
+    }
+
+    # Optional fields, only present in SondeHub data if the sonde sends them
+    if "type" in frame:
+        data_dict["model"] = frame["type"]
+    if "subtype" in frame:
+        data_dict["subtype"] = frame["subtype"]
+    if "frequency" in frame:
+        data_dict["freq"] = f"{float(frame['frequency']):.3f} MHz"
+    if "temp" in frame:
+        data_dict["temp"] = frame["temp"]
+    if "humidity" in frame:
+        data_dict["humidity"] = frame["humidity"]
+    if "pressure" in frame:
+        data_dict["pressure"] = frame["pressure"]
+    if "vel_h" in frame:
+        data_dict["speed"] = frame["vel_h"] * 3.6 # payload summaries contain the speed in km/h
+    if "batt" in frame:
+        data_dict["batt"] = frame["batt"]
+    if "burst_timer" in frame:
+        data_dict["bt"] = frame["burst_timer"]
+    if "xdata" in frame:
+        data_dict["aux"] = frame["xdata"]
+    if "rs41_mainboard" in frame:
+        data_dict["rs41_mainboard"] = frame["rs41_mainboard"]
+    if "rs41_mainboard_firmware" in frame:
+        data_dict["rs41_mainboard_fw"] = frame["rs41_mainboard_firmware"]
+
+    return data_dict
+
+def parse_file(path: str) -> Dict[str, List[rsdb.Packet]]:
+    """
+    Parse a flight archive file (auto_rx log CSV or SondeHub style JSON, optionally gzip compressed).
+    Returns a dict with the normalized serial as key and a time sorted list of packets as value.
+    Frames that can't be parsed are skipped.
+    """
+
+    name = os.path.basename(path[:-3] if path.endswith(".gz") else path)
+    flights: Dict[str, List[rsdb.Packet]] = defaultdict(list)
+    invalid_frames = 0
+
+    with _open(path) as f:
+        if name.endswith(SONDEHUB_EXTENSIONS):
+            rows, convert = _read_sondehub_json(f), _convert_sondehub_frame
+        else:
+            rows, convert = _read_autorx_log(f), _convert_autorx_row
+
+        for row in rows:
+            try:
+                data_dict = convert(row)
+                packet = rsdb.Packet().from_dict(data_dict)
+                assert packet is not None # never none without type key
+
+                packet.datetime = _parse_time(data_dict["datetime"])
+                packet.normalize()
+            except (KeyError, ValueError, TypeError) as e:
+                invalid_frames += 1
+                logging.debug(f"Skipping invalid frame in '{path}': {e}")
+                continue
+
+            flights[packet.serial].append(packet)
+
+    if invalid_frames > 0:
+        logging.warning(f"Skipped {invalid_frames} invalid frames in '{path}'")
+
+    # Sort flights by time and remove frames with duplicate times
+    for serial, packets in flights.items():
+        packets.sort(key=lambda packet: packet.datetime) # type: ignore
+        flights[serial] = [packet for i, packet in enumerate(packets)
+                           if i == 0 or packet.datetime != packets[i-1].datetime]
+
+    return dict(flights)
@@ -0,0 +1,73 @@
+import logging
+import traceback
+from itertools import groupby
+from typing import Any, Dict, List, Optional
+
+import mariadb
+
+import src.rsdb as rsdb
+
+# Per worker process state, set up by init_worker
+_db_conn: mariadb.Connection
+_station: Optional[rsdb.flight.station_type]
+
+RANGE_COLUMNS = ["first_rx_range", "last_rx_range", "last_rx_bearing", "max_range", "max_range_bearing", "max_range_alt"]
+
+def init_worker(config: Dict[str, Any]):
+    """Initialize a backfill worker process with its own database connection"""
+
+    global _db_conn, _station
+
+    _db_conn = rsdb.database.connect(config)
+    _station = (config["station"]["latitude"], config["station"]["longitude"]) if config["station"]["enabled"] else None
+
+def get_pending_serials(cursor: mariadb.Cursor, station_enabled: bool, all_flights: bool = False) -> List[str]:
+    """Get serials of flights which don't have derived metrics yet, or range statistics if the station is enabled"""
+
+    condition = "1=1" if all_flights else "duration IS NULL" + (" OR max_range IS NULL" if station_enabled else "")
+    cursor.execute(f"SELECT serial FROM meta WHERE {condition} ORDER BY serial")
+
+    return [result[0] for result in cursor.fetchall()]
+
+def backfill_flights(serials: List[str]) -> int:
+    """Calculate and store derived metrics (and range statistics if enabled) of flights. Runs in a worker process."""
+
+    try:
+        cursor = _db_conn.cursor()
+
+        placeholders = ", ".join(["?"] * len(serials))
+        cursor.execute("SELECT serial, time, altitude, speed, temperature, latitude, longitude FROM tracking " \
+                       f"WHERE serial IN ({placeholders}) ORDER BY serial, time", serials)
+
+        columns = list(rsdb.flight.DERIVED_METRICS)
+        if _station is not None:
+            columns += RANGE_COLUMNS
+
+        updates = []
+        for serial, rows in groupby(cursor.fetchall(), key=lambda row: row[0]):
+            rows = list(rows)
+            metrics = rsdb.flight.derive_metrics([(row[1], row[2], row[3], row[4]) for row in rows])
+            values = [metrics[metric] for metric in rsdb.flight.DERIVED_METRICS]
+
+            if _station is not None:
+                flight_range = rsdb.flight.RangeTracker(_station)
+                for row in rows:
+                    flight_range.add_position(row[5], row[6], row[2])
+                assert flight_range.first is not None and flight_range.last is not None and flight_range.max is not None # should never fail
+                values += [flight_range.first[0], flight_range.last[0], flight_range.last[1], *flight_range.max]
+
+            updates.append(values + [serial])
+
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        cursor.executemany(f"UPDATE meta SET {assignments} WHERE serial = ?", updates)
+        rsdb.changes.record(cursor, rsdb.changes.UPDATED, [update[-1] for update in updates])
+        _db_conn.commit()
+        cursor.close()
+
+        return len(updates)
+    except Exception as e:
+        logging.error(f"Got exception while backfilling {len(serials)} flights starting at '{serials[0]}': {e}")
+        logging.info(traceback.format_exc())
+        _db_conn.rollback()
+
+        return 0
@@ -0,0 +1,58 @@
+import logging
+from typing import Tuple
+
+import mariadb
+
+import src.rsdb as rsdb
+
+FETCH_SIZE = 50000 # Amount of flights read from the database at once
+
+CREATE_LAUNCH_SITES_SQL = """
+CREATE TEMPORARY TABLE IF NOT EXISTS attributed_launch_sites (
+serial VARCHAR(16) NOT NULL PRIMARY KEY,
+launch_site VARCHAR(64)
+);
+"""
+
+def attribute_flights(connection: mariadb.Connection, index: rsdb.launchsites.LaunchsiteIndex, all_flights: bool = False) -> Tuple[int, int]:
+    """
+    Attribute flights without a launch site (or all flights) to the nearest launch site of their first received position.
+    Returns the amount of flights checked and attributed.
+    """
+
+    cursor = connection.cursor()
+    cursor.execute(CREATE_LAUNCH_SITES_SQL)
+    cursor.execute("TRUNCATE TABLE attributed_launch_sites")
+
+    # Read flights in chunks by serial, and collect their launch sites in a temporary table
+    condition = "" if all_flights else " AND launch_site IS NULL"
+    checked = 0
+    attributed = 0
+    after = ""
+    while True:
+        cursor.execute(f"SELECT serial, first_rx_lat + 0E0, first_rx_lon + 0E0 FROM meta WHERE serial > ?{condition} " \
+                       "ORDER BY serial LIMIT ?", (after, FETCH_SIZE))
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            break
+        after = rows[-1][0]
+
+        launch_sites = [(serial, index.attribute(latitude, longitude)) for serial, latitude, longitude in rows]
+        checked += len(launch_sites)
+        attributed += sum(1 for _, launch_site in launch_sites if launch_site is not None)
+
+        # Flights that can't be attributed only need to be updated if they could have been attributed before
+        if not all_flights:
+            launch_sites = [row for row in launch_sites if row[1] is not None]
+        if len(launch_sites) > 0:
+            cursor.executemany("INSERT INTO attributed_launch_sites VALUES (?, ?)", launch_sites)
+        logging.info(f"Checked {checked} flights, {attributed} attributed to launch sites")
+
+    # Only flights whose launch site actually changed are recorded in the changes feed
+    cursor.execute("INSERT INTO changes (event, serial) SELECT ?, serial FROM meta JOIN attributed_launch_sites USING (serial) " \
+                   "WHERE NOT meta.launch_site <=> attributed_launch_sites.launch_site", (rsdb.changes.UPDATED,))
+    cursor.execute("UPDATE meta JOIN attributed_launch_sites USING (serial) SET meta.launch_site = attributed_launch_sites.launch_site")
+    connection.commit()
+    cursor.close()
+
+    return checked, attributed
@@ -0,0 +1,180 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import src.rsdb as rsdb
+
+from . import backfill, launchsites, rederive, retention
+
+REDERIVE_TASK = "rederive"
+
+
+def run_backfill(config, args: argparse.Namespace):
+    """Calculate derived metrics and range statistics of flights that don't have them yet"""
+
+    database = rsdb.database.connect(config) # Also ensures tables and columns exist before starting workers
+    cursor = database.cursor()
+    serials = backfill.get_pending_serials(cursor, config["station"]["enabled"], args.all)
+    cursor.close()
+    database.close()
+
+    if len(serials) == 0:
+        logging.info("All flights are up to date")
+        return
+
+    batches = [serials[i:i+args.batch_size] for i in range(0, len(serials), args.batch_size)]
+    processes = config["maintenance"]["processes"] or os.cpu_count()
+    logging.info(f"Backfilling {len(serials)} flights with {processes} processes")
+
+    # Process batches of flights in process pool, each worker has its own database connection
+    done = 0
+    start = time.time()
+    with ProcessPoolExecutor(processes, initializer=backfill.init_worker, initargs=(config,)) as executor:
+        for i, updated in enumerate(executor.map(backfill.backfill_flights, batches)):
+            done += updated
+            logging.info(f"({i+1}/{len(batches)}) {done} flights backfilled ({round(done / (time.time() - start), 1)} flights/s)")
+
+    logging.info(f"Done in {round(time.time() - start, 1)}s. Backfilled {done} of {len(serials)} flights")
+
+def run_rederive(config, args: argparse.Namespace):
+    """Recalculate speeds, burst points, meta flags and derived metrics of all or filtered flights. Resumes where a previous run stopped."""
+
+    search_params = {"serial": args.serial, "types": args.types, "date_start": args.start, "date_end": args.end}
+    filters = " ".join(f"{key}={','.join(value) if isinstance(value, list) else value}" # Progress is only resumed with the same filters
+                       for key, value in search_params.items() if value)
+
+    database = rsdb.database.connect(config) # Also ensures tables and columns exist before starting workers
+    cursor = database.cursor()
+    after = rederive.get_progress(cursor, REDERIVE_TASK, filters)
+    if args.restart:
+        after = None
+    elif after is not None:
+        logging.info(f"Resuming previous run after flight '{after}'")
+    serials = rederive.get_serials(cursor, after, **search_params)
+
+    if len(serials) == 0:
+        logging.info("No flights to re-derive")
+        rederive.set_progress(cursor, REDERIVE_TASK, filters, None)
+        database.commit()
+        return
+
+    batches = [serials[i:i+args.batch_size] for i in range(0, len(serials), args.batch_size)]
+    processes = config["maintenance"]["processes"] or os.cpu_count()
+    logging.info(f"Re-deriving {len(serials)} flights with {processes} processes")
+
+    # Process batches of flights in process pool, each worker has its own database connection.
+    # Results are returned in order, so the last serial of every finished batch is where a later run can resume.
+    done = 0
+    speeds = 0
+    start = time.time()
+    with ProcessPoolExecutor(processes, initializer=rederive.init_worker, initargs=(config,)) as executor:
+        for i, (flights, updated_speeds) in enumerate(executor.map(rederive.rederive_flights, batches)):
+            done += flights
+            speeds += updated_speeds
+            rederive.set_progress(cursor, REDERIVE_TASK, filters, batches[i][-1])
+            database.commit()
+
+            rate = done / (time.time() - start)
+            remaining = (len(serials) - done) / rate if rate > 0 else 0
+            logging.info(f"({i+1}/{len(batches)}) {done} flights re-derived, {speeds} speeds updated " \
+                         f"({round(rate, 1)} flights/s, {round(remaining / 60, 1)} minutes remaining)")
+
+    rederive.set_progress(cursor, REDERIVE_TASK, filters, None)
+    database.commit()
+    cursor.close()
+    database.close()
+
+    logging.info(f"Done in {round(time.time() - start, 1)}s. Re-derived {done} flights and updated {speeds} speeds")
+
+def run_launchsites(config, args: argparse.Namespace):
+    """Attribute flights to the nearest launch site in launchsites.txt"""
+
+    index = rsdb.launchsites.create_index(config)
+    if index is None:
+        logging.error("No launch sites to attribute flights to, add them to launchsites.txt first")
+        exit(1)
+
+    database = rsdb.database.connect(config)
+    start = time.time()
+    checked, attributed = launchsites.attribute_flights(database, index, args.all)
+    database.close()
+
+    logging.info(f"Done in {round(time.time() - start, 1)}s. Attributed {attributed} of {checked} flights to {len(index.launchsites)} launch sites")
+
+def run_retention(config, args: argparse.Namespace):
+    """Thin and archive the tracking data of old flights according to the retention policies"""
+
+    database = rsdb.database.connect(config)
+    start = time.time()
+    retention.run_retention(database, config["retention"])
+    database.close()
+
+    logging.info(f"Done in {round(time.time() - start, 1)}s")
+
+def run_indexes(config, args: argparse.Namespace):
+    """Create indexes which take long to build on large tables"""
+
+    database = rsdb.database.connect(config)
+    cursor = database.cursor()
+    if rsdb.database.has_index(cursor, "tracking", rsdb.database.TRACKING_POSITION_INDEX):
+        logging.info("Tracking position index already exists")
+    else:
+        logging.info("Creating tracking position index, this can take a while on large databases")
+        start = time.time()
+        cursor.execute(rsdb.database.CREATE_TRACKING_POSITION_INDEX_SQL)
+        logging.info(f"Done in {round(time.time() - start, 1)}s")
+    cursor.close()
+    database.close()
+
+def main():
+    rsdb.logging.set_up_logging("rsdb-maintenance") # Set up logging
+
+    config = rsdb.config.read_config() # Read config
+    rsdb.logging.set_logging_config(config) # Set logging config
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Maintenance tasks for the radiosondeDB database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_backfill = subparsers.add_parser("backfill", help="Calculate derived metrics (and range statistics if the station is enabled) of existing flights")
+    parser_backfill.add_argument("--all", action="store_true", help="Recalculate all flights instead of only those missing values")
+    parser_backfill.add_argument("--batch-size", type=int, default=100, help="Amount of flights processed per task (default: 100)")
+
+    parser_rederive = subparsers.add_parser("rederive", help="Recalculate missing speeds, burst points, meta flags and derived metrics of existing flights. " \
+                                                             "Resumes an interrupted run with the same filters.")
+    parser_rederive.add_argument("--serial", help="Only flights with this serial, with optional wildcard at the end using *")
+    parser_rederive.add_argument("--types", nargs="+", help="Only flights of these sonde types")
+    parser_rederive.add_argument("--start", type=date.fromisoformat, help="Only flights first received on or after this date (YYYY-MM-DD)")
+    parser_rederive.add_argument("--end", type=date.fromisoformat, help="Only flights first received on or before this date (YYYY-MM-DD)")
+    parser_rederive.add_argument("--restart", action="store_true", help="Start from the beginning instead of resuming an interrupted run")
+    parser_rederive.add_argument("--batch-size", type=int, default=100, help="Amount of flights processed per task (default: 100)")
+
+    parser_launchsites = subparsers.add_parser("launchsites", help="Attribute flights to the nearest launch site in launchsites.txt")
+    parser_launchsites.add_argument("--all", action="store_true", help="Attribute all flights again instead of only those without a launch site, " \
+                                                                       "for example after changing launchsites.txt")
+
+    subparsers.add_parser("retention", help="Thin and archive the tracking data of old flights according to the [retention] config section. " \
+                                            "Can be interrupted and run regularly, it continues where it stopped.")
+
+    subparsers.add_parser("indexes", help="Create indexes that take long to build on large tables, like the tracking position index " \
+                                          "used by vector tiles and track density maps. Flights are still received while they're built.")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "backfill":
+            run_backfill(config, args)
+        elif args.command == "rederive":
+            run_rederive(config, args)
+        elif args.command == "launchsites":
+            run_launchsites(config, args)
+        elif args.command == "retention":
+            run_retention(config, args)
+        elif args.command == "indexes":
+            run_indexes(config, args)
+    except KeyboardInterrupt:
+        logging.info("Got keyboard interrupt, shutting down..")
+        exit(1)
@@ -0,0 +1,234 @@
+import logging
+import math
+import traceback
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import mariadb
+
+import src.rsdb as rsdb
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FETCH_SIZE = 20000 # Amount of rows read from the database at once
+EARTH_RADIUS = 6371008.8 # Mean earth radius in meters, used for vectorized distances
+
+# Progress of resumable maintenance tasks, by task name
+CREATE_PROGRESS_SQL = """
+CREATE TABLE IF NOT EXISTS maintenance_progress (
+task VARCHAR(32) NOT NULL PRIMARY KEY,
+filters VARCHAR(255) NOT NULL,
+position VARCHAR(16) NOT NULL
+);
+"""
+
+# Recalculated values are written to temporary tables first, and then applied with one UPDATE ... JOIN each
+CREATE_SPEEDS_SQL = """
+CREATE TEMPORARY TABLE IF NOT EXISTS rederive_speeds (
+serial VARCHAR(16) NOT NULL,
+time DATETIME NOT NULL,
+speed DECIMAL(4, 1) NOT NULL,
+PRIMARY KEY(serial, time)
+);
+"""
+
+CREATE_META_SQL = f"""
+CREATE TEMPORARY TABLE IF NOT EXISTS rederive_meta (
+serial VARCHAR(16) NOT NULL PRIMARY KEY,
+has_humidity BOOLEAN NOT NULL,
+has_pressure BOOLEAN NOT NULL,
+has_battery BOOLEAN NOT NULL,
+has_burst_timer BOOLEAN NOT NULL,
+has_xdata BOOLEAN NOT NULL,
+burst_time DATETIME,
+burst_lat DECIMAL(9, 6),
+burst_lon DECIMAL(9, 6),
+burst_alt INT,
+{", ".join(f"{metric} DOUBLE" for metric in rsdb.flight.DERIVED_METRICS)}
+);
+"""
+
+META_COLUMNS = ["has_humidity", "has_pressure", "has_battery", "has_burst_timer", "has_xdata",
+                "burst_time", "burst_lat", "burst_lon", "burst_alt"] + list(rsdb.flight.DERIVED_METRICS)
+
+# serial, frame, time, latitude, longitude, altitude, speed, temperature and wether humidity, pressure, battery, burst timer and xdata are present
+row_type = Tuple[str, int, Any, float, float, int, Optional[float], Optional[float], int, int, int, int, int]
+
+# Per worker process state, set up by init_worker
+_db_conn: mariadb.Connection
+
+def init_worker(config: Dict[str, Any]):
+    """Initialize a re-derivation worker process with its own database connection"""
+
+    global _db_conn
+
+    _db_conn = rsdb.database.connect(config)
+
+def get_progress(cursor: mariadb.Cursor, task: str, filters: str) -> str | None:
+    """Get the last serial processed by a task with the same filters, or None if it should start from the beginning"""
+
+    cursor.execute(CREATE_PROGRESS_SQL)
+    cursor.execute("SELECT position FROM maintenance_progress WHERE task = ? AND filters = ?", (task, filters))
+    result = cursor.fetchone()
+
+    return None if result is None else result[0]
+
+def set_progress(cursor: mariadb.Cursor, task: str, filters: str, position: str | None):
+    """Store the last serial processed by a task, or remove its progress once it's done if position is None"""
+
+    if position is None:
+        cursor.execute("DELETE FROM maintenance_progress WHERE task = ?", (task,))
+    else:
+        cursor.execute("REPLACE INTO maintenance_progress VALUES (?, ?, ?)", (task, filters, position))
+
+def get_serials(cursor: mariadb.Cursor, after: str | None, **search_params: Any) -> List[str]:
+    """
+    Get serials of full resolution flights matching the search parameters (see rsdb.database.search_sondes) after a serial, sorted by serial.
+    Thinned and archived flights are skipped, as their values can't be calculated from all frames anymore.
+    """
+
+    conditions, params = rsdb.database.build_search_filter(**search_params)
+    conditions += " AND meta.retention = ?"
+    params.append(rsdb.archive.RETENTION_FULL)
+    if after is not None:
+        conditions += " AND meta.serial > ?"
+        params.append(after)
+    cursor.execute("SELECT serial FROM meta WHERE 1=1" + conditions + " ORDER BY serial", params)
+
+    return [result[0] for result in cursor.fetchall()]
+
+def _read_flights(cursor: mariadb.Cursor, serials: List[str]) -> Iterator[List[row_type]]:
+    """Internal function to read the frame sorted points of flights in chunks, yielding the points of one flight at a time"""
+
+    placeholders = ", ".join(["?"] * len(serials))
+    # Adding 0E0 makes the DB return doubles instead of decimals, which are much faster to convert
+    cursor.execute("SELECT serial, frame, time, latitude + 0E0, longitude + 0E0, altitude, speed + 0E0, temperature + 0E0, " \
+                   "humidity IS NOT NULL, pressure IS NOT NULL, battery IS NOT NULL, burst_timer IS NOT NULL, xdata IS NOT NULL " \
+                   f"FROM tracking WHERE serial IN ({placeholders}) ORDER BY serial, frame", serials)
+
+    flight: List[row_type] = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if len(rows) == 0:
+            break
+
+        for row in rows:
+            if len(flight) > 0 and row[0] != flight[0][0]:
+                yield flight
+                flight = []
+            flight.append(row)
+
+    if len(flight) > 0:
+        yield flight
+
+def is_missing_speed(speed: Optional[float]) -> bool:
+    """
+    Check if a speed value has to be recalculated. Speeds calculated for points between the first and last point of a flight
+    used to always be 0 due to a bug, and calculated speeds aren't marked, so all speeds of exactly 0 are recalculated.
+    """
+
+    return speed is None or speed == 0
+
+def calculate_speeds(rows: Sequence[row_type]) -> Dict[int, float]:
+    """
+    Calculate the speed of points of a frame sorted flight where it's missing (see is_missing_speed).
+    Returns a dict with the index of the point as key and the new speed in km/h (at most rsdb.flight.MAX_SPEED) as value.
+    Vectorized with numpy if it's installed, which uses haversine instead of geodesic distances (less than 0.5% difference).
+    """
+
+    if len(rows) < 2:
+        return {}
+
+    if np is None:
+        points = [(None if is_missing_speed(row[6]) else row[6], row[3], row[4], row[2]) for row in rows]
+        return rsdb.flight.calculate_missing_speeds(points)
+
+    missing = np.flatnonzero(np.array([is_missing_speed(row[6]) for row in rows]))
+    if len(missing) == 0:
+        return {}
+
+    # Distance and time between the points around every missing point, or the point itself at the ends
+    previous = np.maximum(missing - 1, 0)
+    next = np.minimum(missing + 1, len(rows) - 1)
+    latitudes = np.radians(np.array([row[3] for row in rows]))
+    longitudes = np.radians(np.array([row[4] for row in rows]))
+    times = np.array([row[2].timestamp() for row in rows])
+
+    lat1, lat2 = latitudes[previous], latitudes[next]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((longitudes[next] - longitudes[previous]) / 2) ** 2
+    distances = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+    speeds = np.round(np.minimum(distances / (times[next] - times[previous]) * rsdb.flight.MS_TO_KMH, rsdb.flight.MAX_SPEED), 1)
+
+    return dict(zip(missing.tolist(), speeds.tolist()))
+
+def _rederive_flight(rows: Sequence[row_type]) -> Tuple[Dict[int, float], List[Any]]:
+    """Internal function to recalculate the speeds and the values of meta columns (see META_COLUMNS) of a flight"""
+
+    speeds = calculate_speeds(rows)
+
+    # Flags are set from the last packet, like when the flight was finalized
+    last = rows[-1]
+    values: List[Any] = [bool(flag) for flag in last[8:13]]
+
+    burst_index = rsdb.flight.find_burst_index([row[5] for row in rows])
+    if burst_index is None:
+        values += [None, None, None, None]
+    else:
+        burst = rows[burst_index]
+        values += [burst[2], burst[3], burst[4], burst[5]]
+
+    metrics = rsdb.flight.derive_metrics([(row[2], row[5], speeds.get(i, row[6]), row[7]) for i, row in enumerate(rows)])
+    values += [metrics[metric] for metric in rsdb.flight.DERIVED_METRICS]
+
+    return speeds, values
+
+def rederive_flights(serials: List[str]) -> Tuple[int, int]:
+    """
+    Recalculate and store missing speeds, burst points, meta flags and derived metrics of flights.
+    Runs in a worker process. Returns the amount of flights and speeds updated.
+    """
+
+    try:
+        # Read flights unbuffered, so only one chunk of points is in memory at once
+        cursor = _db_conn.cursor(buffered=False)
+        speed_rows = []
+        meta_rows = []
+        for rows in _read_flights(cursor, serials):
+            speeds, values = _rederive_flight(rows)
+            speed_rows.extend((rows[i][0], rows[i][2], speed) for i, speed in speeds.items() if math.isfinite(speed))
+            meta_rows.append([rows[0][0]] + values)
+        cursor.close()
+
+        # Apply all updates with one join per table
+        cursor = _db_conn.cursor()
+        cursor.execute(CREATE_SPEEDS_SQL)
+        cursor.execute(CREATE_META_SQL)
+        cursor.execute("TRUNCATE TABLE rederive_speeds")
+        cursor.execute("TRUNCATE TABLE rederive_meta")
+
+        if len(speed_rows) > 0:
+            cursor.executemany("INSERT INTO rederive_speeds VALUES (?, ?, ?)", speed_rows)
+            cursor.execute("UPDATE tracking JOIN rederive_speeds USING (serial, time) SET tracking.speed = rederive_speeds.speed")
+
+        if len(meta_rows) > 0:
+            cursor.executemany(f"INSERT INTO rederive_meta VALUES ({', '.join(['?'] * (len(META_COLUMNS) + 1))})", meta_rows)
+            # Stored daily burst sketches (see dashboard.database.get_daily_burst_sketches) only notice changed amounts of bursts,
+            # so delete the ones of days with changed burst altitudes. They are created again when needed.
+            cursor.execute("DELETE FROM daily_sketches WHERE day IN (SELECT DATE(meta.first_rx_time) FROM meta JOIN rederive_meta USING (serial) " \
+                           "WHERE NOT meta.burst_alt <=> rederive_meta.burst_alt)")
+            assignments = ", ".join(f"meta.{column} = rederive_meta.{column}" for column in META_COLUMNS)
+            cursor.execute(f"UPDATE meta JOIN rederive_meta USING (serial) SET {assignments}")
+            rsdb.changes.record(cursor, rsdb.changes.UPDATED, [row[0] for row in meta_rows])
+
+        _db_conn.commit()
+        cursor.close()
+
+        return len(meta_rows), len(speed_rows)
+    except Exception as e:
+        logging.error(f"Got exception while re-deriving {len(serials)} flights starting at '{serials[0]}': {e}")
+        logging.info(traceback.format_exc())
+        _db_conn.rollback()
+
+        raise
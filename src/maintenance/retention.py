@@ -0,0 +1,137 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import mariadb
+
+import src.rsdb as rsdb
+
+DELETE_CHUNK_SIZE = 1000 # Amount of frames deleted with one statement when thinning
+
+def find_thinned_frames(times: Sequence[datetime], interval: float, keep: Sequence[Optional[datetime]] = ()) -> List[datetime]:
+    """
+    Get the times of the frames to delete when thinning a time sorted flight, so at least interval seconds are between kept frames.
+    The first and last frame and frames at the times in keep (like the burst) are always kept.
+    """
+
+    deleted = []
+    last_kept = None
+    for i, frame_time in enumerate(times):
+        if last_kept is None or i == len(times) - 1 or frame_time in keep or (frame_time - last_kept).total_seconds() >= interval:
+            last_kept = frame_time
+        else:
+            deleted.append(frame_time)
+
+    return deleted
+
+def _get_flights(cursor: mariadb.Cursor, retention: int, before: datetime, limit: int) -> List[Tuple[str, datetime, Optional[datetime]]]:
+    """Internal function to get serial, first receive time and burst time of flights below a retention state last received before a time"""
+
+    cursor.execute("SELECT serial, first_rx_time, burst_time FROM meta WHERE retention < ? AND last_rx_time < ? " \
+                   "ORDER BY last_rx_time LIMIT ?", (retention, before, limit))
+
+    return cursor.fetchall()
+
+def thin_flights(connection: mariadb.Connection, before: datetime, interval: float, batch_size: int) -> Tuple[int, int] | None:
+    """
+    Thin the next batch of full resolution flights last received before a time to one frame every interval seconds.
+    Returns the amount of flights thinned and frames deleted, or None if there are no flights left to thin.
+    """
+
+    cursor = connection.cursor()
+    flights = _get_flights(cursor, rsdb.archive.RETENTION_THINNED, before, batch_size)
+    if len(flights) == 0:
+        cursor.close()
+        return None
+
+    deleted_frames = 0
+    for serial, _, burst_time in flights:
+        cursor.execute("SELECT time FROM tracking WHERE serial = ? ORDER BY time", (serial,))
+        deleted = find_thinned_frames([result[0] for result in cursor.fetchall()], interval, [burst_time])
+
+        # Delete frames by primary key in chunks, so only the rows of this flight are locked
+        for i in range(0, len(deleted), DELETE_CHUNK_SIZE):
+            chunk = deleted[i:i+DELETE_CHUNK_SIZE]
+            placeholders = ", ".join(["?"] * len(chunk))
+            cursor.execute(f"DELETE FROM tracking WHERE serial = ? AND time IN ({placeholders})", [serial] + chunk)
+        deleted_frames += len(deleted)
+
+    placeholders = ", ".join(["?"] * len(flights))
+    cursor.execute(f"UPDATE meta SET retention = ? WHERE serial IN ({placeholders})",
+                   [rsdb.archive.RETENTION_THINNED] + [flight[0] for flight in flights])
+    rsdb.changes.record(cursor, rsdb.changes.UPDATED, [flight[0] for flight in flights])
+    connection.commit()
+    cursor.close()
+
+    return len(flights), deleted_frames
+
+def archive_flights(connection: mariadb.Connection, archive: rsdb.archive.TrackingArchive, before: datetime, batch_size: int) -> Tuple[int, int] | None:
+    """
+    Move the tracking data of the next batch of flights last received before a time to the archive.
+    Returns the amount of flights archived and frames moved, or None if there are no flights left to archive.
+    """
+
+    cursor = connection.cursor()
+    flights = _get_flights(cursor, rsdb.archive.RETENTION_ARCHIVED, before, batch_size)
+    if len(flights) == 0:
+        cursor.close()
+        return None
+
+    # Write flights to the archive files of their months before deleting them
+    months: Dict[str, Dict[str, Any]] = {}
+    moved_frames = 0
+    for serial, first_rx_time, _ in flights:
+        cursor.execute(f"SELECT {', '.join(rsdb.archive.TRACKING_COLUMNS)} FROM tracking WHERE serial = ? ORDER BY time", (serial,))
+        rows = cursor.fetchall()
+        months.setdefault(archive.month(first_rx_time), {})[serial] = rows
+        moved_frames += len(rows)
+
+    for month, month_flights in months.items():
+        archive.write_flights(month, month_flights)
+
+    serials = [flight[0] for flight in flights]
+    placeholders = ", ".join(["?"] * len(serials))
+    for serial in serials: # Delete by primary key prefix, so only the rows of this flight are locked
+        cursor.execute("DELETE FROM tracking WHERE serial = ?", (serial,))
+    cursor.execute(f"UPDATE meta SET retention = ? WHERE serial IN ({placeholders})", [rsdb.archive.RETENTION_ARCHIVED] + serials)
+    rsdb.changes.record(cursor, rsdb.changes.UPDATED, serials)
+    connection.commit()
+    cursor.close()
+
+    return len(flights), moved_frames
+
+def run_retention(connection: mariadb.Connection, retention_config: Dict[str, Any]):
+    """Apply the retention policies to all flights, in small batches with pauses between them"""
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None) # Times are stored in UTC
+    batch_size = retention_config["batch_size"]
+    pause = retention_config["batch_pause"]
+
+    # Archive first, so flights which are old enough for both aren't thinned before being archived
+    if retention_config["archive_days"] > 0:
+        archive = rsdb.archive.TrackingArchive(retention_config["archive_dir"])
+        before = now - timedelta(days=retention_config["archive_days"])
+        flights = frames = 0
+        while True:
+            result = archive_flights(connection, archive, before, batch_size)
+            if result is None:
+                break
+            flights += result[0]
+            frames += result[1]
+            logging.info(f"Archived {flights} flights ({frames} frames)")
+            time.sleep(pause)
+        logging.info(f"Done archiving, archived {flights} flights ({frames} frames)")
+
+    if retention_config["full_resolution_days"] > 0:
+        before = now - timedelta(days=retention_config["full_resolution_days"])
+        flights = frames = 0
+        while True:
+            result = thin_flights(connection, before, retention_config["thin_interval"], batch_size)
+            if result is None:
+                break
+            flights += result[0]
+            frames += result[1]
+            logging.info(f"Thinned {flights} flights ({frames} frames deleted)")
+            time.sleep(pause)
+        logging.info(f"Done thinning, thinned {flights} flights ({frames} frames deleted)")
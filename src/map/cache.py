@@ -0,0 +1,209 @@
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, List, Tuple
+
+RESCAN_FRACTION = 0.05 # Share of the maximum size a disk cache writes before getting its size from the directory again
+
+class MemoryCache():
+    """A size limited least recently used cache storing values in memory, keeping track of its hit rate"""
+
+    def __init__(self, name: str, max_size: int) -> None:
+        self.name = name
+        self.max_size = max_size # In bytes, as estimated by the caller when setting values
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[Hashable, Tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Get a value from the cache. Returns None if the key is not cached."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key) # Mark as recently used
+
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, size: int):
+        """Store a value with its estimated size in the cache, evicting the least recently used entries if the cache is full"""
+
+        if size > self.max_size: # Never cache values that don't fit
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def delete(self, key: Hashable):
+        """Delete a key from the cache if it exists"""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        """Delete all entries from the cache"""
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> str:
+        """Get a string with the hit rate and memory use of the cache for logging"""
+
+        lookups = self.hits + self.misses
+        hit_rate = 0 if lookups == 0 else round(self.hits / lookups * 100, 1)
+
+        return f"{self.name} cache: {len(self)} entries, {round(self.size / 1e6, 1)}/{round(self.max_size / 1e6, 1)}MB, " \
+               f"{hit_rate}% hit rate ({self.hits} hits, {self.misses} misses)"
+
+class DiskCache():
+    """
+    A size limited least recently used cache storing binary data in files in a directory.
+    Keys are relative file paths inside the cache directory.
+    File modification times are used to keep track of when a cache entry was last used.
+    The directory can be shared by multiple processes. Each one counts its own writes and gets the size of the whole
+    directory again after writing RESCAN_FRACTION of the maximum size, so the limit is exceeded by at most that per process.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size # In bytes
+
+        self._lock = threading.Lock()
+        self._written = 0 # Bytes written since the size was last taken from the directory
+
+        # Get size of already cached data
+        os.makedirs(self.directory, exist_ok=True)
+        self._rescan()
+        logging.debug(f"Disk cache '{self.directory}' contains {round(self.size / 1e6, 1)}MB")
+
+    def _path(self, key: str) -> str:
+        """Internal function to get the file path for a key"""
+
+        path = os.path.normpath(os.path.join(self.directory, key))
+        if not path.startswith(os.path.normpath(self.directory) + os.sep): # Prevent keys from escaping cache directory
+            raise ValueError(f"Invalid cache key '{key}'")
+
+        return path
+
+    def keys(self) -> List[str]:
+        """Get all keys currently in the cache"""
+
+        keys = []
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".tmp"): # Skip partially written files
+                    continue
+                keys.append(os.path.relpath(os.path.join(directory, filename), self.directory))
+
+        return keys
+
+    def get(self, key: str) -> bytes | None:
+        """Get data for a key from the cache. Returns None if the key is not cached."""
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def set(self, key: str, data: bytes):
+        """Store data for a key in the cache, evicting the least recently used entries if the cache is full"""
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to temporary file first to never serve partially written files. Its name is unique across processes.
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path) + ".", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except OSError:
+            os.remove(temp_path)
+            raise
+
+        with self._lock:
+            try:
+                self.size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(temp_path, path)
+            self.size += len(data)
+            self._written += len(data)
+
+            # Other processes may have written to or deleted from the directory as well
+            if self.size > self.max_size or self._written >= self.max_size * RESCAN_FRACTION:
+                self._rescan()
+
+    def delete(self, key: str):
+        """Delete a key from the cache if it exists"""
+
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
+
+    def _rescan(self):
+        """
+        Internal function to get the size of all entries in the directory,
+        and delete least recently used entries until the cache is at 90% of its maximum size if it's full
+        """
+
+        entries = []
+        for key in self.keys():
+            path = os.path.join(self.directory, key)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self.size = sum(size for _, size, _ in entries)
+        self._written = 0
+
+        if self.size <= self.max_size:
+            return
+        entries.sort()
+
+        evicted = 0
+        for _, size, path in entries:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            evicted += 1
+
+        logging.debug(f"Evicted {evicted} entries from disk cache '{self.directory}'")
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import mariadb
+
+import src.rsdb as rsdb
+
+_current = threading.local() # Token of the search running in the current thread
+
+STATEMENT_TIMEOUT_ERRNO = 1969 # MariaDB error when max_statement_time is exceeded
+
+class SearchCancelled(Exception):
+    """Raised in a search that was superseded by a newer search of the same session"""
+
+class SearchTimeout(SearchCancelled):
+    """Raised in a search that took longer than its time budget"""
+
+class SearchToken():
+    """State of a running search, used to cancel it"""
+
+    def __init__(self, connection_id: int, time_budget: float) -> None:
+        self.connection_id = connection_id
+        self.deadline = None if time_budget == 0 else time.time() + time_budget
+        self.cancelled = False
+        self.finished = False
+        self.lock = threading.Lock() # Held while killing the query, so the connection isn't returned to the pool meanwhile
+
+    def timed_out(self) -> bool:
+        """Check if the search has run out of time"""
+
+        return self.deadline is not None and time.time() > self.deadline
+
+    def check(self):
+        """Raise SearchCancelled if the search was cancelled or SearchTimeout if it ran out of time"""
+
+        if self.cancelled:
+            raise SearchCancelled("Search was superseded by a newer search")
+        elif self.timed_out():
+            raise SearchTimeout("Search ran out of time")
+
+def check():
+    """Raise SearchCancelled if the search running in the current thread was cancelled or ran out of time. Should be called regularly in long loops."""
+
+    token = getattr(_current, "token", None)
+    if token is not None:
+        token.check()
+
+class SearchTracker():
+    """
+    Keep track of running searches by session, so a search is cancelled when the same session starts a new one.
+    Cancelled searches stop at the next check, and their running query is killed.
+    """
+
+    def __init__(self, db_pool: rsdb.database.ProcessPool, time_budget: float) -> None:
+        self.db_pool = db_pool
+        self.time_budget = time_budget
+
+        self._searches: Dict[str, SearchToken] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def run(self, session_id: str, connection: mariadb.Connection) -> Iterator[SearchToken]:
+        """
+        Run a search of a session on a connection from the pool, cancelling the previous search of the session.
+        Limits the time of every query to the time budget. Raises SearchCancelled if the search is cancelled
+        and SearchTimeout if it runs out of time. The connection must only be returned to the pool after this returns.
+        """
+
+        token = SearchToken(connection.connection_id, self.time_budget)
+        with self._lock:
+            previous = self._searches.get(session_id)
+            self._searches[session_id] = token
+        if previous is not None:
+            self._cancel(previous)
+
+        cursor = connection.cursor()
+        cursor.execute(f"SET SESSION max_statement_time = {float(self.time_budget)}") # 0 is unlimited
+        cursor.close()
+
+        _current.token = token
+        try:
+            yield token
+        except mariadb.OperationalError as e: # Query was killed or exceeded max_statement_time
+            if token.cancelled:
+                raise SearchCancelled(str(e)) from e
+            elif token.timed_out() or getattr(e, "errno", None) == STATEMENT_TIMEOUT_ERRNO:
+                raise SearchTimeout(str(e)) from e
+            raise
+        finally:
+            _current.token = None
+            with token.lock:
+                token.finished = True
+            with self._lock:
+                if self._searches.get(session_id) is token:
+                    del self._searches[session_id]
+
+    def _cancel(self, token: SearchToken):
+        """Internal function to cancel a search and kill its running query"""
+
+        token.cancelled = True
+
+        with token.lock:
+            if not token.finished:
+                self._kill_query(token)
+
+    def _kill_query(self, token: SearchToken):
+        """Internal function to kill the running query of a search"""
+
+        try:
+            connection = rsdb.database.get_pool_connection(self.db_pool, 1)
+        except mariadb.PoolError:
+            logging.warning("No free database connection to cancel superseded search with, letting it stop by itself")
+            return
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"KILL QUERY {int(token.connection_id)}")
+            cursor.close()
+            logging.debug(f"Killed query of superseded search on connection {token.connection_id}")
+        except mariadb.Error as e: # The search may have finished its query in the meantime
+            logging.debug(f"Couldn't kill query of superseded search: {e}")
+        finally:
+            connection.close()
@@ -13,19 +13,36 @@ SONDE_TRACK_COLORS = [
 ]
 COLOR_MAX_CHANGE = 20 # Maximum amount to change the sonde track colors by
 
-def get_track_color() -> str:
-    """Get a color for a sonde track"""
+def get_track_color(serial: str | None = None) -> str:
+    """Get a color for a sonde track. If a serial is specified, the color is always the same for that serial."""
+
+    rng = random if serial is None else random.Random(serial)
 
     # Pick random color, remove # and convert to RGB
-    hex_color = random.choice(SONDE_TRACK_COLORS)[-6:]
+    hex_color = rng.choice(SONDE_TRACK_COLORS)[-6:]
     r = int(hex_color[0:2], 16)
     g = int(hex_color[2:4], 16)
     b = int(hex_color[4:6], 16)
     
     # Apply small random change to each value
-    new_r = max(0, min(255, r + random.randint(-COLOR_MAX_CHANGE, COLOR_MAX_CHANGE)))
-    new_g = max(0, min(255, g + random.randint(-COLOR_MAX_CHANGE, COLOR_MAX_CHANGE)))
-    new_b = max(0, min(255, b + random.randint(-COLOR_MAX_CHANGE, COLOR_MAX_CHANGE)))
+    new_r = max(0, min(255, r + rng.randint(-COLOR_MAX_CHANGE, COLOR_MAX_CHANGE)))
+    new_g = max(0, min(255, g + rng.randint(-COLOR_MAX_CHANGE, COLOR_MAX_CHANGE)))
+    new_b = max(0, min(255, b + rng.randint(-COLOR_MAX_CHANGE, COLOR_MAX_CHANGE)))
     
     # Convert back to hex
-    return f"#{new_r:02x}{new_g:02x}{new_b:02x}"
\ No newline at end of file
+    return f"#{new_r:02x}{new_g:02x}{new_b:02x}"
+
+DENSITY_COLORS = [(255, 237, 160), (254, 178, 76), (240, 59, 32), (128, 0, 38)] # Color scale from low to high density
+
+def get_density_color(value: float) -> str:
+    """Get a color for a density value between 0 and 1 by interpolating along the density color scale"""
+
+    position = max(0.0, min(1.0, value)) * (len(DENSITY_COLORS) - 1)
+    index = min(int(position), len(DENSITY_COLORS) - 2)
+    fraction = position - index
+
+    low = DENSITY_COLORS[index]
+    high = DENSITY_COLORS[index + 1]
+    r, g, b = (round(low[i] + (high[i] - low[i]) * fraction) for i in range(3))
+
+    return f"#{r:02x}{g:02x}{b:02x}"
@@ -1,30 +1,127 @@
-from collections import defaultdict
+from array import array
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
 import mariadb
 
+from src.rsdb.archive import RETENTION_ARCHIVED, TRACKING_COLUMNS, TrackingArchive
+from src.rsdb.flight import DERIVED_METRICS
 
-def get_flight_paths(cursor: mariadb.Cursor, serials: List[str]) -> Dict[str, List[Tuple[float, float]]]:
+from . import cancellation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PATH_CHUNK_SIZE = 500 # Amount of serials to get flight paths for per query
+PATH_FETCH_SIZE = 20000 # Amount of rows to fetch from the DB at once when getting flight paths
+
+archive: Optional[TrackingArchive] = None # Archive of flights moved out of the tracking table, set by the map if configured
+
+# Flight paths are numpy float64 arrays with a row of latitude and longitude per point if numpy is installed,
+# otherwise array('d') with alternating latitudes and longitudes. Use path_coordinates to convert them to lists.
+flight_path_type = Any
+
+def _finish_flight_path(path: array) -> flight_path_type:
+    """Internal function to convert a flight path from array('d') to a numpy array if numpy is available"""
+
+    if np is None:
+        return path
+
+    return np.frombuffer(path, dtype=np.float64).reshape(-1, 2) # Doesn't copy the data
+
+def get_flight_paths(cursor: mariadb.Cursor, serials: List[str]) -> Dict[str, flight_path_type]:
     """
-    Get lat/longs for flight paths of a list of sondes.
-    Returns a dict with serial as key and list of lat/longs as value.
+    Get lat/longs ordered by time for flight paths of a list of sondes.
+    Returns a dict with serial as key and the flight path as value.
+    Rows are streamed from the DB and decoded straight into float arrays to keep memory use low.
     """
 
-    # Get raw data from DB in one big query
-    placeholders = ", ".join(["?"] * len(serials))
-    cursor.execute(f"SELECT serial, latitude, longitude FROM tracking \
-                     WHERE serial IN ({placeholders})", serials) # Should this be ordered?
+    # Rows are read with an unbuffered cursor on the same connection, so only PATH_FETCH_SIZE rows are in memory at once
+    data = {}
+    stream_cursor = cursor.connection.cursor(buffered=False)
+    try:
+        for i in range(0, len(serials), PATH_CHUNK_SIZE):
+            chunk = serials[i:i+PATH_CHUNK_SIZE]
 
-    results = cursor.fetchall()
+            # Adding 0E0 makes the DB return doubles instead of decimals, which are much faster to convert
+            placeholders = ", ".join(["?"] * len(chunk))
+            stream_cursor.execute(f"SELECT serial, latitude + 0E0, longitude + 0E0 FROM tracking \
+                                    WHERE serial IN ({placeholders}) ORDER BY serial, time", chunk)
 
-    # Format data into dict
-    data = defaultdict(list)
-    for result in results:
-        data[result[0]].append((float(result[1]), float(result[2])))
+            current_serial = None
+            current_path = array("d")
+            while True:
+                results = stream_cursor.fetchmany(PATH_FETCH_SIZE)
+                if len(results) == 0:
+                    break
+                cancellation.check() # Stop fetching if the search was cancelled
+
+                for serial, latitude, longitude in results:
+                    if serial != current_serial:
+                        if current_serial is not None:
+                            data[current_serial] = _finish_flight_path(current_path)
+                        current_serial = serial
+                        current_path = array("d")
+                    current_path.append(latitude)
+                    current_path.append(longitude)
+
+            if current_serial is not None:
+                data[current_serial] = _finish_flight_path(current_path)
+    finally:
+        stream_cursor.close() # Also discards rows that weren't read, if the search was cancelled
+
+    # Read flights without tracking data from the archive
+    missing = [serial for serial in serials if serial not in data]
+    latitude_index, longitude_index = TRACKING_COLUMNS.index("latitude"), TRACKING_COLUMNS.index("longitude")
+    for serial, rows in _read_archived_flights(cursor, missing).items():
+        path = array("d")
+        for row in rows:
+            path.append(row[latitude_index])
+            path.append(row[longitude_index])
+        data[serial] = _finish_flight_path(path)
 
     return data
 
+def _read_archived_flights(cursor: mariadb.Cursor, serials: List[str]) -> Dict[str, List[List[Any]]]:
+    """Internal function to read the rows (see rsdb.archive.TRACKING_COLUMNS) of those flights of a list of sondes that are archived"""
+
+    if archive is None or len(serials) == 0:
+        return {}
+
+    placeholders = ", ".join(["?"] * len(serials))
+    cursor.execute(f"SELECT serial, first_rx_time FROM meta WHERE serial IN ({placeholders}) AND retention = ?",
+                   serials + [RETENTION_ARCHIVED])
+    archived = cursor.fetchall()
+    if len(archived) == 0:
+        return {}
+
+    return archive.read_flights_by_time(archived)
+
+def path_coordinates(path: flight_path_type, decimals: Optional[int] = None, lon_lat: bool = False) -> List[List[float]]:
+    """
+    Convert a flight path to a list of [latitude, longitude] points,
+    optionally rounded and in [longitude, latitude] order (as used in GeoJSON)
+    """
+
+    if np is not None:
+        if lon_lat:
+            path = path[:, ::-1]
+        if decimals is not None:
+            path = path.round(decimals)
+        return path.tolist()
+
+    latitudes = path[0::2]
+    longitudes = path[1::2]
+    if decimals is not None:
+        latitudes = [round(latitude, decimals) for latitude in latitudes]
+        longitudes = [round(longitude, decimals) for longitude in longitudes]
+
+    if lon_lat:
+        return [list(point) for point in zip(longitudes, latitudes)]
+    return [list(point) for point in zip(latitudes, longitudes)]
+
 metas_point = Tuple[datetime, float, float, int]
 metas_type = Dict[str, Tuple[metas_point, metas_point, Optional[metas_point]]]
 def get_flight_meta(cursor: mariadb.Cursor, serials: List[str]) -> metas_type:
@@ -58,11 +155,159 @@ def get_flight_meta(cursor: mariadb.Cursor, serials: List[str]) -> metas_type:
     return data
         
 
-def get_sonde_types(cursor: mariadb.Cursor) -> List[str]:
-    """Get a list of sonde types available in database"""
+def get_serials_by_first_rx(cursor: mariadb.Cursor) -> List[Tuple[str, str, datetime]]:
+    """Get serial, sonde type and first receive time of all flights"""
 
-    cursor.execute("SELECT DISTINCT sonde_type FROM meta;")
+    cursor.execute("SELECT serial, sonde_type, first_rx_time FROM meta;")
 
-    results = cursor.fetchall()
+    return cursor.fetchall()
+
+def get_sonde_types(cursor: mariadb.Cursor, serials: List[str]) -> List[Tuple[str, str]]:
+    """Get serial and sonde type of a list of flights"""
+
+    if len(serials) == 0:
+        return []
+
+    placeholders = ", ".join(["?"] * len(serials))
+    cursor.execute(f"SELECT serial, sonde_type FROM meta WHERE serial IN ({placeholders});", serials)
+
+    return cursor.fetchall()
+
+bounds_type = Tuple[float, float, float, float] # latitude min, longitude min, latitude max, longitude max
+search_filter_type = Tuple[str, List[Any]] # output of rsdb.database.build_search_filter
+
+def get_tile_tracks(cursor: mariadb.Cursor, bounds: bounds_type, search_filter: search_filter_type,
+                    cell_size: Tuple[float, float]) -> List[Tuple[str, datetime, float, float, int]]:
+    """
+    Get the tracking points inside of the specified bounds from flights matching a search filter, reduced to one point per flight
+    in each cell of a grid with the specified latitude and longitude size in degrees. So at low zoom levels, the amount of rows
+    returned depends on the size of the grid instead of the amount of points.
+    Returns a list of serial, time the flight entered the cell, average latitude and longitude in the cell
+    and retention state of the flight (see rsdb.archive) ordered by serial and time.
+    """
+
+    conditions, params = search_filter
+    # Adding 0E0 makes the DB return doubles instead of decimals, which are much faster to convert
+    cursor.execute(f"SELECT tracking.serial, MIN(tracking.time) AS cell_time, AVG(tracking.latitude) + 0E0, AVG(tracking.longitude) + 0E0, \
+                            MIN(meta.retention) \
+                     FROM tracking JOIN meta ON meta.serial = tracking.serial \
+                     WHERE tracking.latitude BETWEEN ? AND ? AND tracking.longitude BETWEEN ? AND ? {conditions} \
+                     GROUP BY tracking.serial, FLOOR(tracking.latitude / ?), FLOOR(tracking.longitude / ?) \
+                     ORDER BY tracking.serial, cell_time",
+                   [bounds[0], bounds[2], bounds[1], bounds[3]] + params + [cell_size[0], cell_size[1]])
+
+    return cursor.fetchall()
+
+def get_tile_meta(cursor: mariadb.Cursor, bounds: bounds_type, search_filter: search_filter_type) -> metas_type:
+    """
+    Get first receive, burst and last receive points of flights matching a search filter
+    that have at least one of these points inside of the specified bounds. Same format as get_flight_meta.
+    """
+
+    conditions, params = search_filter
+    point_conditions = []
+    point_params = []
+    for point in ("first_rx", "last_rx", "burst"):
+        point_conditions.append(f"({point}_lat BETWEEN ? AND ? AND {point}_lon BETWEEN ? AND ?)")
+        point_params.extend([bounds[0], bounds[2], bounds[1], bounds[3]])
+
+    cursor.execute(f"SELECT serial FROM meta WHERE ({' OR '.join(point_conditions)}) {conditions}",
+                   point_params + params)
+    serials = [result[0] for result in cursor.fetchall()]
+
+    if len(serials) == 0:
+        return {}
+
+    return get_flight_meta(cursor, serials)
+
+def get_flight_bounds(cursor: mariadb.Cursor, serials: List[str]) -> List[bounds_type]:
+    """Get the bounds of the flight paths of a list of sondes"""
+
+    placeholders = ", ".join(["?"] * len(serials))
+    cursor.execute(f"SELECT MIN(latitude), MIN(longitude), MAX(latitude), MAX(longitude) FROM tracking \
+                     WHERE serial IN ({placeholders}) GROUP BY serial", serials)
+
+    return [(float(result[0]), float(result[1]), float(result[2]), float(result[3])) for result in cursor.fetchall()]
+
+def get_search_bounds(cursor: mariadb.Cursor, search_filter: search_filter_type) -> bounds_type | None:
+    """Get the bounds of the first and last receive points of flights matching a search filter"""
+
+    conditions, params = search_filter
+    cursor.execute(f"SELECT LEAST(MIN(first_rx_lat), MIN(last_rx_lat)), LEAST(MIN(first_rx_lon), MIN(last_rx_lon)), \
+                            GREATEST(MAX(first_rx_lat), MAX(last_rx_lat)), GREATEST(MAX(first_rx_lon), MAX(last_rx_lon)) \
+                     FROM meta WHERE 1=1 {conditions}", params)
+    result = cursor.fetchone()
+
+    if result is None or result[0] is None:
+        return None
+
+    return float(result[0]), float(result[1]), float(result[2]), float(result[3])
+
+density_points_type = Literal["landing", "burst", "tracks"]
+density_cell_type = Tuple[float, float, int] # latitude and longitude of the south west corner, flight count
+
+def get_density(cursor: mariadb.Cursor, search_filter: search_filter_type, points: density_points_type, cell_size: float) -> List[density_cell_type]:
+    """
+    Get the amount of flights matching a search filter in each cell of a grid with the specified cell size in degrees.
+    points selects what is counted: the landing (last receive) points, the burst points or the track of each flight.
+    Only cells containing flights are returned.
+    """
+
+    conditions, params = search_filter
+    if points == "tracks":
+        cursor.execute(f"SELECT FLOOR(tracking.latitude / ?), FLOOR(tracking.longitude / ?), COUNT(DISTINCT tracking.serial) \
+                         FROM tracking JOIN meta ON meta.serial = tracking.serial \
+                         WHERE 1=1 {conditions} GROUP BY 1, 2", [cell_size, cell_size] + params)
+    else:
+        column = "last_rx" if points == "landing" else "burst"
+        cursor.execute(f"SELECT FLOOR(meta.{column}_lat / ?), FLOOR(meta.{column}_lon / ?), COUNT(*) FROM meta \
+                         WHERE meta.{column}_lat IS NOT NULL {conditions} GROUP BY 1, 2", [cell_size, cell_size] + params)
+
+    return [(int(result[0]) * cell_size, int(result[1]) * cell_size, result[2]) for result in cursor.fetchall()]
+
+def get_meta_watermark(cursor: mariadb.Cursor) -> Tuple[Optional[datetime], int]:
+    """Get the latest last receive time and the amount of flights in the meta table to detect changes"""
+
+    cursor.execute("SELECT MAX(last_rx_time), COUNT(*) FROM meta;")
+    result = cursor.fetchone()
+
+    return result[0], result[1]
+
+def get_serials_since(cursor: mariadb.Cursor, last_rx_time: datetime, search_filter: search_filter_type = ("", [])) -> List[str]:
+    """Get the serials of all flights with a last receive time after the specified time, optionally matching a search filter"""
+
+    conditions, params = search_filter
+    cursor.execute(f"SELECT serial FROM meta WHERE meta.last_rx_time > ? {conditions};", [last_rx_time] + params)
+
+    return [result[0] for result in cursor.fetchall()]
+
+profile_row_type = Tuple[datetime, int, Optional[float], Optional[float], Optional[float], Optional[float]] # time, altitude, temperature, humidity, pressure, speed
+
+def get_flight_profile(cursor: mariadb.Cursor, serial: str) -> List[profile_row_type]:
+    """Get time, altitude, temperature, humidity, pressure and speed of all points of a flight, sorted by time"""
+
+    # Adding 0E0 makes the DB return doubles instead of decimals, which are much faster to convert
+    cursor.execute("SELECT time, altitude, temperature + 0E0, humidity + 0E0, pressure + 0E0, speed + 0E0 FROM tracking \
+                    WHERE serial = ? ORDER BY time", (serial,))
+    rows = cursor.fetchall()
+    if len(rows) > 0:
+        return rows
+
+    # Read flight from the archive if it doesn't have tracking data
+    archived = _read_archived_flights(cursor, [serial])
+    if serial not in archived:
+        return []
+
+    indices = [TRACKING_COLUMNS.index(column) for column in ("time", "altitude", "temperature", "humidity", "pressure", "speed")]
+    return [(datetime.fromisoformat(row[indices[0]]),) + tuple(row[i] for i in indices[1:]) for row in archived[serial]]
+
+def get_flight_details(cursor: mariadb.Cursor, serial: str) -> Dict[str, Any] | None:
+    """Get the meta data and derived metrics of a flight by column name. Returns None if the flight isn't in meta (yet)."""
+
+    columns = ["sonde_type", "subtype", "frame_count", "frequency", "launch_site", "first_rx_time", "last_rx_time", "burst_alt"] + list(DERIVED_METRICS)
+    cursor.execute(f"SELECT {', '.join(columns)} FROM meta WHERE serial = ?", (serial,))
+    result = cursor.fetchone()
+    if result is None:
+        return None
 
-    return [sonde_type[0] for sonde_type in results]
+    return dict(zip(columns, result))
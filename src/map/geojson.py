@@ -0,0 +1,90 @@
+import math
+from typing import Any, Dict, List
+
+from . import color, database
+
+COORDINATE_DECIMALS = 5 # Decimals to round coordinates to (5 decimals is about 1m)
+
+def _point_feature(point: database.metas_point, flight_color: str, radius: int, name: str) -> Dict[str, Any]:
+    """Internal function to create a GeoJSON point feature for a POI dot"""
+
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [round(float(point[2]), COORDINATE_DECIMALS), round(float(point[1]), COORDINATE_DECIMALS)]
+        },
+        "properties": {
+            "color": flight_color,
+            "radius": radius,
+            "tooltip": f"{name} @ {point[3]}m on {point[0].strftime('%Y-%m-%d %H:%M:%S')}"
+        }
+    }
+
+def make_tracks(flight_paths: Dict[str, database.flight_path_type],
+                flights_meta: database.metas_type,
+                skip_poi_dots: bool) -> Dict[str, Any]:
+    """
+    Create a compact GeoJSON feature collection with flight tracks and optionally POI dots.
+    Coordinates are quantized, and styling is only passed as feature properties.
+    """
+
+    features = []
+    for serial, flight_path in flight_paths.items():
+        flight_color = color.get_track_color()
+
+        # Add flight line, GeoJSON uses longitude/latitude order
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": database.path_coordinates(flight_path, COORDINATE_DECIMALS, lon_lat=True)
+            },
+            "properties": {
+                "color": flight_color,
+                "tooltip": serial,
+                "serial": serial # Used to open the flight details when clicked
+            }
+        })
+
+        # Skip the POI dots if there are too many results
+        if skip_poi_dots:
+            continue
+
+        # Add dots for first receive, last receive and burst
+        first_rx, last_rx, burst = flights_meta[serial]
+        features.append(_point_feature(first_rx, flight_color, 3, "first receive"))
+        features.append(_point_feature(last_rx, flight_color, 3, "last receive"))
+        if burst is not None:
+            features.append(_point_feature(burst, flight_color, 4, "burst"))
+
+    return {"type": "FeatureCollection", "features": features}
+
+def make_density(cells: List[database.density_cell_type], cell_size: float) -> Dict[str, Any]:
+    """Create a GeoJSON feature collection with a square for every grid cell, colored by its flight count"""
+
+    if len(cells) == 0:
+        return {"type": "FeatureCollection", "features": []}
+
+    # Use logarithmic scale, as a few cells (e.g. around launch sites) have a lot more flights than the rest
+    max_count = max(cell[2] for cell in cells)
+    features = []
+    for lat, lon, count in cells:
+        lat_min = round(lat, COORDINATE_DECIMALS)
+        lon_min = round(lon, COORDINATE_DECIMALS)
+        lat_max = round(lat + cell_size, COORDINATE_DECIMALS)
+        lon_max = round(lon + cell_size, COORDINATE_DECIMALS)
+
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[lon_min, lat_min], [lon_max, lat_min], [lon_max, lat_max], [lon_min, lat_max], [lon_min, lat_min]]]
+            },
+            "properties": {
+                "color": color.get_density_color(math.log1p(count) / math.log1p(max_count)),
+                "tooltip": f"{count} flights"
+            }
+        })
+
+    return {"type": "FeatureCollection", "features": features}
@@ -0,0 +1,70 @@
+import json
+import queue
+from typing import Any, Dict, Iterator
+
+import flask
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.template import Template
+
+import src.rsdb as rsdb
+
+KEEPALIVE_INTERVAL = 15 # Seconds between keepalive comments on idle event streams, so proxies don't close them
+
+class LiveFeed():
+    """Pass live data of tracked sondes from the archiver on to browsers as server-sent events"""
+
+    def __init__(self, server: flask.Flask, live_config: Dict[str, Any]) -> None:
+        self.socket_dir = live_config["socket_dir"]
+        self.trail_length = live_config["trail_length"]
+        self.subscriber: rsdb.live.LiveSubscriber
+        server.add_url_rule("/live", "live", self._serve_events)
+
+    def start(self):
+        """Subscribe to the archiver. Called in every process serving requests, each gets its own socket (see rsdb.web.WebApp.start)."""
+
+        self.subscriber = rsdb.live.LiveSubscriber(self.socket_dir, "map", self.trail_length)
+
+    def _serve_events(self) -> flask.Response:
+        """Internal function to handle a request for the live event stream"""
+
+        listener, snapshot = self.subscriber.listen()
+
+        def stream() -> Iterator[str]:
+            try:
+                # Send current state first, then all further messages
+                yield f"event: reset\ndata: {json.dumps({'trail_length': self.trail_length})}\n\n"
+                for message in snapshot:
+                    yield f"data: {json.dumps(message)}\n\n"
+
+                while True:
+                    try:
+                        message = listener.get(timeout=KEEPALIVE_INTERVAL)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield f"data: {json.dumps(message)}\n\n"
+            finally:
+                self.subscriber.unlisten(listener)
+
+        return flask.Response(stream(), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class LiveLayer(JSCSSMixin, MacroElement):
+    """Show live sondes on a folium map, using the functions in assets/map/live.js"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJSON(null, rsdb.live.layerOptions).addTo({{ this._parent.get_name() }});
+            rsdb.live.connect(function(data) {
+                {{ this.get_name() }}.clearLayers();
+                {{ this.get_name() }}.addData(data);
+            });
+        {% endmacro %}
+    """)
+
+    default_js = [("rsdb_live", "/assets/map/live.js")]
+
+    def __init__(self):
+        super().__init__()
+        self._name = "LiveLayer"
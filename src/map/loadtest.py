@@ -0,0 +1,92 @@
+import argparse
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from typing import List
+
+import src.rsdb as rsdb
+
+from . import map
+
+def _load_flight_pages(host: str, port: int, serials: List[str], end: float, latencies: List[float], errors: List[int]):
+    """Internal function to open flight pages of random flights until the end time, running in a thread"""
+
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    while time.time() < end:
+        # Same request as the browser makes when a flight page is opened
+        pathname = map.FLIGHT_PAGE_PATH + urllib.parse.quote(random.choice(serials))
+        body = {
+            "output": "..flight_page.children...flight_page.style..",
+            "outputs": [{"id": "flight_page", "property": "children"}, {"id": "flight_page", "property": "style"}],
+            "inputs": [{"id": "url", "property": "pathname", "value": pathname}],
+            "changedPropIds": ["url.pathname"],
+            "state": []
+        }
+
+        start = time.time()
+        try:
+            connection.request("POST", "/_dash-update-component", json.dumps(body), {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=60)
+            ok = False
+
+        if ok:
+            latencies.append(time.time() - start)
+        else:
+            errors.append(1)
+    connection.close()
+
+def main():
+    rsdb.logging.set_up_logging("rsdb-map-loadtest") # Set up logging
+
+    config = rsdb.config.read_config() # Read config
+    rsdb.logging.set_logging_config(config) # Set logging config
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Measure how many flight pages per second a running map serves, " \
+                                                 "for example to compare rsdb-map with rsdb-map-serve and different worker counts")
+    parser.add_argument("--host", default="127.0.0.1", help="Host the map is running on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=config["map"]["port"], help="Port of the map (default: port in the [map] config section)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send requests for (default: 30)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Amount of requests sent in parallel (default: 8)")
+    parser.add_argument("--flights", type=int, default=1000, help="Amount of random flights to open pages of (default: 1000)")
+    args = parser.parse_args()
+
+    # Get flights to open
+    connection = rsdb.database.connect(config)
+    cursor = connection.cursor()
+    cursor.execute("SELECT serial FROM meta ORDER BY RAND() LIMIT ?", (args.flights,))
+    serials = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    connection.close()
+    if len(serials) == 0:
+        logging.error("There are no flights in the database to open")
+        exit(1)
+
+    logging.info(f"Opening pages of {len(serials)} flights with {args.concurrency} parallel requests for {args.duration}s")
+    latencies: List[float] = []
+    errors: List[int] = []
+    end = time.time() + args.duration
+    threads = [threading.Thread(target=_load_flight_pages, args=(args.host, args.port, serials, end, latencies, errors))
+               for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if len(latencies) == 0:
+        logging.error(f"All {len(errors)} requests failed, is the map running on {args.host}:{args.port}?")
+        exit(1)
+
+    latencies.sort()
+    logging.info(f"{round(len(latencies) / args.duration, 1)} requests/s, {len(errors)} failed. " \
+                 f"Latency: median {round(latencies[len(latencies) // 2] * 1000)}ms, " \
+                 f"95th percentile {round(latencies[int(len(latencies) * 0.95)] * 1000)}ms")
@@ -1,18 +1,42 @@
+from typing import Any, Dict
+
+import flask
+
 import src.rsdb as rsdb
 
 from . import map
 
 
-def main():
+def create(config: Dict[str, Any]) -> map.Map:
+    """Create the map with the output of rsdb.config.read_config() as the input"""
+
+    # Ensure tables exist, requests use connections from the pool
+    rsdb.database.connect(config).close()
+    db_pool = rsdb.database.create_pool(config, "rsdb-map", config["map"]["db_pool_size"])
+
+    return map.Map("map", config["map"], config["maptiles"], config["live"], config["retention"], config["changes"], db_pool)
+
+def _read_config() -> Dict[str, Any]:
+    """Internal function to set up logging and read the config"""
+
     rsdb.logging.set_up_logging("rsdb-map") # Set up logging
     
     config = rsdb.config.read_config() # Read config
     rsdb.logging.set_logging_config(config) # Set logging config
 
-    # Connect to DB
-    database = rsdb.database.connect(config)
+    return config
+
+def main():
+    # Start map with the development server
+    create(_read_config()).run()
+
+def create_app() -> flask.Flask:
+    """WSGI app factory for serving the map with any WSGI server, e.g. gunicorn "src.map.main:create_app()" """
+
+    return create(_read_config()).wsgi_app()
+
+def serve():
+    """Serve the map with gunicorn with multiple worker processes"""
 
-    # Start map
-    dash = map.Map("map", config["map"], config["maptiles"], database)
-    dash.run()
-    
\ No newline at end of file
+    config = _read_config()
+    rsdb.web.serve("rsdb-map", lambda: create(config).wsgi_app(), config["map"])
@@ -1,27 +1,92 @@
 import copy
 import hashlib
+import html as html_escape
+import json
 import logging
 import os
 import requests
 import socket
+import threading
 import time
-from datetime import date
-from typing import Any, Dict, List, Tuple, Literal
+import urllib.parse
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple, Literal, get_args
 
 import dash_bootstrap_components as dbc
+import flask
 import folium
+from folium.plugins import HeatMap, VectorGridProtobuf
 import mariadb
-from dash import Input, Output, State, dcc, html
+from dash import ALL, ClientsideFunction, Input, Output, Patch, State, dcc, html, no_update
+from dash.exceptions import PreventUpdate
 
 import src.rsdb as rsdb
 from src.rsdb.web import COLORS
 
-from . import color, database, launchsites
+from . import cache, cancellation, color, database, geojson, live, profiles, serial_index, shell, tileproxy, tiles
+
+try:
+    import dash_leaflet as dl
+except ImportError:
+    dl = None
 
 # Silence requests debug logs
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+CACHE_STATS_INTERVAL = 50 # Amount of search cache lookups after which cache stats are logged on info level
+FLIGHT_PAGE_PATH = "/flight/" # Path of the flight page, followed by the serial
+BUSY_TEXT = "The server is busy, please try again" # Shown if all database connections stay in use (see rsdb.database.get_pool_connection)
+FLIGHT_PAGE_STYLE = {
+    "position": "fixed",
+    "inset": 0,
+    "zIndex": 2000, # Show above the map and its overlays
+    "overflow": "auto",
+    "padding": "1rem",
+    "background": COLORS["background"],
+    "color": COLORS["text"]
+}
+
+def normalize_search_params(search_params: Dict[str, Any]) -> Tuple:
+    """Normalize search parameters into a hashable tuple, so equivalent searches are equal"""
+
+    normalized = []
+    for name, value in sorted(search_params.items()):
+        if isinstance(value, str):
+            value = value.strip()
+        if not value: # Empty lists, strings and zero are the same as not filtering
+            value = None
+        elif isinstance(value, list):
+            value = tuple(sorted(set(item.lower() if name == "data_fields" else item for item in value)))
+        elif isinstance(value, dict):
+            value = tuple(sorted((key, tuple(item)) for key, item in value.items()))
+        normalized.append((name, value))
+
+    return tuple(normalized)
+
+search_result_type = Tuple[Any, int, Optional[rsdb.database.page_key_type], bool] # see Map._search
+
+def _encode_page_key(page_key: rsdb.database.page_key_type) -> str:
+    """Internal function to encode the key of a page of search results for use in URLs"""
+
+    return f"{page_key[0].isoformat()},{page_key[1]}"
+
+def _decode_page_key(page_key: str) -> rsdb.database.page_key_type:
+    """Internal function to decode a page key created with _encode_page_key. Raises ValueError if invalid."""
+
+    first_rx_time, serial = page_key.split(",", 1)
+
+    return datetime.fromisoformat(first_rx_time), serial
+
 CONNECTION_CHECK_HOSTNAME = "one.one.one.one"
+def _flight_link(serial: str) -> str:
+    """Internal function to create the HTML of a link opening the flight page from the folium map iframe"""
+
+    href = html_escape.escape(FLIGHT_PAGE_PATH + urllib.parse.quote(serial, safe=""))
+    onclick = html_escape.escape(f"window.parent.rsdb.map.openFlight({json.dumps(serial)}); return false;")
+
+    return f'<a href="{href}" target="_top" onclick="{onclick}">{html_escape.escape(serial)} details</a>'
+
 def is_connected() -> bool:
     """Check if there is a working internet connection"""
 
@@ -41,49 +106,134 @@ class Map(rsdb.web.WebApp):
     def __init__(self, app_name: str,
                  map_config: Dict[str, Any],
                  maptiles_config: Dict[str, Any],
-                 connection: mariadb.Connection) -> None:
-        super().__init__(app_name, map_config, connection)
+                 live_config: Dict[str, Any],
+                 retention_config: Dict[str, Any],
+                 changes_config: Dict[str, Any],
+                 db_pool: rsdb.database.ProcessPool) -> None:
+        super().__init__(app_name, map_config, db_pool)
+
+        # Requests run on connections from the pool, so searches don't queue behind each other and can be cancelled
+        self.search_time_budget = map_config["search_time_budget"]
+        self.search_tracker = cancellation.SearchTracker(db_pool, self.search_time_budget)
+        self.search_timeout_text = f"Search took longer than {self.search_time_budget}s, please narrow it down"
+
+        # Caches are invalidated by the flights that changed in the database, see _handle_changes
+        self.change_feed = rsdb.changes.ChangeFeed(db_pool, changes_config["poll_interval"])
 
         self.poi_max_results = map_config["poi_max_results"]
+        self.flight_profiles = profiles.FlightProfiles(map_config["profile_points"], map_config["profile_cache_size"] * 1_000_000)
+        self.page_size = map_config["page_size"]
+        self.aggregate_min_results = map_config["aggregate_min_results"]
+        self.aggregate_points = map_config["aggregate_points"]
+        if self.aggregate_points not in get_args(database.density_points_type):
+            logging.error(f"Invalid aggregate_points '{self.aggregate_points}' in map config, " \
+                          f"must be one of {', '.join(get_args(database.density_points_type))}")
+            exit(1)
+        self.aggregate_cell_size = map_config["aggregate_cell_size"]
+
+        # Check which renderer to use
+        self.renderer: Literal["folium", "leaflet"] = map_config["renderer"]
+        if self.renderer == "leaflet" and dl is None:
+            logging.warning("Failed to import dash-leaflet. Falling back to the folium renderer. To use the leaflet renderer, run pip install with [leaflet]")
+            self.renderer = "folium"
+        logging.debug(f"Using {self.renderer} renderer")
 
         # Read launchsites
-        self.launchsites = launchsites.read_launchsites()
-
-        # Create empty map
-        tiles = folium.TileLayer(tiles=maptiles_config["url"],
-                                 attr=maptiles_config["attribution"],
-                                 min_zoom=maptiles_config["min_zoom"],
-                                 max_zoom=maptiles_config["max_zoom"])
-        self.empty_map = folium.Map(tiles=tiles)
-        
-        # If enabled, cache folium dependencies
-        if map_config["download_dependencies"] == True:
-            self._cache_folium_dependencies(self.empty_map)
+        self.launchsites = rsdb.launchsites.read_launchsites()
 
-        # Create copy of empty map with launchsites
-        self.launchsites_map = copy.deepcopy(self.empty_map)
-        for launchsite in self.launchsites:
-            folium.CircleMarker(
-                location=(launchsite[1], launchsite[2]),
-                radius=6,
-                color="black",
-                weight=2,
-                fill=True,
-                fill_opacity=0.1,
-                opacity=1,
-                tooltip=launchsite[0]
-            ).add_to(self.launchsites_map)
+        # If enabled, read flights moved out of the tracking table from the archive
+        if retention_config["archive_days"] > 0:
+            database.archive = rsdb.archive.TrackingArchive(retention_config["archive_dir"])
+
+        # If enabled, show sondes currently tracked by the archiver live
+        self.live_enabled = live_config["enabled"]
+        if self.live_enabled:
+            self.live_feed = live.LiveFeed(self.app.server, live_config)
+
+        # If enabled, load map tiles through caching proxy
+        if maptiles_config["proxy"]:
+            self.tile_proxy = tileproxy.TileProxy(maptiles_config, self.app.server)
+            maptiles_config = dict(maptiles_config, url="/maptiles/{z}/{x}/{y}.png")
+
+        if self.renderer == "folium":
+            # Create empty map
+            tile_layer = folium.TileLayer(tiles=maptiles_config["url"],
+                                          attr=maptiles_config["attribution"],
+                                          min_zoom=maptiles_config["min_zoom"],
+                                          max_zoom=maptiles_config["max_zoom"])
+            self.empty_map = folium.Map(tiles=tile_layer)
+            
+            # If enabled, cache folium dependencies
+            if map_config["download_dependencies"] == True:
+                self._cache_folium_dependencies(self.empty_map)
+
+            if self.live_enabled:
+                live.LiveLayer().add_to(self.empty_map)
+
+            # Create copy of empty map with launchsites
+            self.launchsites_map = copy.deepcopy(self.empty_map)
+            for launchsite in self.launchsites:
+                folium.CircleMarker(
+                    location=(launchsite[1], launchsite[2]),
+                    radius=6,
+                    color="black",
+                    weight=2,
+                    fill=True,
+                    fill_opacity=0.1,
+                    opacity=1,
+                    tooltip=launchsite[0]
+                ).add_to(self.launchsites_map)
+
+            # Render static parts of the maps once, search results are only added to a copy of the rendered shell
+            self.empty_map_html = self.empty_map.get_root().render()
+            self.map_shell = shell.MapShell(self.launchsites_map)
+
+            map_output = Output("map_iframe", "srcDoc")
+
+            # If enabled, set up vector tiles for large searches
+            self.vector_tiles_min_results = map_config["vector_tiles_min_results"]
+            if self.vector_tiles_min_results > 0:
+                self.tile_server = tiles.TileServer(self.app.server, self.db_pool, map_config["tile_cache_dir"],
+                                                    map_config["tile_cache_size"] * 1_000_000, self.change_feed,
+                                                    retention_config["thin_interval"], self.search_tracker)
+            self.page_size = 0 # Progressive loading is only supported by the leaflet renderer
+        else:
+            map_output = Output("tracks_layer", "data")
+
+            # If enabled, serve further pages of search results to load progressively after the first one
+            if self.page_size > 0:
+                self.app.server.add_url_rule("/search/page", "search_page", self._serve_search_page)
+
+        # Requests for tiles and search pages fail with 503 if all database connections stay in use
+        self.app.server.register_error_handler(mariadb.PoolError, lambda _: (BUSY_TEXT, 503))
+
+        # Set up search cache
+        self.search_cache = None
+        if map_config["search_cache_size"] > 0:
+            self.search_cache = cache.MemoryCache("Search", map_config["search_cache_size"] * 1_000_000)
+        self.search_cache_generation = 0 # Incremented when the cache is cleared, so results of searches running during that aren't cached
+        self.search_cache_watermark = None
+        self.search_cache_lock = threading.Lock() # Guards the search cache generation and watermark
 
         # Set up map update callback
+        outputs = [map_output, Output("flight_count", "children")]
+        if self.page_size > 0:
+            outputs.append(Output("search_pages", "data"))
+        if self.renderer == "leaflet":
+            outputs.extend([Output("search_state", "data"), Output("tracks_updates", "children")])
+
         @self.app.callback(
-            [Output("map_iframe", "srcDoc"),
-            Output("flight_count", "children")],
+            outputs,
             State("input_serial", "value"),
             State("input_data_fields", "value"),
             State("input_types", "value"),
             State("input_min_frames", "value"),
             State("input_date_start", "date"),
             State("input_date_end", "date"),
+            State({"type": "input_metric_min", "metric": ALL}, "value"),
+            State({"type": "input_metric_max", "metric": ALL}, "value"),
+            State("input_launch_site", "value"),
+            State("session_id", "data"),
             Input("button_search", "n_clicks")
         )
         def update_map(serial,
@@ -92,61 +242,263 @@ class Map(rsdb.web.WebApp):
                        min_frame_count,
                        date_start, 
                        date_end, 
+                       metric_mins,
+                       metric_maxs,
+                       launch_site,
+                       session_id,
                        n_clicks):
-            """Callback to update map"""
+            """Callback to update map. A running search of the same session is cancelled."""
 
             # Only run if user has clicked the button
             if n_clicks > 0:
-                cursor = self.db_conn.cursor()
-
-                # Convert date types from string to datetime.date
-                if date_start is not None:
-                    date_start = date.fromisoformat(date_start)
-                if date_end is not None:
-                    date_end = date.fromisoformat(date_end)
-
-                # Perform search in DB
-                logging.debug("Searching database")
-                map_start_time = time.time()
-                search_results = rsdb.database.search_sondes(
-                        cursor,
-                        serial,
-                        data_fields,
-                        types,
-                        min_frame_count,
-                        date_start,
-                        date_end
-                )
-                logging.debug(f"Got {len(search_results)} results")
+                try:
+                    connection = rsdb.database.get_pool_connection(self.db_pool)
+                except mariadb.PoolError:
+                    logging.warning("No free database connection for search")
+                    return [no_update, BUSY_TEXT] + [no_update] * (len(outputs) - 2)
+                try:
+                    with self.search_tracker.run(session_id, connection):
+                        return search(connection, serial, data_fields, types, min_frame_count, date_start, date_end,
+                                      metric_mins, metric_maxs, launch_site, session_id)
+                except cancellation.SearchTimeout:
+                    logging.info(f"Search took longer than {self.search_time_budget}s, cancelled it")
+                    return [no_update, self.search_timeout_text] + [no_update] * (len(outputs) - 2)
+                except cancellation.SearchCancelled:
+                    logging.debug("Search was superseded by a newer search, cancelled it")
+                    raise PreventUpdate
+                finally:
+                    connection.close()
 
-                # If there are results, create map. If not, return empty map;
-                if len(search_results) > 0:
-                    # Create map
-                    map = self._make_map(cursor, search_results)
-                else:
-                    map = self.empty_map
-                map_processing_time = time.time() - map_start_time
+        def search(connection, serial, data_fields, types, min_frame_count, date_start, date_end, metric_mins, metric_maxs, launch_site,
+                   session_id):
+            """Search and create the outputs of update_map"""
+
+            cursor = connection.cursor()
+
+            # Convert date types from string to datetime.date
+            if date_start is not None:
+                date_start = date.fromisoformat(date_start)
+            if date_end is not None:
+                date_end = date.fromisoformat(date_end)
+
+            # Get ranges of derived metrics that are filtered by, inputs are in the order of DERIVED_METRICS
+            metric_ranges = {metric: (minimum, maximum) for metric, minimum, maximum
+                             in zip(rsdb.flight.DERIVED_METRICS, metric_mins, metric_maxs)
+                             if minimum is not None or maximum is not None}
+
+            # Perform search and create map. Flights added after the watermark are added when refreshing.
+            map_start_time = time.time()
+            watermark = database.get_meta_watermark(cursor)[0]
+            search_params = {
+                "serial": (serial or "").strip() or None, # Searched and cached the same with or without surrounding spaces
+                "data_fields": data_fields,
+                "types": types,
+                "min_frame_count": min_frame_count,
+                "date_start": date_start,
+                "date_end": date_end,
+                "metric_ranges": metric_ranges,
+                "launch_site": launch_site
+            }
+            map_data, result_count, next_page, aggregated = self._search(cursor, search_params)
+            if next_page is not None:
+                total_count = rsdb.database.count_sondes(cursor, **search_params)
+            else:
+                total_count = result_count
+            map_processing_time = time.time() - map_start_time
+            cursor.close()
+
+            # Create text for flight count map overlay
+            if aggregated:
+                flight_count_text = f"({round(map_processing_time, 1)}s) Showing density of {result_count} flights"
+            else:
+                flight_count_text = f"({round(map_processing_time, 1)}s) Showing {result_count} flights"
+
+            # Let the client load the remaining pages, see loadPages in assets/map/leaflet.js
+            if self.page_size > 0 and next_page is not None:
+                flight_count_text += ", loading more..."
+            search_pages = {
+                "query": tiles.encode_search_query(search_params),
+                "after": None if next_page is None else _encode_page_key(next_page),
+                "count": result_count,
+                "elapsed": map_processing_time,
+                "session": session_id # Loading pages is cancelled by a new search of the session, like the search itself
+            }
+
+            # Remember search for refreshing, and clear flights added by previous refreshes
+            search_state = {
+                "query": tiles.encode_search_query(search_params),
+                "watermark": None if watermark is None else watermark.isoformat(),
+                "count": total_count,
+                "aggregated": aggregated
+            }
+
+            results = [map_data, flight_count_text]
+            if self.page_size > 0:
+                results.append(search_pages)
+            if self.renderer == "leaflet":
+                results.extend([search_state, []])
+            return results
+
+        # Set up refresh callback
+        auto_refresh_interval = map_config["auto_refresh_interval"]
+        refresh_outputs = [Output("button_search", "n_clicks")]
+        if self.renderer == "leaflet":
+            refresh_outputs.extend([Output("tracks_updates", "children", allow_duplicate=True),
+                                    Output("flight_count", "children", allow_duplicate=True),
+                                    Output("search_state", "data", allow_duplicate=True)])
+
+        @self.app.callback(
+            refresh_outputs,
+            Input("button_refresh", "n_clicks"),
+            Input("auto_refresh", "n_intervals"),
+            State("button_search", "n_clicks"),
+            State("search_state", "data")
+        )
+        def refresh_map(refresh_clicks, n_intervals, search_clicks, search_state):
+            """
+            Callback to add flights added since the last search or refresh to the map.
+            If that's not possible, the search is run again by clicking the search button.
+            """
+
+            if search_clicks == 0: # Nothing to refresh
+                return [no_update] * len(refresh_outputs)
+            elif self.renderer == "folium" or search_state is None:
+                return [search_clicks + 1] + [no_update] * (len(refresh_outputs) - 1)
+
+            start = time.time()
+            try:
+                connection = rsdb.database.get_pool_connection(self.db_pool)
+            except mariadb.PoolError: # Try again with the next refresh
+                logging.warning("No free database connection for refreshing search")
+                return [no_update, no_update, BUSY_TEXT, no_update]
+            try:
+                cursor = connection.cursor()
+                refresh = self._refresh(cursor, search_state)
                 cursor.close()
+            finally:
+                connection.close()
+
+            if refresh is None:
+                logging.debug("Can't refresh search, running it again")
+                return [search_clicks + 1, no_update, no_update, no_update]
+
+            tracks, added, search_state = refresh
+            if added == 0:
+                return [no_update, no_update, no_update, search_state]
+
+            # Only send the tracks of the added flights as a new layer
+            tracks_updates = Patch()
+            tracks_updates.append(dl.GeoJSON(data=tracks,
+                                             style={"variable": "rsdb.map.trackStyle"},
+                                             pointToLayer={"variable": "rsdb.map.pointToLayer"},
+                                             onEachFeature={"variable": "rsdb.map.onEachTrack"}))
+            flight_count_text = f"({round(time.time() - start, 1)}s) Showing {search_state['count']} flights, {added} new"
 
-                # Create text for flight count map overlay
-                flight_count_text = f"({round(map_processing_time, 1)}s) Showing {len(search_results)} flights"
+            return [no_update, tracks_updates, flight_count_text, search_state]
 
-                return map.get_root().render(), flight_count_text
+        if self.renderer == "leaflet" and self.live_enabled:
+            self.app.clientside_callback(
+                ClientsideFunction(namespace="rsdb_map", function_name="connectLive"),
+                Output("live_layer", "data"),
+                Input("live_layer", "id"),
+                prevent_initial_call=False # Connect when the page is loaded
+            )
+
+        if self.page_size > 0:
+            self.app.clientside_callback(
+                ClientsideFunction(namespace="rsdb_map", function_name="loadPages"),
+                Output("tracks_pages", "children"),
+                Input("search_pages", "data"),
+                prevent_initial_call=True
+            )
             
-        # Get available types from DB
-        # TODO: this should update every once in a while without having to restart
-        cursor = self.db_conn.cursor()
-        available_sonde_types = database.get_sonde_types(cursor)
+        @self.app.callback(
+            Output("flight_page", "children"),
+            Output("flight_page", "style"),
+            Input("url", "pathname"),
+            prevent_initial_call=False # Open the flight page if it's loaded directly
+        )
+        def update_flight_page(pathname):
+            """Callback to show the details and profiles of a flight when its page is opened, see openFlight in assets/map/leaflet.js"""
+
+            if pathname is None or not pathname.startswith(FLIGHT_PAGE_PATH):
+                return [], {"display": "none"}
+
+            serial = urllib.parse.unquote(pathname[len(FLIGHT_PAGE_PATH):])
+            start = time.time()
+            try:
+                connection = rsdb.database.get_pool_connection(self.db_pool)
+            except mariadb.PoolError:
+                logging.warning("No free database connection for flight page")
+                return [dcc.Link("< Back to map", href="/"), html.P(BUSY_TEXT)], FLIGHT_PAGE_STYLE
+            try:
+                cursor = connection.cursor()
+                details, start_time, flight_profiles = self.flight_profiles.get(cursor, serial)
+                cursor.close()
+            finally:
+                connection.close()
+            logging.debug(f"Loaded flight page of '{serial}' in {round(time.time()-start, 2)}s. {self.flight_profiles.cache.stats()}")
+
+            return profiles.make_page(serial, details, flight_profiles, start_time), FLIGHT_PAGE_STYLE
+
+        # Load serials and sonde types for suggestions and the sonde type filter
+        connection = rsdb.database.get_pool_connection(self.db_pool)
+        cursor = connection.cursor()
+        self.serial_index = serial_index.SerialIndex(cursor)
+        if self.aggregate_min_results > 0 and self.aggregate_points == "tracks" \
+           and not rsdb.database.has_index(cursor, "tracking", rsdb.database.TRACKING_POSITION_INDEX):
+            logging.warning("Tracking table has no position index, track density maps will be slow. Create it with rsdb-maintenance indexes")
         cursor.close()
+        connection.close()
+        self.serial_suggestions = map_config["serial_suggestions"]
+        self.change_feed.subscribe(self._handle_changes)
 
-        # Prepare inputs
-        input_serial = dcc.Input(
-            id="input_serial",
-            type="text",
-            placeholder="Serial",
-            className="w-100",
-            style={"height": "100%"}
+        @self.app.callback(
+            Output("serial_suggestions", "children"),
+            Input("input_serial", "value")
         )
+        def update_serial_suggestions(serial):
+            """Callback to suggest serials starting with the entered text"""
+
+            serial = (serial or "").strip().rstrip("*")
+            if len(serial) == 0:
+                return []
+
+            return [html.Option(value=suggestion) for suggestion in self.serial_index.lookup(serial, self.serial_suggestions)]
+
+        @self.app.callback(
+            Output("input_types", "options"),
+            Input("types_refresh_interval", "n_intervals")
+        )
+        def update_sonde_types(n_intervals):
+            """Callback to periodically update the available sonde types"""
+
+            try:
+                connection = rsdb.database.get_pool_connection(self.db_pool)
+            except mariadb.PoolError: # Checking the serial index can wait until the next update
+                return sorted(self.serial_index.sonde_types)
+            try:
+                cursor = connection.cursor()
+                self.serial_index.check(cursor)
+                cursor.close()
+            finally:
+                connection.close()
+
+            return sorted(self.serial_index.sonde_types)
+
+        # Prepare inputs
+        input_serial = html.Div([
+            dcc.Input(
+                id="input_serial",
+                type="text",
+                placeholder="Serial",
+                list="serial_suggestions",
+                autoComplete="off",
+                className="w-100",
+                style={"height": "100%"}
+            ),
+            html.Datalist(id="serial_suggestions")
+        ], style={"height": "100%"})
         
         # FIXME: Dropdowns don't scale properly on small heights
         data_field_options = ["humidity", "pressure", "XDATA"]
@@ -162,7 +514,7 @@ class Map(rsdb.web.WebApp):
 
         input_types = dcc.Dropdown(
             id="input_types",
-            options=available_sonde_types,
+            options=sorted(self.serial_index.sonde_types),
             placeholder="Sonde Types",
             multi=True,
             searchable=False,
@@ -200,31 +552,99 @@ class Map(rsdb.web.WebApp):
             style={"height": "100%"}
         )
 
+        button_refresh = html.Button(
+            "Refresh",
+            id="button_refresh",
+            n_clicks=0,
+            className="w-100",
+            style={"height": "100%"}
+        )
+
+        button_filters = html.Button(
+            "Filters",
+            id="button_filters",
+            n_clicks=0,
+            className="w-100",
+            style={"height": "100%"}
+        )
+
+        # Range filters for derived metrics and the launch site filter, hidden until the filters button is clicked
+        metric_filters = dbc.Collapse(dbc.Container(dbc.Row([
+            dbc.Col([
+                html.Div(label, style={"color": COLORS["text"], "fontSize": "0.8rem"}),
+                dbc.InputGroup([
+                    dcc.Input(id={"type": "input_metric_min", "metric": metric}, type="number", placeholder="Min.", className="w-50"),
+                    dcc.Input(id={"type": "input_metric_max", "metric": metric}, type="number", placeholder="Max.", className="w-50")
+                ])
+            ], width=2) for metric, label in rsdb.flight.DERIVED_METRICS.items()
+        ] + [
+            dbc.Col([
+                html.Div("Launch site", style={"color": COLORS["text"], "fontSize": "0.8rem"}),
+                dcc.Dropdown(
+                    options=sorted(launchsite[0] for launchsite in self.launchsites),
+                    id="input_launch_site",
+                    placeholder="Launch site"
+                )
+            ], width=2)
+        ], class_name="g-1"), fluid=True), id="metric_filters", is_open=False)
+
+        @self.app.callback(
+            Output("metric_filters", "is_open"),
+            Input("button_filters", "n_clicks"),
+            State("metric_filters", "is_open")
+        )
+        def toggle_metric_filters(n_clicks, is_open):
+            """Callback to show or hide the derived metric filters"""
+
+            return not is_open
+
         # Arrange inputs
         inputs = dbc.Container([
             dbc.Row([
-                dbc.Col(input_serial, width=4),
+                dbc.Col(input_serial, width=2),
                 dbc.Col(input_data_fields, width=2, style={"height": "5vh"}),
                 dbc.Col(input_types, width=2, style={"height": "5vh"}),
                 dbc.Col(input_min_frames, width=1),
                 dbc.Col(input_date_start, width=1),
                 dbc.Col(input_date_end, width=1),
-                dbc.Col(button_search, width=1)
+                dbc.Col(button_search, width=1),
+                dbc.Col(button_filters, width=1),
+                dbc.Col(button_refresh, width=1)
             ], class_name="g-0", style={"height": "5vh"})
         ], style={"width": "100%", "height": "5vh", "flex": "0 0 auto"}, fluid=True)
+        inputs = [inputs, metric_filters]
+
+        # Create map element
+        if self.renderer == "leaflet":
+            map_element = self._create_leaflet_map(maptiles_config)
+        else:
+            map_element = html.Iframe(
+                id="map_iframe",
+                srcDoc=self.empty_map_html,
+                style={"width": "100%", "height": "100%"}
+            )
 
-        # Set app layout
-        self.app.layout = html.Div([
+        # Set app layout. It's created for every page load to give every session its own id.
+        self._layout_children = [
             html.Div(inputs, style={"width": "100%"}),
             html.Div([
-                html.Iframe(
-                    id="map_iframe",
-                    srcDoc=self.empty_map.get_root().render(),
-                    style={"width": "100%", "height": "100%"}
-                ),
+                map_element,
                 html.Div("(0.0s) Showing 0 flights", id="flight_count", className="overlay-text")
-            ], style={"flex": "1 1 auto", "overflow": "auto"})
-        ], style={"height": "100vh", "display": "flex", "flexDirection": "column"})
+            ], style={"flex": "1 1 auto", "overflow": "auto"}),
+            html.Div(id="flight_page", style={"display": "none"}), # Shown above the map, so it keeps its state
+            dcc.Location(id="url"),
+            dcc.Store(id="search_pages"),
+            dcc.Store(id="search_state"),
+            dcc.Interval(id="types_refresh_interval", interval=60_000),
+            dcc.Interval(id="auto_refresh", interval=max(auto_refresh_interval, 1) * 1000, disabled=auto_refresh_interval == 0)
+        ]
+        self.app.layout = self._serve_layout
+
+    def _serve_layout(self) -> html.Div:
+        """Internal function to create the app layout with a new session id, used to cancel superseded searches"""
+
+        return html.Div(self._layout_children + [dcc.Store(id="session_id", data=uuid.uuid4().hex)],
+                        style={"height": "100vh", "display": "flex", "flexDirection": "column"})
         
     def _cache_folium_dependencies(self, map: folium.Map):
         """Download required js and css dependencies of a folium map to local storage"""
@@ -293,8 +713,311 @@ class Map(rsdb.web.WebApp):
             path = os.path.join(lib_path, file)
             os.remove(path)
 
-    def _make_map(self, cursor: mariadb.Cursor, serials: List[str]):
-        """Generate the map with data from the database"""
+    def _search(self, cursor: mariadb.Cursor, search_params: Dict[str, Any]) -> search_result_type:
+        """
+        Search for flights and create map data for the results with the selected renderer.
+        If progressive loading is enabled, only the first page of results is included.
+        Uses the search cache if enabled. Returns the map data, amount of results,
+        the key of the next page if there is one and wether the results are shown as density.
+        """
+
+        # Check cache
+        cache_key = None
+        with self.search_cache_lock:
+            generation = self.search_cache_generation
+        if self.search_cache is not None:
+            # The cache is cleared by the changes feed, this catches changes it missed (see rsdb.changes.GAP_TIMEOUT)
+            watermark = database.get_meta_watermark(cursor)
+            with self.search_cache_lock:
+                if watermark != self.search_cache_watermark:
+                    if self.search_cache_watermark is not None:
+                        logging.debug("Flights have changed, clearing search cache")
+                    self.search_cache_generation += 1
+                    self.search_cache.clear()
+                    self.search_cache_watermark = watermark
+                generation = self.search_cache_generation
+
+            cache_key = (self.renderer, normalize_search_params(search_params))
+            cached = self.search_cache.get(cache_key)
+            self._log_search_cache_stats()
+            if cached is not None:
+                logging.debug("Got search results from cache")
+                return cached
+
+        # Show the density of flights instead of their tracks for very large searches
+        if self.aggregate_min_results > 0:
+            result_count = rsdb.database.count_sondes(cursor, **search_params)
+            if result_count >= self.aggregate_min_results:
+                result = (self._make_density(cursor, search_params), result_count, None, True)
+                self._cache_search_result(cache_key, generation, result)
+                return result
+
+        # Perform search in DB, only getting the newest flights first if progressive loading is enabled
+        logging.debug("Searching database")
+        next_page = None
+        if self.page_size > 0:
+            search_results, next_page = rsdb.database.search_sondes_page(cursor, self.page_size, **search_params)
+        else:
+            search_results = rsdb.database.search_sondes(cursor, **search_params)
+        logging.debug(f"Got {len(search_results)} results")
+
+        # Create map data with the selected renderer
+        if self.renderer == "leaflet":
+            map_data = self._make_tracks(cursor, search_results)
+        elif len(search_results) > 0: # If there are results, create map. If not, return empty map
+            map_data = self._make_map(cursor, search_results, search_params)
+        else:
+            map_data = self.empty_map_html
+
+        result = (map_data, len(search_results), next_page, False)
+        self._cache_search_result(cache_key, generation, result)
+
+        return result
+
+    def _cache_search_result(self, cache_key: Any, generation: int, result: search_result_type):
+        """
+        Internal function to add a search result to the search cache with its estimated size, if enabled.
+        Results are dropped if the cache was cleared since the search started, as they may be outdated.
+        """
+
+        if self.search_cache is None:
+            return
+
+        map_data = result[0]
+        size = len(map_data) if isinstance(map_data, str) else len(json.dumps(map_data))
+        with self.search_cache_lock:
+            if generation == self.search_cache_generation:
+                self.search_cache.set(cache_key, result, size)
+
+    def start(self):
+        """Start checking for changed flights and receiving live data in this process"""
+
+        self.change_feed.start()
+        if self.live_enabled:
+            self.live_feed.start()
+
+    def _handle_changes(self, changes: List[rsdb.changes.change_type]):
+        """Internal function to invalidate cached data of flights that changed, called by the changes feed"""
+
+        finalized = [serial for _, event, serial in changes if event == rsdb.changes.FINALIZED]
+        updated = [serial for _, event, serial in changes if event == rsdb.changes.UPDATED]
+
+        # Search results only contain flights in meta, so flights being received or wiped don't affect them
+        if len(finalized) > 0 or len(updated) > 0:
+            with self.search_cache_lock:
+                self.search_cache_generation += 1
+                if self.search_cache is not None:
+                    logging.debug(f"{len(finalized)} flights finalized and {len(updated)} updated, clearing search cache")
+                    self.search_cache.clear()
+
+        self.flight_profiles.invalidate(updated)
+
+        if len(finalized) > 0:
+            connection = rsdb.database.get_pool_connection(self.db_pool)
+            try:
+                cursor = connection.cursor()
+                self.serial_index.add(cursor, finalized)
+                cursor.close()
+            finally:
+                connection.close()
+
+    def _refresh(self, cursor: mariadb.Cursor, search_state: Dict[str, Any]) -> Tuple[Dict[str, Any], int, Dict[str, Any]] | None:
+        """
+        Get tracks of flights added to the results of a search since it was run or last refreshed.
+        Returns the tracks, amount of added flights and the new search state, or None if the search
+        has to be run again because flights were removed from the results or the results are shown as density.
+        """
+
+        if search_state["aggregated"]:
+            return None
+
+        search_params = tiles.parse_search_query(dict(urllib.parse.parse_qsl(search_state["query"])))
+        watermark = database.get_meta_watermark(cursor)[0]
+        previous_watermark = None if search_state["watermark"] is None else datetime.fromisoformat(search_state["watermark"])
+
+        # Get flights received after the previous watermark, which only scales with the amount of new flights
+        if previous_watermark is None:
+            new_serials = rsdb.database.search_sondes(cursor, **search_params)
+        elif watermark is None or watermark <= previous_watermark:
+            new_serials = []
+        else:
+            search_filter = rsdb.database.build_search_filter(**search_params)
+            new_serials = database.get_serials_since(cursor, previous_watermark, search_filter)
+
+        # If the amount of results doesn't add up, flights were removed or changed
+        count = rsdb.database.count_sondes(cursor, **search_params)
+        if count != search_state["count"] + len(new_serials):
+            return None
+
+        tracks = self._make_tracks(cursor, new_serials, search_state["count"])
+        search_state = dict(search_state, count=count, watermark=None if watermark is None else watermark.isoformat())
+
+        return tracks, len(new_serials), search_state
+
+    def _serve_search_page(self) -> flask.Response:
+        """Internal function to handle a request for a further page of search results as GeoJSON tracks"""
+
+        try:
+            search_params = tiles.parse_search_query(flask.request.args)
+            after = _decode_page_key(flask.request.args["after"])
+            previous_results = int(flask.request.args.get("count", 0))
+            session_id = flask.request.args["session"]
+        except (KeyError, ValueError):
+            flask.abort(400)
+
+        # Every page gets the time budget of a search, and is cancelled by a new search of the same session
+        start = time.time()
+        connection = rsdb.database.get_pool_connection(self.db_pool)
+        try:
+            with self.search_tracker.run(session_id, connection):
+                cursor = connection.cursor()
+                search_results, next_page = rsdb.database.search_sondes_page(cursor, self.page_size, after, **search_params)
+                tracks = self._make_tracks(cursor, search_results, previous_results)
+                cursor.close()
+        except cancellation.SearchTimeout:
+            logging.info(f"Page of search results took longer than {self.search_time_budget}s, cancelled it")
+            return flask.Response(self.search_timeout_text, 503)
+        except cancellation.SearchCancelled:
+            logging.debug("Loading pages was superseded by a newer search, cancelled it")
+            return flask.Response("Search was superseded by a newer search", 409)
+        finally:
+            connection.close()
+        logging.debug(f"Created page with {len(search_results)} results in {round(time.time()-start, 2)}s")
+
+        return flask.jsonify({
+            "tracks": tracks,
+            "count": len(search_results),
+            "after": None if next_page is None else _encode_page_key(next_page)
+        })
+
+    def _log_search_cache_stats(self):
+        """Log search cache stats, on info level every few lookups to not spam info level logs"""
+
+        assert self.search_cache is not None # should never fail
+
+        stats = self.search_cache.stats()
+        if (self.search_cache.hits + self.search_cache.misses) % CACHE_STATS_INTERVAL == 0:
+            logging.info(stats)
+        else:
+            logging.debug(stats)
+
+    def _create_leaflet_map(self, maptiles_config: Dict[str, Any]):
+        """Create a persistent leaflet map with an initially empty layer for flight tracks"""
+
+        assert dl is not None # should never fail, renderer falls back to folium if import fails
+
+        launchsite_markers = [
+            dl.CircleMarker(
+                center=(launchsite[1], launchsite[2]),
+                radius=6,
+                color="black",
+                weight=2,
+                fill=True,
+                fillOpacity=0.1,
+                opacity=1,
+                children=dl.Tooltip(launchsite[0])
+            ) for launchsite in self.launchsites
+        ]
+
+        # Styling functions for the tracks layer are defined in assets/map/leaflet.js
+        return dl.Map([
+            dl.TileLayer(url=maptiles_config["url"],
+                         attribution=maptiles_config["attribution"],
+                         minZoom=maptiles_config["min_zoom"],
+                         maxZoom=maptiles_config["max_zoom"]),
+            dl.LayerGroup(launchsite_markers),
+            dl.GeoJSON(id="tracks_layer",
+                       style={"variable": "rsdb.map.trackStyle"},
+                       pointToLayer={"variable": "rsdb.map.pointToLayer"},
+                       onEachFeature={"variable": "rsdb.map.onEachTrack"},
+                       zoomToBounds=True),
+            dl.LayerGroup(id="tracks_pages"), # Further pages of results when loading progressively
+            dl.LayerGroup(id="tracks_updates"), # Flights added to the results when refreshing
+            dl.GeoJSON(id="live_layer",
+                       style={"variable": "rsdb.map.trackStyle"},
+                       pointToLayer={"variable": "rsdb.map.pointToLayer"})
+        ], center=(0, 0), zoom=2, style={"width": "100%", "height": "100%"})
+
+    def _make_tracks(self, cursor: mariadb.Cursor, serials: List[str], previous_results: int = 0) -> Dict[str, Any]:
+        """
+        Generate compact GeoJSON flight tracks for the leaflet renderer with data from the database.
+        previous_results is the amount of results on previous pages when loading progressively.
+        """
+
+        if len(serials) == 0:
+            return geojson.make_tracks({}, {}, True)
+
+        # Get flight paths from DB
+        logging.debug("Getting data from DB")
+        start = time.time()
+        flight_paths = database.get_flight_paths(cursor, serials)
+        flights_meta = database.get_flight_meta(cursor, serials)
+        logging.debug(f"Done in {round(time.time()-start, 2)}s")
+
+        # Create GeoJSON
+        start = time.time()
+        skip_poi_dots = previous_results + len(serials) >= self.poi_max_results
+        tracks = geojson.make_tracks(flight_paths, flights_meta, skip_poi_dots)
+        logging.debug(f"Created GeoJSON in {round(time.time()-start, 2)}s")
+
+        return tracks
+
+    def _make_density(self, cursor: mariadb.Cursor, search_params: Dict[str, Any]) -> Any:
+        """
+        Generate map data showing the density of flights matching search parameters in grid cells
+        instead of their tracks, so the size doesn't depend on the amount of flights
+        """
+
+        logging.debug(f"Creating {self.aggregate_points} density map")
+
+        start = time.time()
+        search_filter = rsdb.database.build_search_filter(**search_params)
+        cells = database.get_density(cursor, search_filter, self.aggregate_points, self.aggregate_cell_size)
+        logging.debug(f"Got {len(cells)} grid cells in {round(time.time()-start, 2)}s")
+
+        if self.renderer == "leaflet":
+            return geojson.make_density(cells, self.aggregate_cell_size)
+
+        # Draw heatmap at the centers of the grid cells
+        map = self.map_shell.new_map()
+        if len(cells) > 0:
+            max_count = max(cell[2] for cell in cells)
+            half_cell = self.aggregate_cell_size / 2
+            HeatMap([(lat + half_cell, lon + half_cell, count / max_count) for lat, lon, count in cells],
+                    min_opacity=0.3).add_to(map)
+
+            # Zoom to fit all cells, the heatmap isn't considered by fit_bounds
+            map.fit_bounds([(min(cell[0] for cell in cells), min(cell[1] for cell in cells)),
+                            (max(cell[0] for cell in cells) + self.aggregate_cell_size,
+                             max(cell[1] for cell in cells) + self.aggregate_cell_size)])
+
+        return self.map_shell.render(map)
+
+    def _make_tile_map(self, cursor: mariadb.Cursor, search_params: Dict[str, Any]) -> str:
+        """Generate map HTML that loads flight tracks as vector tiles instead of embedding them"""
+
+        logging.debug("Creating vector tile map")
+
+        map = self.map_shell.new_map()
+
+        # Add vector tile layer
+        tile_layer = VectorGridProtobuf(tiles.make_tile_url(search_params), options=tiles.TILE_LAYER_OPTIONS)
+        tile_layer.add_to(map)
+        tiles.VectorTileTooltips(tile_layer).add_to(map)
+
+        # Zoom to fit all flights, there are no overlays in the map to fit to
+        bounds = database.get_search_bounds(cursor, rsdb.database.build_search_filter(**search_params))
+        if bounds is not None:
+            map.fit_bounds([(bounds[0], bounds[1]), (bounds[2], bounds[3])], max_zoom=8)
+
+        return self.map_shell.render(map)
+
+    def _make_map(self, cursor: mariadb.Cursor, serials: List[str], search_params: Dict[str, Any]) -> str:
+        """Generate the map HTML with data from the database"""
+
+        # Load large searches as vector tiles, so the browser only loads flights in view
+        if self.vector_tiles_min_results > 0 and len(serials) >= self.vector_tiles_min_results:
+            return self._make_tile_map(cursor, search_params)
 
         logging.debug("Creating map")
 
@@ -308,15 +1031,20 @@ class Map(rsdb.web.WebApp):
         # Create map
         logging.debug("Drawing map")
         start = time.time()
-        map = copy.deepcopy(self.launchsites_map)
+        map = self.map_shell.new_map()
         skip_poi_dots = len(serials) >= self.poi_max_results
         for serial, flight_path in flight_paths.items():
+            cancellation.check() # Stop drawing if the search was cancelled
             flight_color=color.get_track_color()
 
-            # Add flight line
-            folium.PolyLine(flight_path,
+            # Add flight line. With few results, a popup links to the flight page.
+            popup = None
+            if not skip_poi_dots:
+                popup = folium.Popup(_flight_link(serial))
+            folium.PolyLine(database.path_coordinates(flight_path),
                             color=flight_color,
-                            tooltip=serial
+                            tooltip=serial,
+                            popup=popup
             ).add_to(map)
 
             # Skip plotting the POI dots if there are too many results
@@ -366,7 +1094,8 @@ class Map(rsdb.web.WebApp):
         # Automatically zoom to fit all elements
         folium.FitOverlays(max_zoom=8).add_to(map)
 
+        map_html = self.map_shell.render(map)
         logging.debug(f"Done in {round(time.time()-start, 2)}s")
 
-        return map
+        return map_html
         
\ No newline at end of file
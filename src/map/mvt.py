@@ -0,0 +1,131 @@
+import math
+import struct
+from typing import Dict, List, Sequence, Tuple
+
+# Minimal Mapbox vector tile encoder, see https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+EXTENT = 4096 # Tile coordinate extent
+
+GEOMETRY_POINT = 1
+GEOMETRY_LINESTRING = 2
+
+tile_point = Tuple[int, int]
+feature_type = Tuple[int, List[List[tile_point]], Dict[str, str | int | float]] # geometry type, parts, properties
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Get the bounds of a web mercator tile as latitude min, longitude min, latitude max, longitude max"""
+
+    n = 2 ** z
+    lon_min = x / n * 360 - 180
+    lon_max = (x + 1) / n * 360 - 180
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+
+    return lat_min, lon_min, lat_max, lon_max
+
+def project(lat: float, lon: float, z: int, x: int, y: int) -> tile_point:
+    """Project a latitude and longitude to integer coordinates in the specified tile"""
+
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    world_x = (lon + 180) / 360
+    world_y = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2
+
+    return round((world_x * n - x) * EXTENT), round((world_y * n - y) * EXTENT)
+
+def _varint(value: int) -> bytes:
+    """Internal function to encode an unsigned integer as protobuf varint"""
+
+    result = bytearray()
+    while value > 0x7F:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+
+    return bytes(result)
+
+def _zigzag(value: int) -> int:
+    """Internal function to zigzag encode a signed integer"""
+
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+def _field(field: int, data: bytes) -> bytes:
+    """Internal function to encode a length delimited protobuf field"""
+
+    return _varint((field << 3) | 2) + _varint(len(data)) + data
+
+def _uint_field(field: int, value: int) -> bytes:
+    """Internal function to encode a varint protobuf field"""
+
+    return _varint(field << 3) + _varint(value)
+
+def _packed_field(field: int, values: Sequence[int]) -> bytes:
+    """Internal function to encode a packed repeated uint32 protobuf field"""
+
+    return _field(field, b"".join(_varint(value) for value in values))
+
+def _encode_value(value: str | int | float) -> bytes:
+    """Internal function to encode a property value"""
+
+    if isinstance(value, str):
+        return _field(1, value.encode("utf-8"))
+    elif isinstance(value, float):
+        return _varint((3 << 3) | 1) + struct.pack("<d", value)
+    elif value >= 0:
+        return _uint_field(5, value)
+    else:
+        return _uint_field(6, _zigzag(value))
+
+def _encode_geometry(geometry_type: int, parts: List[List[tile_point]]) -> List[int]:
+    """Internal function to encode geometry parts as MVT geometry commands"""
+
+    commands = []
+    cursor_x = 0
+    cursor_y = 0
+    for part in parts:
+        if geometry_type == GEOMETRY_POINT:
+            segments = [part]
+        else:
+            segments = [part[:1], part[1:]]
+
+        for command, points in zip((1, 2), segments): # MoveTo, then LineTo
+            commands.append(command | (len(points) << 3))
+            for point_x, point_y in points:
+                commands.append(_zigzag(point_x - cursor_x))
+                commands.append(_zigzag(point_y - cursor_y))
+                cursor_x = point_x
+                cursor_y = point_y
+
+    return commands
+
+def encode_tile(layers: Dict[str, List[feature_type]]) -> bytes:
+    """Encode layers of features into a vector tile. Layers without features are skipped."""
+
+    tile = bytearray()
+    for name, features in layers.items():
+        if len(features) == 0:
+            continue
+
+        keys: Dict[str, int] = {}
+        values: Dict[str | int | float, int] = {}
+        layer = bytearray(_uint_field(15, 2) + _field(1, name.encode("utf-8"))) # version and name
+        for geometry_type, parts, properties in features:
+            # Get tags as indexes into key and value tables
+            tags = []
+            for key, value in properties.items():
+                tags.append(keys.setdefault(key, len(keys)))
+                tags.append(values.setdefault(value, len(values)))
+
+            feature = _packed_field(2, tags) + _uint_field(3, geometry_type) \
+                      + _packed_field(4, _encode_geometry(geometry_type, parts))
+            layer += _field(2, feature)
+
+        for key in keys:
+            layer += _field(3, key.encode("utf-8"))
+        for value in values:
+            layer += _field(4, _encode_value(value))
+        layer += _uint_field(5, EXTENT)
+
+        tile += _field(3, bytes(layer))
+
+    return bytes(tile)
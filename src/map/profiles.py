@@ -0,0 +1,188 @@
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Sequence, Tuple
+
+import mariadb
+import plotly.graph_objects as go
+from dash import dcc, html
+
+from src.rsdb.flight import DERIVED_METRICS
+from src.rsdb.web import COLORS
+
+from . import cache, database
+
+# Profiles shown on the flight page: name, title, column index in database.profile_row_type and wether it's shown over altitude
+PROFILES = [
+    ("altitude", "Altitude (m)", 1, False),
+    ("temperature", "Temperature (°C)", 2, True),
+    ("humidity", "Humidity (%)", 3, True),
+    ("pressure", "Pressure (hPa)", 4, True),
+    ("speed", "Speed (km/h)", 5, False)
+]
+
+series_type = Tuple[List[float], List[float], List[int]] # seconds since first point, value and altitude of every point
+flight_type = Tuple[Dict[str, Any] | None, datetime | None, Dict[str, series_type]] # details, time of first point and profiles
+
+def lttb(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    """
+    Downsample a series with the Largest-Triangle-Three-Buckets algorithm, which keeps the visual shape of the series.
+    x has to be sorted. Returns the indices of the points to keep.
+    """
+
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+
+    # Split all points except the first and last into buckets, and keep one point from every bucket
+    bucket_size = (length - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third point of the triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, length)
+        next_count = next_end - next_start
+        average_x = sum(x[next_start:next_end]) / next_count
+        average_y = sum(y[next_start:next_end]) / next_count
+
+        # Keep the point of this bucket forming the largest triangle with the previous kept point and the average
+        ax, ay = x[a], y[a]
+        max_area = -1.0
+        for j in range(int(i * bucket_size) + 1, int((i + 1) * bucket_size) + 1):
+            area = abs((ax - average_x) * (y[j] - ay) - (ax - x[j]) * (average_y - ay))
+            if area > max_area:
+                max_area = area
+                a = j
+        indices.append(a)
+
+    indices.append(length - 1)
+
+    return indices
+
+def downsample_profiles(rows: List[database.profile_row_type], points: int) -> Dict[str, series_type]:
+    """Split the rows of a flight profile into one series per profile, each downsampled to a maximum amount of points"""
+
+    if len(rows) == 0:
+        return {}
+
+    start = rows[0][0]
+    seconds = [(row[0] - start).total_seconds() for row in rows]
+
+    profiles = {}
+    for name, _, column, _ in PROFILES:
+        # Skip points without a value, sondes don't send every field
+        indices = [i for i, row in enumerate(rows) if row[column] is not None]
+        if len(indices) == 0:
+            continue
+
+        x = [seconds[i] for i in indices]
+        y = [float(rows[i][column]) for i in indices]
+        kept = lttb(x, y, points)
+        profiles[name] = ([x[i] for i in kept], [y[i] for i in kept], [rows[indices[i]][1] for i in kept])
+
+    return profiles
+
+class FlightProfiles():
+    """Get downsampled profiles of flights, cached per serial as flights don't change after being finalized"""
+
+    def __init__(self, points: int, cache_size: int) -> None:
+        self.points = points
+        self.cache = cache.MemoryCache("Flight profile", cache_size)
+
+    def get(self, cursor: mariadb.Cursor, serial: str) -> flight_type:
+        """Get the details, start time and downsampled profiles of a flight. Details are None if the flight isn't finalized yet."""
+
+        cached = self.cache.get(serial)
+        if cached is not None:
+            return cached
+
+        start = time.time()
+        details = database.get_flight_details(cursor, serial)
+        rows = database.get_flight_profile(cursor, serial)
+        profiles = downsample_profiles(rows, self.points)
+        start_time = rows[0][0] if len(rows) > 0 else None
+        logging.debug(f"Downsampled profiles of flight '{serial}' from {len(rows)} points in {round(time.time()-start, 2)}s")
+
+        # Only cache finalized flights, as flights that are still being received get new points
+        flight = (details, start_time, profiles)
+        if details is not None:
+            self.cache.set(serial, flight, len(json.dumps(profiles)))
+
+        return flight
+
+    def invalidate(self, serials: List[str]):
+        """Remove changed flights from the cache"""
+
+        for serial in serials:
+            self.cache.delete(serial)
+
+def _make_figure(profile: Tuple[str, str, int, bool], series: series_type, start_time: datetime) -> go.Figure:
+    """Internal function to create the figure of a profile"""
+
+    name, title, _, over_altitude = profile
+    seconds, values, altitudes = series
+
+    if over_altitude: # Atmospheric profiles are shown as value over altitude
+        trace = go.Scattergl(x=values, y=altitudes, mode="lines", name=name)
+        axis_titles = dict(xaxis_title=title, yaxis_title="Altitude (m)")
+    else:
+        times = [start_time + timedelta(seconds=second) for second in seconds]
+        trace = go.Scattergl(x=times, y=values, mode="lines", name=name)
+        axis_titles = dict(yaxis_title=title)
+
+    figure = go.Figure(trace)
+    figure.update_layout(
+        paper_bgcolor=COLORS["background"],
+        plot_bgcolor=COLORS["background"],
+        font=dict(family="sans-serif", size=14, color=COLORS["text"]),
+        margin=dict(l=60, r=20, t=40, b=40),
+        title=title,
+        **axis_titles
+    )
+
+    return figure
+
+def _format_detail(value: Any) -> str:
+    """Internal function to format a value of the flight details"""
+
+    if value is None:
+        return "-"
+    elif isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+
+    return str(value)
+
+def make_page(serial: str, details: Dict[str, Any] | None, profiles: Dict[str, series_type], start_time: datetime | None) -> List[Any]:
+    """Create the contents of the flight page from the details and profiles of a flight"""
+
+    children: List[Any] = [
+        dcc.Link("< Back to map", href="/"),
+        html.H2(f"Flight {serial}")
+    ]
+
+    if details is None and len(profiles) == 0:
+        children.append(html.P("Flight not found."))
+        return children
+    elif details is None:
+        children.append(html.P("Flight is still being received, details are shown once it's finished."))
+    else:
+        rows = [
+            ("Type", " ".join(str(details[key]) for key in ("sonde_type", "subtype") if details[key])),
+            ("Frequency (MHz)", details["frequency"]),
+            ("Launch site", details["launch_site"]),
+            ("First received", details["first_rx_time"]),
+            ("Last received", details["last_rx_time"]),
+            ("Frames", details["frame_count"]),
+            ("Burst altitude (m)", details["burst_alt"])
+        ] + [(label, details[metric]) for metric, label in DERIVED_METRICS.items()]
+        children.append(html.Table([html.Tr([html.Th(label), html.Td(_format_detail(value))]) for label, value in rows],
+                                   className="flight_details"))
+
+    if start_time is not None:
+        for profile in PROFILES:
+            if profile[0] in profiles:
+                children.append(dcc.Graph(figure=_make_figure(profile, profiles[profile[0]], start_time)))
+
+    return children
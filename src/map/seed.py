@@ -0,0 +1,74 @@
+import argparse
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import src.rsdb as rsdb
+
+from . import tileproxy
+
+SEED_THREADS = 2 # Keep this low, public tile servers don't allow bulk downloading
+
+def _tile_at(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    """Internal function to get the x and y of the tile containing a point at a zoom level"""
+
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+
+    return min(x, n - 1), min(y, n - 1)
+
+def get_tiles(lat_min: float, lon_min: float, lat_max: float, lon_max: float, zoom_min: int, zoom_max: int) -> List[Tuple[int, int, int]]:
+    """Get all tiles inside of a bounding box for a range of zoom levels"""
+
+    tiles = []
+    for z in range(zoom_min, zoom_max + 1):
+        x_min, y_min = _tile_at(lat_max, lon_min, z) # Tile y increases to the south
+        x_max, y_max = _tile_at(lat_min, lon_max, z)
+        tiles.extend((z, x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1))
+
+    return tiles
+
+def main():
+    rsdb.logging.set_up_logging("rsdb-map-seed") # Set up logging
+
+    config = rsdb.config.read_config() # Read config
+    rsdb.logging.set_logging_config(config) # Set logging config
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Download map tiles of an area into the map tile proxy cache, for example to use the map offline")
+    parser.add_argument("lat_min", type=float)
+    parser.add_argument("lon_min", type=float)
+    parser.add_argument("lat_max", type=float)
+    parser.add_argument("lon_max", type=float)
+    parser.add_argument("zoom_min", type=int)
+    parser.add_argument("zoom_max", type=int)
+    args = parser.parse_args()
+
+    maptiles_config = config["maptiles"]
+    if maptiles_config["proxy_offline"]:
+        logging.error("Can't seed tile cache while proxy_offline is enabled")
+        exit(1)
+    zoom_max = min(args.zoom_max, maptiles_config["max_zoom"])
+
+    tiles = get_tiles(args.lat_min, args.lon_min, args.lat_max, args.lon_max, args.zoom_min, zoom_max)
+    logging.info(f"Seeding {len(tiles)} tiles")
+
+    proxy = tileproxy.TileProxy(maptiles_config)
+    start = time.time()
+    failed = 0
+    try:
+        with ThreadPoolExecutor(SEED_THREADS) as executor:
+            for i, data in enumerate(executor.map(lambda tile: proxy.get_tile(*tile), tiles)):
+                if data is None:
+                    failed += 1
+                if (i + 1) % 100 == 0:
+                    logging.info(f"({i+1}/{len(tiles)}) {failed} failed")
+    except KeyboardInterrupt:
+        logging.info("Got keyboard interrupt, shutting down..")
+        exit(1)
+
+    logging.info(f"Done in {round(time.time() - start, 1)}s. {len(tiles) - failed} tiles cached, {failed} failed")
@@ -0,0 +1,82 @@
+import bisect
+import logging
+import threading
+import time
+from typing import List, Set, Tuple
+
+import mariadb
+
+from . import database
+
+CHECK_INTERVAL = 60 # Minimum seconds between checks for flights the changes feed missed
+
+class SerialIndex():
+    """
+    An in memory index of all serials and sonde types in the meta table for fast serial prefix lookups.
+    New flights are added incrementally from the changes feed instead of reloading everything.
+    """
+
+    def __init__(self, cursor: mariadb.Cursor) -> None:
+        self._lock = threading.Lock()
+        self._last_check = time.time()
+        self._load(cursor)
+
+    def _load(self, cursor: mariadb.Cursor):
+        """Internal function to load all serials from the database"""
+
+        start = time.time()
+        rows = database.get_serials_by_first_rx(cursor)
+
+        # Keys are (uppercase serial, serial) so lookups ignore case but return the original serials
+        self._keys: List[Tuple[str, str]] = sorted((row[0].upper(), row[0]) for row in rows)
+        self.sonde_types: Set[str] = set(row[1] for row in rows)
+
+        logging.debug(f"Loaded {len(self._keys)} serials into index in {round(time.time()-start, 2)}s")
+
+    def add(self, cursor: mariadb.Cursor, serials: List[str]):
+        """Add finalized flights to the index, see Map._handle_changes"""
+
+        rows = database.get_sonde_types(cursor, serials)
+        with self._lock:
+            keys = list(self._keys) # Lookups keep using the previous list until the new one is complete
+            added = 0
+            for serial, sonde_type in rows:
+                key = (serial.upper(), serial)
+                index = bisect.bisect_left(keys, key)
+                if index == len(keys) or keys[index] != key:
+                    keys.insert(index, key)
+                    added += 1
+                self.sonde_types.add(sonde_type)
+            self._keys = keys
+
+        if added > 0:
+            logging.debug(f"Added {added} serials to index")
+
+    def check(self, cursor: mariadb.Cursor):
+        """
+        Reload the index if the amount of flights in meta doesn't match, because the changes feed missed some (see rsdb.changes.GAP_TIMEOUT).
+        Does nothing if the last check was too recent.
+        """
+
+        with self._lock:
+            if time.time() - self._last_check < CHECK_INTERVAL:
+                return
+            self._last_check = time.time()
+
+            if database.get_meta_watermark(cursor)[1] != len(self._keys):
+                logging.info("Serial index is out of sync with meta, reloading it")
+                self._load(cursor)
+
+    def lookup(self, prefix: str, limit: int) -> List[str]:
+        """Get up to limit serials starting with a prefix (ignoring case), sorted alphabetically"""
+
+        prefix = prefix.upper()
+        keys = self._keys # Keep reference in case the index is reloaded during the lookup
+        index = bisect.bisect_left(keys, (prefix,))
+
+        serials = []
+        while index < len(keys) and len(serials) < limit and keys[index][0].startswith(prefix):
+            serials.append(keys[index][1])
+            index += 1
+
+        return serials
@@ -0,0 +1,45 @@
+import folium
+
+
+class MapShell():
+    """
+    A folium map whose static parts (tiles, dependencies, launch sites) are rendered once.
+    Dynamic layers are added to a stub map sharing the shell's map name, and only they are
+    rendered and spliced into the shell for every request.
+    """
+
+    def __init__(self, map: folium.Map) -> None:
+        self._map_id = map._id
+
+        figure = map.get_root()
+        self.html = figure.render()
+        self._header_names = set(figure.header._children.keys()) # Used to skip dependencies already in the shell
+
+        # Split shell at the places dynamic parts are inserted
+        head_end = self.html.index("</head>")
+        body_end = self.html.rindex("</body>")
+        script_end = self.html.rindex("</script>")
+        self._parts = (self.html[:head_end], self.html[head_end:body_end], self.html[body_end:script_end], self.html[script_end:])
+
+    def new_map(self) -> folium.Map:
+        """Create a stub map to add dynamic layers to, which can then be rendered into the shell with render"""
+
+        map = folium.Map(tiles=None)
+        map._id = self._map_id # Elements reference the map by name, which is generated from the id
+
+        return map
+
+    def render(self, map: folium.Map) -> str:
+        """Render the layers of a stub map created with new_map into the shell"""
+
+        # Only render the children of the map, the map itself is already in the shell
+        figure = map.get_root()
+        for child in list(map._children.values()):
+            child.render()
+
+        header = "".join(element.render() for name, element in figure.header._children.items()
+                         if name not in self._header_names)
+        html = figure.html.render()
+        script = figure.script.render()
+
+        return self._parts[0] + header + self._parts[1] + html + self._parts[2] + script + self._parts[3]
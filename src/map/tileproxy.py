@@ -0,0 +1,136 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import flask
+import requests
+
+from . import cache
+
+USER_AGENT = "radiosondedb tile proxy (https://github.com/DB8LE/radiosondeDB)" # Tile servers like OSM require an identifying user agent
+REQUEST_TIMEOUT = 10 # Seconds to wait for the upstream tile server
+BROWSER_MAX_AGE = 86400 # Seconds the browser may cache tiles without asking the proxy again
+
+class TileProxy():
+    """
+    Proxy map tiles from the configured tile server through a size limited disk cache.
+    Cached tiles are revalidated with the tile server once they are older than the configured maximum age,
+    and served stale if the tile server can't be reached. Concurrent requests for the same tile are only fetched once.
+    """
+
+    def __init__(self, maptiles_config: Dict[str, Any], server: Optional[flask.Flask] = None) -> None:
+        self.url = maptiles_config["url"]
+        self.max_zoom = maptiles_config["max_zoom"]
+        self.max_age = maptiles_config["proxy_max_age"]
+        self.offline = maptiles_config["proxy_offline"]
+        self.cache = cache.DiskCache(maptiles_config["proxy_cache_dir"], maptiles_config["proxy_cache_size"] * 1_000_000)
+
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = USER_AGENT
+
+        # Events of tiles currently being fetched, so concurrent requests can wait for them instead of fetching again
+        self._fetching: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+        if server is not None:
+            server.add_url_rule("/maptiles/<int:z>/<int:x>/<int:y>.png", "maptiles", self._serve_tile)
+
+    def _serve_tile(self, z: int, x: int, y: int) -> flask.Response:
+        """Internal function to handle a tile request"""
+
+        if z > self.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            flask.abort(404)
+
+        data = self.get_tile(z, x, y)
+        if data is None:
+            flask.abort(404)
+
+        response = flask.Response(data, mimetype="image/png")
+        response.headers["Cache-Control"] = f"public, max-age={BROWSER_MAX_AGE}"
+
+        return response
+
+    def get_tile(self, z: int, x: int, y: int) -> bytes | None:
+        """Get a tile from the cache, fetching or revalidating it first if needed. Returns None if the tile isn't available."""
+
+        key = f"{z}/{x}/{y}"
+        data = self.cache.get(key + ".png")
+        if data is not None and (self.offline or not self._is_stale(key)):
+            return data
+        elif self.offline:
+            return None
+
+        # Wait for the tile if it's already being fetched by another request, otherwise fetch it
+        with self._lock:
+            event = self._fetching.get(key)
+            fetching = event is None
+            if fetching:
+                event = self._fetching[key] = threading.Event()
+
+        if not fetching:
+            event.wait(REQUEST_TIMEOUT * 2)
+            return self.cache.get(key + ".png") or data
+
+        try:
+            return self._fetch(key, z, x, y, data) or data # Serve stale tile if fetching fails
+        finally:
+            with self._lock:
+                del self._fetching[key]
+            event.set()
+
+    def _is_stale(self, key: str) -> bool:
+        """Internal function to check if a cached tile needs to be revalidated"""
+
+        meta = self._get_meta(key)
+
+        return meta is None or time.time() - meta["fetched"] > self.max_age
+
+    def _get_meta(self, key: str) -> Dict[str, Any] | None:
+        """Internal function to get the metadata (fetch time and validators) stored with a cached tile"""
+
+        meta = self.cache.get(key + ".json")
+        if meta is None:
+            return None
+
+        try:
+            return json.loads(meta)
+        except ValueError:
+            return None
+
+    def _fetch(self, key: str, z: int, x: int, y: int, cached: bytes | None) -> bytes | None:
+        """Internal function to fetch a tile from the tile server, revalidating the cached version if there is one"""
+
+        headers = {}
+        meta = self._get_meta(key)
+        if cached is not None and meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        url = self.url.replace("{s}", "a").replace("{r}", "").format(z=z, x=x, y=y)
+        try:
+            response = self._session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            logging.warning(f"Failed to fetch map tile {key}: {e}")
+            return None
+
+        if response.status_code == 304 and cached is not None and meta is not None:
+            meta["fetched"] = time.time()
+            self.cache.set(key + ".json", json.dumps(meta).encode("utf-8"))
+            return cached
+        elif response.status_code != 200:
+            logging.warning(f"Failed to fetch map tile {key}: HTTP {response.status_code}")
+            return None
+
+        self.cache.set(key + ".png", response.content)
+        self.cache.set(key + ".json", json.dumps({
+            "fetched": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }).encode("utf-8"))
+        logging.debug(f"Fetched map tile {key} ({len(response.content)} bytes)")
+
+        return response.content
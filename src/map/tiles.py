@@ -0,0 +1,347 @@
+import hashlib
+import logging
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List
+
+import flask
+from branca.element import MacroElement
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template
+
+import src.rsdb as rsdb
+
+from . import cache, cancellation, color, database, mvt
+
+TILE_BUFFER = 1 / 16 # Fraction of a tile to also include data from around the tile, so lines don't end at tile borders
+TRACK_GRID = 256 # Tracks are reduced to one point per flight in each cell of a grid this many cells wide, about one per screen pixel
+TRACK_GAP = 60 # Seconds between two points in a tile after which the track is split if they aren't close (it left the tile in between).
+               # For thinned flights, this is added to the thinning interval.
+TRACK_JOIN_CELLS = 4 # Maximum distance in grid cells of points which are always connected, as they're in the same or close cells
+CHANGE_CHECK_INTERVAL = 60 # Minimum seconds between checks for flights the changes feed missed
+MAX_ZOOM = 20
+WATERMARK_KEY = "watermark" # Cache key to store the meta table state and changes feed position the cached tiles were generated with
+
+# Options for the leaflet vector grid layer showing the tiles
+TILE_LAYER_OPTIONS = """{
+    interactive: true,
+    vectorTileLayerStyles: {
+        tracks: function(properties) {
+            return {color: properties.color, weight: 3};
+        },
+        pois: function(properties) {
+            return {radius: properties.radius, color: properties.color, weight: 3,
+                    fill: true, fillColor: properties.color, fillOpacity: 1, opacity: 1};
+        }
+    }
+}"""
+
+def encode_search_query(search_params: Dict[str, Any]) -> str:
+    """Encode search parameters (see rsdb.database.build_search_filter) as a normalized URL query string"""
+
+    query = {}
+    for name, value in search_params.items():
+        if not value:
+            continue
+        elif isinstance(value, list):
+            query[name] = ",".join(value)
+        elif isinstance(value, dict): # Metric ranges as metric:min:max separated by semicolons
+            query[name] = ";".join(f"{metric}:{'' if minimum is None else minimum}:{'' if maximum is None else maximum}"
+                                   for metric, (minimum, maximum) in sorted(value.items()))
+        elif isinstance(value, date):
+            query[name] = value.isoformat()
+        else:
+            query[name] = str(value)
+
+    return urllib.parse.urlencode(sorted(query.items()))
+
+def parse_search_query(args: Dict[str, str]) -> Dict[str, Any]:
+    """Get search parameters from URL query arguments created with encode_search_query. Raises ValueError if invalid."""
+
+    search_params: Dict[str, Any] = {}
+    if "serial" in args:
+        search_params["serial"] = args["serial"]
+    if "data_fields" in args:
+        search_params["data_fields"] = args["data_fields"].split(",")
+    if "types" in args:
+        search_params["types"] = args["types"].split(",")
+    if "min_frame_count" in args:
+        search_params["min_frame_count"] = int(args["min_frame_count"])
+    if "date_start" in args:
+        search_params["date_start"] = date.fromisoformat(args["date_start"])
+    if "date_end" in args:
+        search_params["date_end"] = date.fromisoformat(args["date_end"])
+    if "launch_site" in args:
+        search_params["launch_site"] = args["launch_site"]
+    if "metric_ranges" in args:
+        search_params["metric_ranges"] = {}
+        for metric_range in args["metric_ranges"].split(";"):
+            metric, minimum, maximum = metric_range.split(":")
+            search_params["metric_ranges"][metric] = (float(minimum) if minimum else None, float(maximum) if maximum else None)
+
+    return search_params
+
+def make_tile_url(search_params: Dict[str, Any]) -> str:
+    """Get the tile URL template for vector tiles of flights matching search parameters"""
+
+    return "/tiles/{z}/{x}/{y}.mvt?" + encode_search_query(search_params)
+
+def _intersects(a: database.bounds_type, b: database.bounds_type) -> bool:
+    """Internal function to check if two bounds intersect"""
+
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def _buffered_tile_bounds(z: int, x: int, y: int) -> database.bounds_type:
+    """Internal function to get the bounds of a tile including the buffer around it"""
+
+    lat_min, lon_min, lat_max, lon_max = mvt.tile_bounds(z, x, y)
+    lat_buffer = (lat_max - lat_min) * TILE_BUFFER
+    lon_buffer = (lon_max - lon_min) * TILE_BUFFER
+
+    return lat_min - lat_buffer, lon_min - lon_buffer, lat_max + lat_buffer, lon_max + lon_buffer
+
+class VectorTileTooltips(MacroElement):
+    """Show the tooltip property of vector tile features when hovering over them"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.tooltip();
+            {{ this.layer.get_name() }}.on("mouseover", function(e) {
+                {{ this.get_name() }}.setLatLng(e.latlng).setContent(e.layer.properties.tooltip);
+                {{ this._parent.get_name() }}.openTooltip({{ this.get_name() }});
+            });
+            {{ this.layer.get_name() }}.on("mouseout", function(e) {
+                {{ this._parent.get_name() }}.closeTooltip({{ this.get_name() }});
+            });
+        {% endmacro %}
+    """)
+
+    def __init__(self, layer: VectorGridProtobuf):
+        super().__init__()
+        self._name = "VectorTileTooltips"
+        self.layer = layer
+
+class TileServer():
+    """
+    Serve vector tiles with flight tracks and POIs filtered by search parameters.
+    Tiles are cached on disk and invalidated when flights inside of them are added or changed (see rsdb.changes).
+    """
+
+    def __init__(self, server: flask.Flask, db_pool: rsdb.database.ProcessPool, cache_directory: str, cache_size: int,
+                 change_feed: rsdb.changes.ChangeFeed, thin_interval: float, search_tracker: cancellation.SearchTracker) -> None:
+        self.db_pool = db_pool
+        self.search_tracker = search_tracker
+        self.thin_interval = thin_interval # Frames of thinned flights are this far apart, see retention config
+        self.cache = cache.DiskCache(cache_directory, cache_size)
+
+        self._lock = threading.Lock()
+        self._last_change_check = time.time()
+        self._generation = 0 # Incremented when tiles are invalidated, so tiles created during that aren't cached
+
+        # Get current state of meta table and clear cache if flights have changed since the tiles were cached
+        connection = rsdb.database.get_pool_connection(self.db_pool)
+        cursor = connection.cursor()
+        self.watermark = (database.get_meta_watermark(cursor), change_feed.position)
+        if not rsdb.database.has_index(cursor, "tracking", rsdb.database.TRACKING_POSITION_INDEX):
+            logging.warning("Tracking table has no position index, vector tiles will be slow. Create it with rsdb-maintenance indexes")
+        cursor.close()
+        connection.close()
+
+        if self.cache.get(WATERMARK_KEY) != self._watermark_bytes():
+            logging.info("Flights have changed since tiles were cached, clearing tile cache")
+            self._invalidate_all()
+
+        change_feed.subscribe(self.handle_changes)
+        server.add_url_rule("/tiles/<int:z>/<int:x>/<int:y>.mvt", "tiles", self._serve_tile)
+
+    def _watermark_bytes(self) -> bytes:
+        """Internal function to get the current watermark in the format it is stored in the cache"""
+
+        return repr(self.watermark).encode("utf-8")
+
+    def _serve_tile(self, z: int, x: int, y: int) -> flask.Response:
+        """Internal function to handle a tile request"""
+
+        if z > MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            flask.abort(404)
+
+        try:
+            search_params = parse_search_query(flask.request.args)
+        except ValueError:
+            flask.abort(400)
+
+        self._check_for_changes()
+
+        # Tiles are cached per search by a hash of the normalized search parameters
+        search_hash = hashlib.sha1(make_tile_url(search_params).encode("utf-8")).hexdigest()[:16]
+        key = f"{search_hash}/{z}/{x}/{y}.mvt"
+
+        data = self.cache.get(key)
+        if data is None:
+            start = time.time()
+            generation = self._generation
+            try:
+                data = self._make_tile(z, x, y, search_params)
+            except cancellation.SearchTimeout:
+                logging.info(f"Tile {z}/{x}/{y} took longer than {self.search_tracker.time_budget}s, cancelled it")
+                return flask.Response("Tile took too long to create", 503)
+            with self._lock:
+                if generation == self._generation: # Tile may contain outdated data otherwise
+                    self.cache.set(key, data)
+            logging.debug(f"Created tile {z}/{x}/{y} ({len(data)} bytes) in {round(time.time()-start, 2)}s")
+
+        return flask.Response(data, mimetype="application/vnd.mapbox-vector-tile")
+
+    def _make_tile(self, z: int, x: int, y: int, search_params: Dict[str, Any]) -> bytes:
+        """Internal function to create a vector tile from data in the database"""
+
+        bounds = _buffered_tile_bounds(z, x, y)
+        search_filter = rsdb.database.build_search_filter(**search_params)
+        lat_min, lon_min, lat_max, lon_max = mvt.tile_bounds(z, x, y)
+        cell_size = ((lat_max - lat_min) / TRACK_GRID, (lon_max - lon_min) / TRACK_GRID)
+
+        # Tiles are loaded in parallel, so each one gets the time budget of a search without cancelling the others
+        connection = rsdb.database.get_pool_connection(self.db_pool)
+        try:
+            with self.search_tracker.run(uuid.uuid4().hex, connection):
+                cursor = connection.cursor()
+                points = database.get_tile_tracks(cursor, bounds, search_filter, cell_size)
+                flights_meta = database.get_tile_meta(cursor, bounds, search_filter)
+                cursor.close()
+        finally:
+            connection.close()
+
+        # Create track lines from the points of the grid cells, which are snapped to the tile coordinates
+        track_parts: Dict[str, List[List[mvt.tile_point]]] = defaultdict(list)
+        join_distance = TRACK_JOIN_CELLS * mvt.EXTENT / TRACK_GRID
+        previous = None
+        for serial, point_time, lat, lon, retention in points:
+            point = mvt.project(lat, lon, z, x, y)
+            track_gap = TRACK_GAP + (self.thin_interval if retention == rsdb.archive.RETENTION_THINNED else 0)
+
+            if previous is None or previous[0] != serial:
+                track_parts[serial].append([point])
+            elif (point_time - previous[1]).total_seconds() > track_gap \
+                 and max(abs(point[0] - previous[2][0]), abs(point[1] - previous[2][1])) > join_distance:
+                track_parts[serial].append([point])
+            elif track_parts[serial][-1][-1] != point:
+                track_parts[serial][-1].append(point)
+
+            previous = (serial, point_time, point)
+
+        tracks: List[mvt.feature_type] = []
+        for serial, parts in track_parts.items():
+            parts = [part for part in parts if len(part) > 1]
+            if len(parts) > 0:
+                tracks.append((mvt.GEOMETRY_LINESTRING, parts, {"tooltip": serial, "color": color.get_track_color(serial)}))
+
+        # Create POI dots
+        pois: List[mvt.feature_type] = []
+        for serial, meta in flights_meta.items():
+            flight_color = color.get_track_color(serial)
+            for point, name, radius in zip(meta, ("first receive", "last receive", "burst"), (3, 3, 4)):
+                if point is None or not _intersects((point[1], point[2], point[1], point[2]), bounds):
+                    continue
+
+                pois.append((mvt.GEOMETRY_POINT, [[mvt.project(float(point[1]), float(point[2]), z, x, y)]], {
+                    "tooltip": f"{serial} {name} @ {point[3]}m on {point[0].strftime('%Y-%m-%d %H:%M:%S')}",
+                    "color": flight_color,
+                    "radius": radius
+                }))
+
+        return mvt.encode_tile({"tracks": tracks, "pois": pois})
+
+    def handle_changes(self, changes: List[rsdb.changes.change_type]):
+        """Invalidate cached tiles containing flights that were finalized or updated, called by the changes feed"""
+
+        serials = list(dict.fromkeys(serial for _, event, serial in changes
+                                     if event in (rsdb.changes.FINALIZED, rsdb.changes.UPDATED)))
+
+        with self._lock:
+            # Flights being received or wiped aren't in meta, so they aren't in any tile. Only the feed position is stored.
+            if len(serials) == 0:
+                self.watermark = (self.watermark[0], max(self.watermark[1], changes[-1][0]))
+                self.cache.set(WATERMARK_KEY, self._watermark_bytes())
+                return
+
+            connection = rsdb.database.get_pool_connection(self.db_pool)
+            try:
+                cursor = connection.cursor()
+                meta_watermark = database.get_meta_watermark(cursor)
+                flight_bounds = database.get_flight_bounds(cursor, serials)
+                cursor.close()
+            finally:
+                connection.close()
+
+            # Changes committed late can have a lower sequence number than ones handled before
+            self.watermark = (meta_watermark, max(self.watermark[1], changes[-1][0]))
+            if len(flight_bounds) < len(serials): # Flights without tracking data were archived, their previous bounds are unknown
+                logging.info("Flights were archived, clearing tile cache")
+                self._invalidate_all()
+            else:
+                self._invalidate_bounds(flight_bounds)
+
+    def _check_for_changes(self):
+        """
+        Internal function to check for new flights the changes feed missed (see rsdb.changes.GAP_TIMEOUT)
+        and invalidate cached tiles containing them
+        """
+
+        with self._lock:
+            if time.time() - self._last_change_check < CHANGE_CHECK_INTERVAL:
+                return
+            self._last_change_check = time.time()
+
+            connection = rsdb.database.get_pool_connection(self.db_pool)
+            try:
+                cursor = connection.cursor()
+                meta_watermark = database.get_meta_watermark(cursor)
+                if meta_watermark == self.watermark[0]:
+                    cursor.close()
+                    return
+
+                # Get flights added since the last known state
+                latest_time, flight_count = self.watermark[0]
+                new_serials = [] if latest_time is None else database.get_serials_since(cursor, latest_time)
+                flight_bounds = database.get_flight_bounds(cursor, new_serials) if len(new_serials) > 0 else []
+                cursor.close()
+            finally:
+                connection.close()
+
+            self.watermark = (meta_watermark, self.watermark[1])
+            if flight_count + len(new_serials) != meta_watermark[1]: # Flights were removed or added with older times (e.g. imported)
+                logging.info("Flights have changed, clearing tile cache")
+                self._invalidate_all()
+            else:
+                self._invalidate_bounds(flight_bounds)
+
+    def _invalidate_bounds(self, flight_bounds: List[database.bounds_type]):
+        """Internal function to delete all cached tiles intersecting any of the specified bounds"""
+
+        self._generation += 1
+        invalidated = 0
+        for key in self.cache.keys():
+            if key == WATERMARK_KEY:
+                continue
+
+            z, x, y = (int(part) for part in key[:-len(".mvt")].split("/")[1:])
+            tile_bounds = _buffered_tile_bounds(z, x, y)
+            if any(_intersects(tile_bounds, bounds) for bounds in flight_bounds):
+                self.cache.delete(key)
+                invalidated += 1
+
+        self.cache.set(WATERMARK_KEY, self._watermark_bytes())
+        logging.debug(f"Invalidated {invalidated} cached tiles")
+
+    def _invalidate_all(self):
+        """Internal function to delete all cached tiles"""
+
+        self._generation += 1
+        for key in self.cache.keys():
+            self.cache.delete(key)
+
+        self.cache.set(WATERMARK_KEY, self._watermark_bytes())
@@ -1,5 +1,11 @@
+from . import archive as archive
+from . import changes as changes
 from . import config as config
 from . import database as database
+from . import flight as flight
+from . import launchsites as launchsites
+from . import live as live
 from . import logging as logging
+from . import sketch as sketch
 from . import web as web
 from .packet import Packet as Packet
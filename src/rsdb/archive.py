@@ -0,0 +1,140 @@
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Retention state of a flight, stored in meta.retention
+RETENTION_FULL = 0 # All received frames are in the tracking table
+RETENTION_THINNED = 1 # Frames were thinned to the configured interval
+RETENTION_ARCHIVED = 2 # Frames were moved from the tracking table to the archive
+
+# Columns of the tracking table in the order they are stored in the archive
+TRACKING_COLUMNS = ["frame", "time", "latitude", "longitude", "altitude", "temperature", "humidity",
+                    "pressure", "speed", "battery", "burst_timer", "xdata"]
+
+archive_row_type = List[Any] # values of TRACKING_COLUMNS
+index_type = Dict[str, Tuple[int, int]] # offset and length of the gzip member of every flight by serial
+
+def _encode_value(value: Any) -> Any:
+    """Internal function to convert a value from the tracking table to JSON"""
+
+    if isinstance(value, datetime):
+        return value.isoformat()
+    elif isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    elif value is not None and not isinstance(value, (int, float, str)): # Decimals
+        return float(value)
+
+    return value
+
+class TrackingArchive():
+    """
+    Compressed monthly archive files of the tracking data of flights, by month of their first receive time.
+    Every flight is a separate gzip member (so the file is a valid .gz of JSON lines) which can be read on its own,
+    found with an index file next to it. Flights archived again replace their previous version.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+        self._indexes: Dict[str, Tuple[float, index_type]] = {} # modification time and index by month
+        self._lock = threading.Lock()
+
+    def _paths(self, month: str) -> Tuple[str, str]:
+        """Internal function to get the paths of the archive and index file of a month"""
+
+        base = os.path.join(self.directory, month)
+
+        return base + ".jsonl.gz", base + ".idx"
+
+    @staticmethod
+    def month(first_rx_time: datetime) -> str:
+        """Get the month of the archive file of a flight by its first receive time"""
+
+        return first_rx_time.strftime("%Y-%m")
+
+    def write_flights(self, month: str, flights: Dict[str, Sequence[Sequence[Any]]]):
+        """Append flights (rows in the order of TRACKING_COLUMNS by serial) to the archive file of a month, flushed to disk before returning"""
+
+        os.makedirs(self.directory, exist_ok=True)
+        archive_path, index_path = self._paths(month)
+
+        with open(archive_path, "ab") as archive_file, open(index_path, "a") as index_file:
+            for serial, rows in flights.items():
+                data = json.dumps({"serial": serial, "rows": [[_encode_value(value) for value in row] for row in rows]})
+                member = gzip.compress((data + "\n").encode("utf-8"))
+
+                offset = archive_file.tell()
+                archive_file.write(member)
+                index_file.write(f"{serial} {offset} {len(member)}\n")
+
+            # Make sure the data is on disk before it's deleted from the database
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+    def _get_index(self, month: str) -> index_type:
+        """Internal function to get the index of a month, which is cached until the index file changes"""
+
+        _, index_path = self._paths(month)
+        try:
+            modified = os.path.getmtime(index_path)
+        except FileNotFoundError:
+            return {}
+
+        with self._lock:
+            cached = self._indexes.get(month)
+            if cached is not None and cached[0] == modified:
+                return cached[1]
+
+        index: index_type = {}
+        with open(index_path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3: # Skip lines of an interrupted write
+                    index[parts[0]] = (int(parts[1]), int(parts[2])) # Later lines replace earlier ones
+
+        with self._lock:
+            self._indexes[month] = (modified, index)
+
+        return index
+
+    def read_flights(self, month: str, serials: List[str]) -> Dict[str, List[archive_row_type]]:
+        """Read flights from the archive file of a month. Returns rows in the order of TRACKING_COLUMNS by serial, missing flights are skipped."""
+
+        index = self._get_index(month)
+        archive_path, _ = self._paths(month)
+
+        flights = {}
+        with open(archive_path, "rb") as f:
+            for serial in serials:
+                if serial not in index:
+                    logging.warning(f"Flight '{serial}' is missing from archive {archive_path}")
+                    continue
+
+                offset, length = index[serial]
+                f.seek(offset)
+                flight = json.loads(gzip.decompress(f.read(length)))
+                flights[serial] = flight["rows"]
+
+        return flights
+
+    def read_flights_by_time(self, flights: List[Tuple[str, datetime]]) -> Dict[str, List[archive_row_type]]:
+        """Read flights by serial and first receive time from the archive files of their months"""
+
+        months: Dict[str, List[str]] = {}
+        for serial, first_rx_time in flights:
+            months.setdefault(self.month(first_rx_time), []).append(serial)
+
+        data = {}
+        for month, serials in months.items():
+            try:
+                data.update(self.read_flights(month, serials))
+            except FileNotFoundError:
+                logging.warning(f"Archive of month {month} is missing, can't read {len(serials)} archived flights")
+
+        return data
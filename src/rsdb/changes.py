@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import mariadb
+
+from . import database
+
+# Changes of flights are recorded in the changes table by the apps writing to the database, in the same transaction
+# as the change itself. Apps caching data (like the map and dashboard) tail the table by its sequence number to
+# invalidate only the affected cache entries. Events are one of:
+STARTED = "started" # A new flight is being received, it's in the tracking table but not in meta yet
+FINALIZED = "finalized" # A flight was added to meta, by the archiver or the importer
+WIPED = "wiped" # A flight was deleted before being finalized, as it didn't reach the minimum amount of frames
+UPDATED = "updated" # Tracking data or meta values of a finalized flight were changed by a maintenance task
+
+change_type = Tuple[int, str, str] # sequence number, event, serial
+listener_type = Callable[[List[change_type]], None]
+
+FETCH_LIMIT = 10000 # Maximum amount of changes read at once
+# Sequence numbers are taken when a change is inserted, but only become visible when its transaction commits, so a
+# change with a lower sequence number can appear after higher ones were read. Skipped sequence numbers are read again
+# until they appear or GAP_TIMEOUT has passed (their transaction was rolled back), keeping at most MAX_GAPS of them.
+GAP_TIMEOUT = 3600
+MAX_GAPS = 1000
+
+def record(cursor: mariadb.Cursor, event: str, serials: Sequence[str]):
+    """Record an event for flights. Committed together with the transaction of the cursor."""
+
+    if len(serials) > 0:
+        cursor.executemany("INSERT INTO changes (event, serial) VALUES (?, ?)", [(event, serial) for serial in serials])
+
+def prune(cursor: mariadb.Cursor, keep_days: float):
+    """Delete changes older than keep_days"""
+
+    cursor.execute("DELETE FROM changes WHERE time < NOW() - INTERVAL ? SECOND", (int(keep_days * 86400),))
+
+def get_position(cursor: mariadb.Cursor) -> int:
+    """Get the sequence number of the latest change, or 0 if there are none"""
+
+    cursor.execute("SELECT COALESCE(MAX(sequence), 0) FROM changes")
+
+    return cursor.fetchone()[0]
+
+def get_changes(cursor: mariadb.Cursor, after: int, limit: int = FETCH_LIMIT) -> List[change_type]:
+    """Get the changes after a sequence number in order"""
+
+    cursor.execute("SELECT sequence, event, serial FROM changes WHERE sequence > ? ORDER BY sequence LIMIT ?", (after, limit))
+
+    return cursor.fetchall()
+
+def get_changes_by_sequence(cursor: mariadb.Cursor, sequences: List[int]) -> List[change_type]:
+    """Get the changes with specific sequence numbers which exist, in order"""
+
+    if len(sequences) == 0:
+        return []
+
+    placeholders = ", ".join(["?"] * len(sequences))
+    cursor.execute(f"SELECT sequence, event, serial FROM changes WHERE sequence IN ({placeholders}) ORDER BY sequence", sequences)
+
+    return cursor.fetchall()
+
+class ChangeFeed():
+    """Tail the changes table in a thread started with start(), passing new changes to all listeners"""
+
+    def __init__(self, db_pool: database.ProcessPool, poll_interval: float) -> None:
+        self.db_pool = db_pool
+        self.poll_interval = poll_interval
+
+        self._listeners: List[listener_type] = []
+        self._lock = threading.Lock()
+        self._gaps: Dict[int, float] = {} # Skipped sequence numbers and when they were skipped, see GAP_TIMEOUT
+
+        # Only changes after starting are passed on, earlier ones are already in the data loaded at startup
+        connection = database.get_pool_connection(self.db_pool)
+        cursor = connection.cursor()
+        self.position = get_position(cursor)
+        cursor.close()
+        connection.close()
+
+    def start(self):
+        """Start checking for changes. Called in every process serving requests, see rsdb.web.WebApp.start"""
+
+        threading.Thread(target=self._poll_loop, name="change-feed", daemon=True).start()
+
+    def subscribe(self, listener: listener_type):
+        """Register a function which is called with every list of new changes"""
+
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _poll(self):
+        """
+        Internal function to read new changes and skipped changes which appeared since, and pass them to the listeners.
+        The position only moves on once all listeners handled the changes, so changes are read again after database errors.
+        """
+
+        connection = database.get_pool_connection(self.db_pool)
+        try:
+            cursor = connection.cursor()
+            changes = get_changes(cursor, self.position)
+            late_changes = get_changes_by_sequence(cursor, sorted(self._gaps))
+            cursor.close()
+        finally:
+            connection.close()
+
+        if len(changes) == 0 and len(late_changes) == 0:
+            self._expire_gaps()
+            return
+        logging.debug(f"Got {len(changes) + len(late_changes)} flight changes ({len(late_changes)} committed late)")
+
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(sorted(late_changes + changes))
+            except mariadb.Error: # Temporary, like no free connection in the pool. Handle the same changes again next time.
+                raise
+            except Exception as e:
+                logging.error(f"Got exception while handling flight changes: {e}")
+
+        for change in late_changes:
+            self._gaps.pop(change[0], None)
+        now = time.time()
+        expected = self.position + 1
+        for change in changes:
+            for sequence in range(expected, min(change[0], expected + MAX_GAPS)):
+                self._gaps[sequence] = now
+            expected = change[0] + 1
+        if len(changes) > 0:
+            self.position = changes[-1][0]
+        self._expire_gaps()
+
+    def _expire_gaps(self):
+        """Internal function to stop waiting for skipped changes which most likely were rolled back"""
+
+        now = time.time()
+        for sequence, skipped in list(self._gaps.items()):
+            if now - skipped > GAP_TIMEOUT:
+                del self._gaps[sequence]
+
+        # Keep the newest gaps if there are too many
+        for sequence in sorted(self._gaps)[:-MAX_GAPS]:
+            del self._gaps[sequence]
+
+    def _poll_loop(self):
+        """Internal function to check for new changes regularly, running in a thread"""
+
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._poll()
+            except mariadb.Error as e:
+                logging.warning(f"Failed to check for flight changes: {e}")
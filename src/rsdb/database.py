@@ -1,9 +1,14 @@
 import datetime
 import logging
-from typing import Any, Dict, List, Optional, Literal
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Literal, Tuple
 
 import mariadb
 
+from .flight import DERIVED_METRICS
+
 CREATE_TRACKING_SQL = """
 CREATE TABLE IF NOT EXISTS tracking (
 serial VARCHAR(16) NOT NULL,
@@ -52,6 +57,72 @@ rs41_firmware TEXT
 );
 """
 
+# Columns added to meta after it was created, so they are also added to existing databases
+ADD_META_COLUMNS_SQL = [
+    # Range statistics from the receiving station, NULL if no station location is configured
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS first_rx_range INT UNSIGNED;",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS last_rx_range INT UNSIGNED;",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS last_rx_bearing SMALLINT UNSIGNED;",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS max_range INT UNSIGNED;",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS max_range_bearing SMALLINT UNSIGNED;",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS max_range_alt INT;",
+    # Derived metrics (see flight.DERIVED_METRICS), NULL until calculated
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS ascent_rate DECIMAL(4, 1);",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS descent_rate DECIMAL(4, 1);",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS max_speed DECIMAL(4, 1);",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS duration INT UNSIGNED;",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS min_temperature DECIMAL(4, 1);",
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS tropopause_alt INT;",
+    # Nearest launch site in launchsites.txt (see launchsites.LaunchsiteIndex), NULL if there is none close enough
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS launch_site VARCHAR(64);",
+    # Retention state of the tracking data of the flight (see archive.RETENTION_*)
+    "ALTER TABLE meta ADD COLUMN IF NOT EXISTS retention TINYINT UNSIGNED NOT NULL DEFAULT 0;"
+]
+
+# Sketches of the distribution of a metric of all flights of a day, see sketch.py
+CREATE_DAILY_SKETCHES_SQL = """
+CREATE TABLE IF NOT EXISTS daily_sketches (
+day DATE NOT NULL,
+metric VARCHAR(32) NOT NULL,
+flights INT UNSIGNED NOT NULL,
+sketch BLOB NOT NULL,
+PRIMARY KEY(metric, day)
+);
+"""
+
+# Feed of flight changes, tailed by the web apps to invalidate their caches (see changes.py)
+CREATE_CHANGES_SQL = """
+CREATE TABLE IF NOT EXISTS changes (
+sequence BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+event VARCHAR(16) NOT NULL,
+serial VARCHAR(16) NOT NULL
+);
+"""
+
+CREATE_INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS meta_last_rx_time ON meta (last_rx_time);",
+    "CREATE INDEX IF NOT EXISTS meta_first_rx_time ON meta (first_rx_time, serial);",
+    "CREATE INDEX IF NOT EXISTS meta_launch_site ON meta (launch_site, first_rx_time);",
+    "CREATE INDEX IF NOT EXISTS meta_retention ON meta (retention, last_rx_time);",
+    "CREATE INDEX IF NOT EXISTS changes_time ON changes (time);"
+] + [f"CREATE INDEX IF NOT EXISTS meta_{metric} ON meta ({metric});" for metric in DERIVED_METRICS]
+
+# Index of tracking points by position, used by vector tiles and track density maps. Building it on a large tracking table takes
+# long, so it isn't created on connect but once with rsdb-maintenance indexes, online so receiving flights continues meanwhile.
+# Bounding box queries only range scan the latitude, the longitude is checked on the index entries. As these also contain
+# the primary key (serial, time), the tracking rows themselves only have to be read for points inside the box.
+TRACKING_POSITION_INDEX = "tracking_position"
+CREATE_TRACKING_POSITION_INDEX_SQL = f"CREATE INDEX IF NOT EXISTS {TRACKING_POSITION_INDEX} ON tracking (latitude, longitude) ALGORITHM=INPLACE LOCK=NONE;"
+
+def has_index(cursor: mariadb.Cursor, table: str, index: str) -> bool:
+    """Check if an index exists on a table of the current database"""
+
+    cursor.execute("SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = ? AND index_name = ?",
+                   (table, index))
+
+    return cursor.fetchone()[0] > 0
+
 def connect(config: Dict[str, Dict[str, Any]]) -> mariadb.Connection:
     """Get a connection to the database with the output of config.read_config() as the input while ensuring the needed tables exist."""
 
@@ -65,67 +136,182 @@ def connect(config: Dict[str, Dict[str, Any]]) -> mariadb.Connection:
     logging.debug("Ensuring MariaDB tables exist")
     cursor.execute(CREATE_TRACKING_SQL)
     cursor.execute(CREATE_META_SQL)
+    for sql in ADD_META_COLUMNS_SQL:
+        cursor.execute(sql)
+    cursor.execute(CREATE_DAILY_SKETCHES_SQL)
+    cursor.execute(CREATE_CHANGES_SQL)
+    for sql in CREATE_INDEXES_SQL:
+        cursor.execute(sql)
     cursor.close()
 
     return conn
 
-def search_sondes(
-    cursor: mariadb.Cursor,
+class ProcessPool():
+    """
+    A pool of connections to the database which is created on first use in every process.
+    Web apps can be initialized before forking into worker processes (see web.WebApp.wsgi_app),
+    and every worker connects with its own pool instead of sharing the connections of the parent.
+    """
+
+    def __init__(self, config: Dict[str, Dict[str, Any]], pool_name: str, pool_size: int) -> None:
+        self.config = config
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+
+        self._pool: Optional[mariadb.ConnectionPool] = None
+        self._pid: Optional[int] = None # Process the pool was created in
+        self._lock = threading.Lock()
+
+    def get_connection(self) -> mariadb.Connection:
+        """Get a connection from the pool of this process, see get_pool_connection"""
+
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    logging.info(f"Creating MariaDB connection pool '{self.pool_name}' with {self.pool_size} connections")
+                    self._pool = mariadb.ConnectionPool(pool_name=self.pool_name, pool_size=self.pool_size, **self.config["mariadb"])
+                    self._pid = os.getpid()
+
+        assert self._pool is not None # should never fail
+
+        return self._pool.get_connection()
+
+    def close(self):
+        """Close the connections of this process. The pool is created again when it's used after this."""
+
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.close()
+            self._pool = None
+            self._pid = None
+
+def create_pool(config: Dict[str, Dict[str, Any]], pool_name: str, pool_size: int) -> ProcessPool:
+    """
+    Create a pool of connections to the database for apps handling requests in parallel, with the output of config.read_config() as the input.
+    Tables have to be ensured to exist with connect() first.
+    """
+
+    return ProcessPool(config, pool_name, pool_size)
+
+def get_pool_connection(pool: ProcessPool, timeout: float = 10) -> mariadb.Connection:
+    """Get a connection from a pool, waiting up to timeout seconds if all connections are in use. Close it to return it to the pool."""
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return pool.get_connection()
+        except mariadb.PoolError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+metric_range_type = Tuple[Optional[float], Optional[float]] # minimum and maximum of a derived metric
+
+DATA_FIELDS = ["humidity", "pressure", "xdata"] # Data fields that can be filtered by, each has a has_<field> column in meta
+
+def build_search_filter(
     serial: Optional[str] = None,
     data_fields: Optional[List[str]] = None,
-    types: Optional[List[Literal["humidity", "pressure", "XDATA"]]] = None,
+    types: Optional[List[str]] = None,
     min_frame_count: Optional[int] = None,
     date_start: Optional[datetime.date] = None,
-    date_end: Optional[datetime.date] = None
-) -> List[str]:
+    date_end: Optional[datetime.date] = None,
+    metric_ranges: Optional[Dict[str, metric_range_type]] = None,
+    launch_site: Optional[str] = None
+) -> Tuple[str, List[Any]]:
     """
-    Search for sondes in the meta table.
-
-    Search parameters:
-    - serial: (with optional wildcard at the end using *)
-    - data_fields: data fields that have to be available in flight data
-    - types: filter allowed sonde types
-    - min_frame_count: minimum frame_count
-    - start_date: filter first_rx_time from this to end_date
-    - end_date: filter first_rx time from start_date to this
-
-    Returns a list of serials matching the parameters
+    Build SQL conditions for filtering the meta table with the same parameters as search_sondes.
+    Columns are qualified with the table name, so the conditions can also be used in joins.
+    Returns the conditions (each starting with AND) and the parameters for them.
     """
-    sql = "SELECT serial FROM meta WHERE 1=1"
+
+    sql = ""
     params: List[Any] = []
-    
+
     # Serial filter
     if serial:
         if serial.endswith('*'):
             pattern = serial[:-1] + '%'
         else:
             pattern = serial
-        sql += " AND serial LIKE ?"
+        sql += " AND meta.serial LIKE ?"
         params.append(pattern)
 
     if data_fields:
         for data_field in data_fields:
-            sql += f" AND has_{data_field.lower()} = 1"
+            if data_field.lower() not in DATA_FIELDS: # Column names can't be parameters, so only allow known ones
+                logging.warning(f"Ignoring invalid data field '{data_field}' in search")
+                continue
+            sql += f" AND meta.has_{data_field.lower()} = 1"
 
     # Types filter
     if types:
         placeholders = ", ".join(["?"] * len(types))
-        sql += f" AND sonde_type IN ({placeholders})"
+        sql += f" AND meta.sonde_type IN ({placeholders})"
         params.extend(types)
     
     # Frame count filter
     if min_frame_count:
-        sql += " AND frame_count >= ?"
+        sql += " AND meta.frame_count >= ?"
         params.append(min_frame_count)
 
     # Date filters
     if date_start:
-        sql += " AND first_rx_time >= ?"
+        sql += " AND meta.first_rx_time >= ?"
         params.append(date_start)
     if date_end:
-        sql += " AND first_rx_time <= ?"
+        sql += " AND meta.first_rx_time <= ?"
         params.append(date_end)
 
+    # Launch site filter
+    if launch_site:
+        sql += " AND meta.launch_site = ?"
+        params.append(launch_site)
+
+    # Derived metric filters
+    if metric_ranges:
+        for metric, (minimum, maximum) in metric_ranges.items():
+            if metric not in DERIVED_METRICS: # Column names can't be parameters, so only allow known ones
+                logging.warning(f"Ignoring invalid metric '{metric}' in search")
+                continue
+            if minimum is not None:
+                sql += f" AND meta.{metric} >= ?"
+                params.append(minimum)
+            if maximum is not None:
+                sql += f" AND meta.{metric} <= ?"
+                params.append(maximum)
+
+    return sql, params
+
+def search_sondes(
+    cursor: mariadb.Cursor,
+    serial: Optional[str] = None,
+    data_fields: Optional[List[str]] = None,
+    types: Optional[List[Literal["humidity", "pressure", "XDATA"]]] = None,
+    min_frame_count: Optional[int] = None,
+    date_start: Optional[datetime.date] = None,
+    date_end: Optional[datetime.date] = None,
+    metric_ranges: Optional[Dict[str, metric_range_type]] = None,
+    launch_site: Optional[str] = None
+) -> List[str]:
+    """
+    Search for sondes in the meta table.
+
+    Search parameters:
+    - serial: (with optional wildcard at the end using *)
+    - data_fields: data fields that have to be available in flight data
+    - types: filter allowed sonde types
+    - min_frame_count: minimum frame_count
+    - start_date: filter first_rx_time from this to end_date
+    - end_date: filter first_rx time from start_date to this
+    - metric_ranges: minimum and maximum (each optional) of derived metrics by metric name
+    - launch_site: name of the launch site flights were attributed to
+
+    Returns a list of serials matching the parameters
+    """
+    conditions, params = build_search_filter(serial, data_fields, types, min_frame_count, date_start, date_end, metric_ranges, launch_site) # type: ignore
+    sql = "SELECT serial FROM meta WHERE 1=1" + conditions
+
     # Run query
     cursor.execute(sql, params)
     results = cursor.fetchall()
@@ -135,3 +321,43 @@ def search_sondes(
     
     return results
 
+def count_sondes(cursor: mariadb.Cursor, **search_params: Any) -> int:
+    """Get the amount of sondes matching the same search parameters as search_sondes"""
+
+    conditions, params = build_search_filter(**search_params)
+    cursor.execute("SELECT COUNT(*) FROM meta WHERE 1=1" + conditions, params)
+
+    return cursor.fetchone()[0]
+
+page_key_type = Tuple[datetime.datetime, str] # first_rx_time and serial of the last result on a page
+
+def search_sondes_page(
+    cursor: mariadb.Cursor,
+    limit: int,
+    after: Optional[page_key_type] = None,
+    **search_params: Any
+) -> Tuple[List[str], Optional[page_key_type]]:
+    """
+    Get one page of search results, ordered from newest to oldest first receive time.
+    Takes the same search parameters as search_sondes, and the key of the previous page to continue after it.
+    Returns a list of serials and the key for the next page, which is None if this is the last page.
+    """
+
+    conditions, params = build_search_filter(**search_params)
+
+    # Continue after the previous page (keyset pagination, so later pages are as fast as the first one)
+    if after is not None:
+        conditions += " AND (meta.first_rx_time < ? OR (meta.first_rx_time = ? AND meta.serial < ?))"
+        params.extend([after[0], after[0], after[1]])
+
+    # Get one more result than needed to check if there is another page
+    cursor.execute("SELECT serial, first_rx_time FROM meta WHERE 1=1" + conditions + \
+                   " ORDER BY meta.first_rx_time DESC, meta.serial DESC LIMIT ?", params + [limit + 1])
+    results = cursor.fetchall()
+
+    next_page = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_page = (results[-1][1], results[-1][0])
+
+    return [result[0] for result in results], next_page
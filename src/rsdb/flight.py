@@ -0,0 +1,266 @@
+import math
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import geopy.distance
+
+from .packet import Packet
+
+MAX_VELOCITY = 300 # Maximum velocity in m/s between two packets (faster shouldn't be possible without a broken packet)
+MS_TO_KMH = 3.6 # Speeds are stored in km/h, like they're sent by auto_rx
+MAX_SPEED = 999.9 # Largest value in km/h fitting the speed columns, faster calculated speeds are clamped to it
+EARTH_RADIUS = 6371008.8 # Mean earth radius in meters, used for fast distance estimates
+ESTIMATE_MARGIN = 0.99 # Haversine distances are within 0.5% of geodesic ones, so estimates below this share of a limit are below it
+
+speed_point = Tuple[Optional[float], float, float, datetime] # speed, latitude, longitude, time
+
+def packet_velocity(previous: Packet, packet: Packet) -> float:
+    """Get the velocity in m/s needed to get from the position of the previous packet to the position of the packet"""
+
+    assert previous.datetime is not None and packet.datetime is not None # should never fail
+
+    time_delta = (packet.datetime - previous.datetime).total_seconds()
+    distance = geopy.distance.geodesic((previous.latitude, previous.longitude), (packet.latitude, packet.longitude)).meters
+
+    return distance / time_delta
+
+def _estimate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Internal function to estimate the distance between two points in meters with the haversine formula, which is much faster than geodesic"""
+
+    lat1, lon1, lat2, lon2 = math.radians(lat1), math.radians(lon1), math.radians(lat2), math.radians(lon2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+def filter_packets(packets: Sequence[Packet], min_frame_spacing: int, rx_timeout_seconds: int) -> List[Packet]:
+    """
+    Filter a time sorted list of packets from one flight the same way the archiver does while receiving.
+    Packets closer than min_frame_spacing seconds to the previous stored packet and packets with an impossible
+    velocity are dropped. Once no packet has been received for rx_timeout_seconds, the flight is cut off.
+    """
+
+    if len(packets) == 0:
+        return []
+
+    results = [packets[0]]
+    for packet in packets[1:]:
+        latest_packet = results[-1]
+        assert packet.datetime is not None and latest_packet.datetime is not None # should never fail
+
+        time_delta = (packet.datetime - latest_packet.datetime).total_seconds()
+        if time_delta >= rx_timeout_seconds: # Reception timed out, archival doesn't continue
+            break
+        if round(time_delta, 1) < min_frame_spacing:
+            continue
+
+        # Only calculate the exact velocity if the estimate is close to the limit
+        estimate = _estimate_distance(latest_packet.latitude, latest_packet.longitude, packet.latitude, packet.longitude) / time_delta
+        if estimate > MAX_VELOCITY * ESTIMATE_MARGIN and packet_velocity(latest_packet, packet) > MAX_VELOCITY:
+            continue
+
+        results.append(packet)
+
+    return results
+
+def calculate_missing_speeds(points: Sequence[speed_point]) -> Dict[int, float]:
+    """
+    Calculate speed values for points in a frame sorted flight where it is not present.
+    Returns a dict with the index of the point as key and the new speed in km/h (at most MAX_SPEED) as value.
+    """
+
+    updated_values: Dict[int, float] = {}
+    for i, point in enumerate(points):
+        if point[0] is not None: # Skip points that already have a speed value
+            continue
+
+        if i == 0: # First point
+            next_point = points[i+1]
+
+            lat1 = point[1]
+            lon1 = point[2]
+            lat2 = next_point[1]
+            lon2 = next_point[2]
+
+            time_diff = (next_point[3] - point[3]).total_seconds()
+        elif i == (len(points)-1): # Last point
+            prev_point = points[i-1]
+
+            lat1 = point[1]
+            lon1 = point[2]
+            lat2 = prev_point[1]
+            lon2 = prev_point[2]
+
+            time_diff = (point[3] - prev_point[3]).total_seconds()
+        else: # Other points
+            prev_point = points[i-1]
+            next_point = points[i+1]
+
+            lat1 = prev_point[1]
+            lon1 = prev_point[2]
+            lat2 = next_point[1]
+            lon2 = next_point[2]
+
+            time_diff = (next_point[3] - prev_point[3]).total_seconds()
+
+        # Calculate speed
+        distance = geopy.distance.geodesic((lat1, lon1), (lat2, lon2)).meters
+        speed = distance / time_diff * MS_TO_KMH
+
+        updated_values[i] = round(min(speed, MAX_SPEED), 1)
+
+    return updated_values
+
+def find_burst_index(altitudes: Sequence[int]) -> int | None:
+    """
+    Find the burst point in the frame sorted altitudes of a flight.
+    Returns the index of the burst point, or None if the flight doesn't have a burst point.
+    """
+
+    if len(altitudes) == 0:
+        return None
+
+    # Get maximum altitude
+    max_index = max(range(len(altitudes)), key=lambda i: altitudes[i])
+    max_altitude = altitudes[max_index]
+
+    # Ensure there are lower points before and after it to make sure it is actually a burst
+    has_previous = any(altitude < max_altitude for altitude in altitudes[:max_index])
+    has_next = any(altitude < max_altitude for altitude in altitudes[max_index+1:])
+
+    if has_previous and has_next:
+        return max_index
+    else:
+        return None
+
+station_type = Tuple[float, float] # latitude, longitude of the receiving station
+range_point = Tuple[int, int, int] # range in meters, bearing in degrees, altitude in meters
+
+def station_range(station: station_type, latitude: float, longitude: float) -> Tuple[float, float]:
+    """Get the distance in meters and the initial bearing in degrees from a station to a position"""
+
+    distance = geopy.distance.geodesic(station, (latitude, longitude)).meters
+
+    lat1, lat2 = math.radians(station[0]), math.radians(latitude)
+    lon_delta = math.radians(longitude - station[1])
+    bearing = math.degrees(math.atan2(math.sin(lon_delta) * math.cos(lat2),
+                                      math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon_delta)))
+
+    return distance, bearing % 360
+
+class RangeTracker():
+    """
+    Keep track of the range of a flight from the receiving station while its packets are added,
+    so range statistics don't need the tracking data of the flight afterwards
+    """
+
+    def __init__(self, station: station_type) -> None:
+        self.station = station
+
+        self.first: Optional[range_point] = None
+        self.last: Optional[range_point] = None
+        self.max: Optional[range_point] = None # Point furthest from the station
+
+    def add(self, packet: Packet):
+        """Add the next received packet of the flight"""
+
+        self.add_position(packet.latitude, packet.longitude, packet.altitude)
+
+    def add_position(self, latitude: float, longitude: float, altitude: int):
+        """Add the position of the next received packet of the flight"""
+
+        distance, bearing = station_range(self.station, float(latitude), float(longitude))
+        point = (round(distance), round(bearing) % 360, altitude)
+
+        if self.first is None:
+            self.first = point
+        self.last = point
+        if self.max is None or point[0] > self.max[0]:
+            self.max = point
+
+# Metrics derived from all points of a flight, stored in meta columns of the same name. Values are labels with units.
+DERIVED_METRICS = {
+    "ascent_rate": "Ascent rate (m/s)",
+    "descent_rate": "Descent rate (m/s)",
+    "max_speed": "Max. speed (km/h)",
+    "duration": "Duration (s)",
+    "min_temperature": "Min. temperature (°C)",
+    "tropopause_alt": "Tropopause (m)"
+}
+TROPOPAUSE_MIN_ALTITUDE = 5000 # Minimum altitude to look for the tropopause at, to skip inversions near the ground
+TROPOPAUSE_LAPSE_RATE = 2 # Maximum lapse rate in K/km at the tropopause (WMO definition)
+TROPOPAUSE_CHECK_DEPTH = 2000 # Meters above the tropopause in which the average lapse rate must stay below the limit
+
+metrics_point = Tuple[datetime, int, Optional[float], Optional[float]] # time, altitude, speed, temperature
+
+def _find_tropopause(points: Sequence[Tuple[int, float]]) -> int | None:
+    """
+    Internal function to find the tropopause altitude in the altitude sorted altitudes and temperatures of an ascent.
+    This is the lowest altitude at which the lapse rate drops to 2 K/km and stays there on average for 2km (WMO definition).
+    """
+
+    for i in range(len(points) - 1):
+        altitude, temperature = points[i]
+        if altitude < TROPOPAUSE_MIN_ALTITUDE:
+            continue
+
+        next_altitude, next_temperature = points[i+1]
+        if next_altitude <= altitude or (temperature - next_temperature) / (next_altitude - altitude) * 1000 > TROPOPAUSE_LAPSE_RATE:
+            continue
+
+        # Check average lapse rate to all points in the 2km above
+        j = i + 1
+        while j < len(points) and points[j][0] <= altitude + TROPOPAUSE_CHECK_DEPTH:
+            if (temperature - points[j][1]) / (points[j][0] - altitude) * 1000 > TROPOPAUSE_LAPSE_RATE:
+                break
+            j += 1
+        else:
+            if points[j-1][0] - altitude >= TROPOPAUSE_CHECK_DEPTH / 2: # Require enough data above
+                return altitude
+
+    return None
+
+def derive_metrics(points: Sequence[metrics_point]) -> Dict[str, float | None]:
+    """
+    Calculate the derived metrics (see DERIVED_METRICS) of a flight from its time sorted points in one pass.
+    Metrics that can't be calculated (like the descent rate of a flight without a burst) are None.
+    """
+
+    metrics: Dict[str, float | None] = {metric: None for metric in DERIVED_METRICS}
+    if len(points) == 0:
+        return metrics
+
+    # Collect highest point, maximum speed, minimum temperature and ascent temperatures in one pass
+    top_index = 0
+    max_speed = None
+    min_temperature = None
+    ascent_temperatures: List[Tuple[int, float]] = []
+    for i, (_, altitude, speed, temperature) in enumerate(points):
+        if altitude > points[top_index][1]:
+            top_index = i
+        if speed is not None and (max_speed is None or speed > max_speed):
+            max_speed = speed
+        if temperature is not None:
+            if min_temperature is None or temperature < min_temperature:
+                min_temperature = temperature
+            if top_index == i: # New highest point, still ascending
+                ascent_temperatures.append((altitude, temperature))
+
+    first_time, first_altitude = points[0][0], points[0][1]
+    top_time, top_altitude = points[top_index][0], points[top_index][1]
+    last_time, last_altitude = points[-1][0], points[-1][1]
+
+    metrics["duration"] = round((last_time - first_time).total_seconds())
+    metrics["max_speed"] = None if max_speed is None else min(max_speed, MAX_SPEED)
+    metrics["min_temperature"] = min_temperature
+
+    ascent_time = (top_time - first_time).total_seconds()
+    if ascent_time > 0 and top_altitude > first_altitude:
+        metrics["ascent_rate"] = round((top_altitude - first_altitude) / ascent_time, 1)
+
+    descent_time = (last_time - top_time).total_seconds()
+    if descent_time > 0 and top_altitude > last_altitude:
+        metrics["descent_rate"] = round((top_altitude - last_altitude) / descent_time, 1)
+
+    metrics["tropopause_alt"] = _find_tropopause(ascent_temperatures)
+
+    return metrics
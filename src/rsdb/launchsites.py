@@ -0,0 +1,120 @@
+import logging
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+
+def read_launchsites() -> List[Tuple[str, float, float]]:
+    """Read the launchsites file in the current directory and return list of name, lat and lon"""
+
+    if not os.path.isfile("launchsites.txt"):
+        logging.warning("Couldn't find launchsites.txt in current directory")
+        return []
+    
+    try:
+        with open("launchsites.txt", "r") as f:
+            lines = f.readlines()
+
+        results = []
+        for line in lines:
+            if len(line) < 5: # Skip empty/invalid lines
+                continue
+
+            line = line.strip().split(",")
+
+            name = line[0]
+            lat = float(line[1])
+            lon = float(line[2])
+
+            results.append((name, lat, lon))
+
+        return results
+    except Exception as e:
+        logging.error("Got exception while loading launchsites.txt: "+str(e))
+
+        return []
+
+EARTH_RADIUS = 6371008.8 # Mean earth radius in meters
+
+point_type = Tuple[float, float, float] # position on the unit sphere
+node_type = Tuple[point_type, int, int, Any, Any] # point, index of the launch site, split axis, lower and upper subtree
+
+def _unit_vector(latitude: float, longitude: float) -> point_type:
+    """Internal function to convert a position to a point on the unit sphere"""
+
+    lat, lon = math.radians(latitude), math.radians(longitude)
+
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+def _build_tree(points: List[Tuple[point_type, int]], depth: int = 0) -> node_type | None:
+    """Internal function to build a KD-tree of points with their launch site indices"""
+
+    if len(points) == 0:
+        return None
+
+    axis = depth % 3
+    points = sorted(points, key=lambda point: point[0][axis])
+    median = len(points) // 2
+
+    return (points[median][0], points[median][1], axis,
+            _build_tree(points[:median], depth + 1), _build_tree(points[median+1:], depth + 1))
+
+class LaunchsiteIndex():
+    """
+    Find the nearest launch site of a position. Launch sites are indexed in a KD-tree of their positions on the unit sphere,
+    where the straight line (chord) distance grows with the great circle distance, so the nearest point is the nearest site.
+    """
+
+    def __init__(self, launchsites: List[Tuple[str, float, float]], max_distance: float) -> None:
+        self.launchsites = launchsites
+        self.max_distance = max_distance # In meters
+
+        # Chord length of the maximum distance, for comparing with distances on the unit sphere
+        self._max_chord = 2 * math.sin(min(max_distance / EARTH_RADIUS, math.pi) / 2)
+        self._tree = _build_tree([(_unit_vector(lat, lon), i) for i, (_, lat, lon) in enumerate(launchsites)])
+
+    def nearest(self, latitude: float, longitude: float) -> Tuple[str, float] | None:
+        """Get the name and distance in meters of the nearest launch site, or None if there is none within the maximum distance"""
+
+        target = _unit_vector(float(latitude), float(longitude))
+        best: List[Any] = [None, self._max_chord ** 2] # Launch site index and squared chord distance of the nearest site so far
+
+        # Search subtree on the side of the target first, and the other side only if it could contain a nearer site
+        stack = [self._tree]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node is None:
+                continue
+
+            point, index, axis, lower, upper = node
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            if distance <= best[1]:
+                best = [index, distance]
+
+            difference = target[axis] - point[axis]
+            near, far = (lower, upper) if difference < 0 else (upper, lower)
+            if difference ** 2 <= best[1]:
+                stack.append(far)
+            stack.append(near)
+
+        if best[0] is None:
+            return None
+
+        chord = math.sqrt(best[1])
+        return self.launchsites[best[0]][0], 2 * EARTH_RADIUS * math.asin(min(chord / 2, 1))
+
+    def attribute(self, latitude: float, longitude: float) -> str | None:
+        """Get the name of the launch site a flight first received at a position was most likely launched from"""
+
+        result = self.nearest(latitude, longitude)
+
+        return None if result is None else result[0]
+
+def create_index(config: Dict[str, Any]) -> LaunchsiteIndex | None:
+    """Create a launch site index from launchsites.txt with the output of config.read_config() as the input. Returns None if there are no launch sites."""
+
+    launchsites = read_launchsites()
+    if len(launchsites) == 0:
+        return None
+
+    return LaunchsiteIndex(launchsites, config["launchsites"]["max_distance"] * 1000)
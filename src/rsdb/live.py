@@ -0,0 +1,198 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from .packet import Packet
+
+# Live data of currently tracked sondes is sent from the archiver (publisher) to subscribers (like the map)
+# as JSON datagrams over Unix sockets. Every subscriber binds its own socket in the socket directory,
+# and the publisher sends every update to all sockets in it. Messages are one of these events:
+# - reset: the publisher (re)started, all previous state should be dropped
+# - flight: full state of a flight with serial, sonde_type and trail (sent to new subscribers)
+# - point: new point with serial, sonde_type and point to add to the trail of a flight
+# - remove: the flight with serial is no longer tracked
+
+SOCKET_SUFFIX = ".sock"
+RESCAN_INTERVAL = 1 # Minimum seconds between checks for new subscribers
+MAX_MESSAGE_SIZE = 65536
+LISTENER_QUEUE_SIZE = 1000 # Maximum amount of messages queued for a listener, further messages are dropped
+
+live_point = Tuple[float, float, int, float] # latitude, longitude, altitude, unix time
+message_type = Dict[str, Any]
+
+def _packet_point(packet: Packet) -> live_point:
+    """Internal function to get the live point of a packet"""
+
+    assert packet.datetime is not None # should never fail
+
+    return packet.latitude, packet.longitude, packet.altitude, packet.datetime.timestamp()
+
+class LivePublisher():
+    """Publish live data of tracked sondes to all subscriber sockets in the socket directory"""
+
+    def __init__(self, socket_dir: str, trail_length: int) -> None:
+        self.socket_dir = socket_dir
+        self.trail_length = trail_length
+
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+        self._subscribers: List[str] = []
+        self._last_scan = 0.0
+        self._flights: Dict[str, Tuple[str, Deque[live_point]]] = {} # sonde type and trail by serial
+
+    def publish_packet(self, packet: Packet):
+        """Publish a new packet of a tracked sonde"""
+
+        flight = self._flights.get(packet.serial)
+        if flight is None:
+            flight = self._flights[packet.serial] = (packet.type or "", deque(maxlen=self.trail_length))
+
+        point = _packet_point(packet)
+        flight[1].append(point)
+        self._send({"event": "point", "serial": packet.serial, "sonde_type": flight[0], "point": point})
+
+    def publish_remove(self, serial: str):
+        """Publish that a sonde is no longer tracked"""
+
+        if self._flights.pop(serial, None) is not None:
+            self._send({"event": "remove", "serial": serial})
+
+    def poll(self):
+        """Check for new subscribers and send them the current state. Should be called regularly."""
+
+        if time.time() - self._last_scan < RESCAN_INTERVAL:
+            return
+        self._last_scan = time.time()
+
+        subscribers = [os.path.join(self.socket_dir, filename) for filename in os.listdir(self.socket_dir)
+                       if filename.endswith(SOCKET_SUFFIX)]
+        new_subscribers = [path for path in subscribers if path not in self._subscribers]
+        self._subscribers = subscribers
+
+        for path in new_subscribers:
+            logging.debug(f"Got new live data subscriber '{path}'")
+            self._send_to(path, {"event": "reset"})
+            for serial, (sonde_type, trail) in self._flights.items():
+                self._send_to(path, {"event": "flight", "serial": serial, "sonde_type": sonde_type, "trail": list(trail)})
+
+    def _send(self, message: message_type):
+        """Internal function to send a message to all subscribers"""
+
+        for path in list(self._subscribers):
+            self._send_to(path, message)
+
+    def _send_to(self, path: str, message: message_type):
+        """Internal function to send a message to a subscriber, removing it if it's gone"""
+
+        try:
+            self._socket.sendto(json.dumps(message).encode("utf-8"), path)
+        except (ConnectionRefusedError, FileNotFoundError): # Subscriber exited without removing its socket
+            logging.debug(f"Removing stale live data subscriber '{path}'")
+            if path in self._subscribers:
+                self._subscribers.remove(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        except BlockingIOError: # Subscriber isn't keeping up, drop message instead of blocking the archiver
+            logging.debug(f"Dropped live data message for subscriber '{path}'")
+
+    def close(self):
+        """Close the publisher socket"""
+
+        self._socket.close()
+
+class LiveSubscriber():
+    """
+    Receive live data of tracked sondes from the publisher, keep the current state
+    and pass all messages on to listeners (like connected browsers)
+    """
+
+    def __init__(self, socket_dir: str, name: str, trail_length: int) -> None:
+        self.trail_length = trail_length
+
+        # Bind own socket in socket directory, the publisher finds it there
+        os.makedirs(socket_dir, exist_ok=True)
+        self.path = os.path.join(socket_dir, f"{name}-{os.getpid()}{SOCKET_SUFFIX}")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        atexit.register(self.close)
+
+        self._flights: Dict[str, message_type] = {} # flight messages by serial
+        self._listeners: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+        threading.Thread(target=self._receive, name="live-subscriber", daemon=True).start()
+
+    def _receive(self):
+        """Internal function to receive messages from the publisher, running in a thread"""
+
+        while True:
+            try:
+                message = json.loads(self._socket.recv(MAX_MESSAGE_SIZE))
+            except OSError: # Socket was closed
+                return
+            except ValueError:
+                logging.warning("Received invalid live data message")
+                continue
+
+            with self._lock:
+                self._apply(message)
+                for listener in self._listeners:
+                    try:
+                        listener.put_nowait(message)
+                    except queue.Full:
+                        pass
+
+    def _apply(self, message: message_type):
+        """Internal function to update the current state with a message"""
+
+        event = message.get("event")
+        if event == "reset":
+            self._flights.clear()
+        elif event == "flight":
+            self._flights[message["serial"]] = message
+        elif event == "point":
+            flight = self._flights.setdefault(message["serial"], {
+                "event": "flight", "serial": message["serial"], "sonde_type": message["sonde_type"], "trail": []
+            })
+            flight["trail"] = (flight["trail"] + [message["point"]])[-self.trail_length:]
+        elif event == "remove":
+            self._flights.pop(message["serial"], None)
+
+    def listen(self) -> Tuple[queue.Queue, List[message_type]]:
+        """Register a listener. Returns a queue receiving all further messages and flight messages with the current state."""
+
+        listener: queue.Queue = queue.Queue(LISTENER_QUEUE_SIZE)
+        with self._lock:
+            self._listeners.append(listener)
+            snapshot = [dict(flight) for flight in self._flights.values()]
+
+        return listener, snapshot
+
+    def unlisten(self, listener: queue.Queue):
+        """Remove a listener registered with listen"""
+
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def close(self):
+        """Close the subscriber socket and remove it from the socket directory"""
+
+        self._socket.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -111,3 +111,30 @@ Temperature: {self.temperature}°C
         data_dict = json.loads(json_data)
 
         return self.from_dict(data_dict)
+
+    def normalize(self) -> Self:
+        """
+        Normalize serial and type to match sondehub's format.
+        Removes the type prefix from the serial and the suffix from the main type.
+        """
+
+        # Remove type prefix from serial
+        if self.serial[:3] == "DFM":
+            self.serial = self.serial[4:]
+        elif self.serial[:4] == "IMET":
+            self.serial = self.serial[5:]
+        elif self.serial[:3] == "M10":
+            self.serial = self.serial[4:]
+        elif self.serial[:3] == "M20":
+            self.serial = self.serial[4:]
+        # TODO: are there more of these?
+
+        # Remove suffix from main type
+        if self.type is not None: # theoretically shouldn't happen but who knows
+            if self.type[-4:] == "-SGP":
+                self.type = self.type[:-4]
+            elif self.type[-3:] == "-SG":
+                self.type = self.type[:-3]
+            # TODO: are there more of these?
+
+        return self
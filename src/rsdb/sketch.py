@@ -0,0 +1,138 @@
+import math
+from array import array
+from typing import List, Tuple
+
+DEFAULT_COMPRESSION = 100 # Higher values keep more centroids, making quantiles more accurate and sketches larger
+
+class TDigest():
+    """
+    A mergeable sketch of a distribution of values for estimating quantiles (merging t-digest).
+    Values are summarized in a bounded amount of weighted centroids, which are smaller near the tails
+    so extreme quantiles stay accurate. Sketches of parts of the data can be merged into one of all data.
+    """
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION) -> None:
+        self.compression = compression
+
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+        self._centroids: List[Tuple[float, float]] = [] # mean and weight, sorted by mean
+        self._buffer: List[Tuple[float, float]] = [] # Unmerged centroids
+
+    def __len__(self) -> int:
+        return len(self._centroids) + len(self._buffer)
+
+    def add(self, value: float, weight: float = 1):
+        """Add a value to the sketch"""
+
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if len(self._buffer) > self.compression * 5:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        """Add all values of another sketch to this one"""
+
+        self._buffer.extend(other._centroids)
+        self._buffer.extend(other._buffer)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        self._compress()
+
+    def _k(self, q: float) -> float:
+        """Internal function for the scale function, mapping a quantile to the centroid index space"""
+
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _k_inverse(self, k: float) -> float:
+        """Internal function for the inverse of the scale function"""
+
+        return (math.sin(min(k * 2 * math.pi / self.compression, math.pi / 2)) + 1) / 2
+
+    def _compress(self):
+        """Internal function to merge buffered values into the centroids"""
+
+        if len(self._buffer) == 0:
+            return
+
+        centroids = sorted(self._centroids + self._buffer)
+        self._buffer = []
+
+        # Merge neighboring centroids as long as they stay within the size limit for their quantile
+        merged = []
+        q_start = 0.0
+        q_limit = self._k_inverse(self._k(q_start) + 1)
+        mean, weight = centroids[0]
+        for next_mean, next_weight in centroids[1:]:
+            if q_start + (weight + next_weight) / self.count <= q_limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged.append((mean, weight))
+                q_start += weight / self.count
+                q_limit = self._k_inverse(self._k(q_start) + 1)
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+
+        self._centroids = merged
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate the value at a quantile between 0 and 1. Returns None if the sketch is empty."""
+
+        self._compress()
+        if len(self._centroids) == 0:
+            return None
+        elif len(self._centroids) == 1:
+            return self._centroids[0][0]
+
+        # Interpolate between the centers of the centroids around the target rank, and the extremes at the ends
+        target = q * self.count
+        first_mean, first_weight = self._centroids[0]
+        if target < first_weight / 2:
+            return self.min + (first_mean - self.min) * target / (first_weight / 2)
+
+        cumulative = 0.0
+        for (mean, weight), (next_mean, next_weight) in zip(self._centroids, self._centroids[1:]):
+            center = cumulative + weight / 2
+            next_center = cumulative + weight + next_weight / 2
+            if target < next_center:
+                return mean + (next_mean - mean) * (target - center) / (next_center - center)
+            cumulative += weight
+
+        last_mean, last_weight = self._centroids[-1]
+        remaining = self.count - target
+
+        return self.max - (self.max - last_mean) * remaining / (last_weight / 2)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the sketch for storing in the database"""
+
+        self._compress()
+        data = array("d", [self.compression, self.min, self.max])
+        for mean, weight in self._centroids:
+            data.append(mean)
+            data.append(weight)
+
+        return data.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TDigest":
+        """Deserialize a sketch serialized with to_bytes"""
+
+        values = array("d")
+        values.frombytes(data)
+
+        sketch = cls(values[0])
+        sketch.min = values[1]
+        sketch.max = values[2]
+        sketch._centroids = list(zip(values[3::2], values[4::2]))
+        sketch.count = sum(weight for _, weight in sketch._centroids)
+
+        return sketch
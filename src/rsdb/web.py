@@ -1,26 +1,34 @@
 import logging
 import os
 import re
+import threading
 import traceback
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Callable, Dict
 
-import mariadb
+import flask
 from dash import Dash, html
 
+from . import database
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
 COLORS = {
     "background": "#121214",
     "text": "#ffffff"
 }
 
 class WebApp(ABC):
-    def __init__(self, app_name: str, config: Dict[str, Any], db_conn: mariadb.Connection) -> None:
+    def __init__(self, app_name: str, config: Dict[str, Any], db_pool: database.ProcessPool) -> None:
         logging.info("Initializing "+app_name)
 
         self._app_name = app_name
 
         self.port = config["port"]
-        self.db_conn = db_conn
+        self.db_pool = db_pool
 
         # Get assets path
         assets_base_path = os.path.join(os.getcwd(), "./assets/")
@@ -39,13 +47,44 @@ class WebApp(ABC):
         self.app.title = "RSDB "+app_name.capitalize()
         self.app.logger = logging.getLogger()
 
+        # Background threads are started in the process serving requests, which is a forked worker with wsgi_app
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self.app.server.before_request(self._ensure_started)
+
+    def start(self):
+        """Start background threads and open sockets needed to serve requests. Called once in every process serving requests."""
+
+        pass
+
+    def _ensure_started(self):
+        """Internal function to call start once per process, before the first request it handles"""
+
+        if self._started_pid != os.getpid():
+            with self._start_lock:
+                if self._started_pid != os.getpid():
+                    self.start()
+                    self._started_pid = os.getpid()
+
+    def wsgi_app(self) -> flask.Flask:
+        """
+        Get the WSGI app for serving with multiple worker processes (see serve).
+        The app can be initialized once before forking, so expensive setup (like cached figures) is shared by all workers.
+        Connections of this process are closed, every worker connects with its own pool and starts its own threads.
+        """
+
+        self.db_pool.close()
+
+        return self.app.server
+
     def run(self):
-        """Run the website"""
+        """Run the website with the development server of Dash in a single process"""
 
         logging.info("Running "+self._app_name)
-        
+
         # Run dash app
         try:
+            self._ensure_started()
             self.app.run(host="0.0.0.0", port=self.port)
         except KeyboardInterrupt:
             logging.info("Caught KeyboardInterrupt, shutting down")
@@ -53,7 +92,30 @@ class WebApp(ABC):
             logging.error(f"Got exception while running {self._app_name}: {e}")
             logging.info(traceback.format_exc())
         finally:
-            # Close database connection
-            if self.db_conn:
-                self.db_conn.close()
+            # Close database connections
+            self.db_pool.close()
+
+def serve(app_name: str, create_function: Callable[[], flask.Flask], config: Dict[str, Any]):
+    """
+    Serve a web app with gunicorn, using the workers and threads from its config section.
+    The app is created once with create_function before forking the worker processes.
+    """
+
+    if BaseApplication is None:
+        logging.error("Failed to import gunicorn. To serve with multiple worker processes, run pip install with [serve]")
+        exit(1)
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"0.0.0.0:{config['port']}")
+            self.cfg.set("workers", config["workers"])
+            self.cfg.set("threads", config["threads"])
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("preload_app", True)
+            self.cfg.set("proc_name", app_name)
+
+        def load(self) -> flask.Flask:
+            return create_function()
 
+    logging.info(f"Serving {app_name} with {config['workers']} worker processes of {config['threads']} threads each")
+    _Application().run()